@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from generate_data import ADMIN_PASSWORD, ADMIN_USERNAME, STAFF_PASSWORD, generate
+from startup_benchmark import REPO_ROOT, make_sandbox
+
+sys.path.insert(0, REPO_ROOT)
+
+from hr_store import (
+    LEAVE_REQUESTS_FILE, OPEX_CAPEX_REQUESTS_FILE, PAYROLL_FILE, USERS_FILE, import_payroll_file, load_json,
+    write_json_atomic
+)
+
+# Benchmark suite for the HR store and pages.
+# Generates synthetic data (see generate_data.py) into a sandbox copy of the
+# repo, then times storage operations in-process and page renders through
+# Streamlit's AppTest in fresh interpreters. Results are written as JSON and
+# can be compared against a saved baseline to catch regressions.
+#
+# Usage:
+#   python benchmarks/benchmark_suite.py                          # compare with benchmarks/baseline.json
+#   python benchmarks/benchmark_suite.py --scale 1 --runs 5       # production-sized data
+#   python benchmarks/benchmark_suite.py --save-baseline          # record a new baseline
+#   python benchmarks/benchmark_suite.py --only load_ --only payslip
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PAYSLIPS_PER_RUN = 50
+
+APPTEST_SCRIPT = r"""
+import json, os, sys, time
+from streamlit.testing.v1 import AppTest
+app_path, admin_username, admin_password, staff_username, staff_password = sys.argv[1:6]
+timings = {}
+
+def timed(name, action):
+    started = time.perf_counter()
+    result = action()
+    timings[name] = time.perf_counter() - started
+    assert not result.exception, [str(e.value) for e in result.exception]
+    return result
+
+def login(at, username, password):
+    at.text_input(key="login_username_input").input(username)
+    at.text_input(key="login_password_input").input(password)
+    return at.button(key="login_button").click()
+
+def goto(at, page):
+    at.session_state.current_page = page
+    return at
+
+at = AppTest.from_file(app_path, default_timeout=600)
+timed("apptest_login_page", at.run)
+timed("apptest_login_to_dashboard", lambda: login(at, admin_username, admin_password).run())
+timed("apptest_dashboard_rerun", at.run)
+timed("apptest_leave_applications_page", lambda: goto(at, "view_leave_applications").run())
+review = next(box for box in at.selectbox if box.label == "Select Leave Request to Review")
+if len(review.options) > 1:
+    timed("apptest_open_leave_review", lambda: review.select(review.options[1]).run())
+    request_id = review.options[1].split(" - ")[0].replace("ID: ", "")
+    timed("apptest_approve_leave", lambda: at.button(key=f"approve_{request_id}").click().run())
+
+staff = AppTest.from_file(app_path, default_timeout=600)
+staff.run()
+timed("apptest_staff_login_to_dashboard", lambda: login(staff, staff_username, staff_password).run())
+timed("apptest_staff_leave_form", lambda: goto(staff, "leave_request").run())
+print(json.dumps(timings))
+"""
+
+def measure(action, runs, setup=None):
+    durations = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        action()
+        durations.append(time.perf_counter() - started)
+    return summarise(durations)
+
+def summarise(durations):
+    return {"median_s": statistics.median(durations), "min_s": min(durations), "max_s": max(durations), "runs": len(durations)}
+
+def storage_benchmarks(runs):
+    results = {}
+    for name, filename in (("users", USERS_FILE), ("leave_requests", LEAVE_REQUESTS_FILE),
+                           ("opex_capex_requests", OPEX_CAPEX_REQUESTS_FILE), ("payroll", PAYROLL_FILE)):
+        results[f"load_{name}"] = measure(lambda: load_json(filename, []), runs)
+    leave_requests = load_json(LEAVE_REQUESTS_FILE, [])
+    results["save_leave_requests"] = measure(lambda: write_json_atomic(leave_requests, LEAVE_REQUESTS_FILE), runs)
+
+    # One month of payslips for every staff member, replacing the latest month on file
+    payroll = load_json(PAYROLL_FILE, [])
+    if payroll:
+        latest = max((rec['year'], rec['month']) for rec in payroll)
+        month_rows = [{key: rec[key] for key in ('staff_id', 'month', 'year', 'basic_salary', 'allowances', 'deductions', 'net_pay')}
+                      for rec in payroll if (rec['year'], rec['month']) == latest]
+        results["payroll_ingest_month"] = measure(lambda: import_payroll_file(month_rows), runs)
+    return results
+
+def payslip_benchmarks(runs):
+    from hr_payslips import generate_payslip_pdf
+    payroll = load_json(PAYROLL_FILE, [])[:PAYSLIPS_PER_RUN]
+    profiles = {user['staff_id']: user['profile'] for user in load_json(USERS_FILE, [])}
+    if not payroll:
+        return {}
+    render_all = lambda: [generate_payslip_pdf(rec, profiles.get(rec['staff_id'], {}), rec['staff_id']) for rec in payroll]
+    return {f"payslip_pdf_x{len(payroll)}": measure(render_all, runs)}
+
+def apptest_benchmarks(sandbox, runs, staff_username):
+    trials = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", APPTEST_SCRIPT, os.path.join(sandbox, "hr_app.py"),
+             ADMIN_USERNAME, ADMIN_PASSWORD, staff_username, STAFF_PASSWORD],
+            cwd=sandbox, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"AppTest run failed:\n{completed.stderr[-2000:]}")
+        trials.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {name: summarise([trial[name] for trial in trials if name in trial]) for name in trials[0]}
+
+def compare(results, baseline, tolerance):
+    # Prints current vs baseline medians and returns the names that got slower than tolerance allows
+    if baseline.get("counts") != results.get("counts"):
+        print(f"note: baseline was recorded with different data sizes ({baseline.get('counts')})")
+    regressions = []
+    print(f"\n{'benchmark':<36} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            print(f"{name:<36} {'-':>12} {current['median_s'] * 1000:10.1f}ms {'new':>9}")
+            continue
+        ratio = current['median_s'] / previous['median_s'] if previous['median_s'] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<36} {previous['median_s'] * 1000:10.1f}ms {current['median_s'] * 1000:10.1f}ms {ratio - 1:+8.0%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hr_store operations and app pages on synthetic data")
+    parser.add_argument("--scale", type=float, default=0.02, help="Data scale passed to generate_data (1.0 = 10k users, 500k leave requests)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--only", action="append", help="Only run benchmarks whose name starts with this prefix (repeatable)")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results to --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a benchmark counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any benchmark regressed")
+    args = parser.parse_args()
+
+    sandbox, _ = make_sandbox(None)
+    original_cwd = os.getcwd()
+    try:
+        counts = generate(os.path.join(sandbox, "hr_data"), scale=args.scale, seed=args.seed)
+        os.chdir(sandbox) # Data paths in hr_store are relative to the app directory
+        wanted = lambda name: not args.only or any(name.startswith(prefix) for prefix in args.only)
+
+        results = {}
+        if any(wanted(name) for name in ("load_", "save_", "payroll_")):
+            results.update(storage_benchmarks(args.runs))
+        if wanted("payslip_"):
+            results.update(payslip_benchmarks(args.runs))
+        if wanted("apptest_"):
+            results.update(apptest_benchmarks(sandbox, args.runs, staff_username="staff00001"))
+        results = {name: result for name, result in results.items() if wanted(name)}
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    report = {
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale,
+        "counts": counts,
+        "results": results,
+    }
+    for name, result in results.items():
+        print(f"{name:<36} median {result['median_s'] * 1000:10.1f} ms  (min {result['min_s'] * 1000:.1f}, max {result['max_s'] * 1000:.1f})")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
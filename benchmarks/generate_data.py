@@ -0,0 +1,195 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from passlib.hash import pbkdf2_sha256
+
+from hr_analytics import OPEX_APPROVAL_STEPS, working_days
+from hr_store import new_staff_record, requisition_final_status, write_json_atomic
+
+# Synthetic hr_data generator for benchmarks and load tests.
+# Writes users, leave requests, OPEX/CAPEX requisitions and monthly payroll in
+# the same shape the app writes them. The defaults are production-like; --scale
+# shrinks every count for quick runs. All staff share the password "123456" and
+# the admin logs in as admin@example.com / admin123.
+#
+# Usage:
+#   python benchmarks/generate_data.py --output /tmp/hr_big/hr_data
+#   python benchmarks/generate_data.py --output /tmp/hr_small/hr_data --scale 0.01 --seed 1
+
+DEFAULT_USERS = 10_000
+DEFAULT_LEAVE_REQUESTS = 500_000
+DEFAULT_REQUISITIONS = 200_000
+DEFAULT_PAYROLL_YEARS = 5
+
+ADMIN_USERNAME = "admin@example.com"
+ADMIN_PASSWORD = "admin123"
+STAFF_PASSWORD = "123456"
+
+DEPARTMENTS = ["Admin", "HR", "Finance", "IT", "Marketing", "Operations", "Sales", "Executive"]
+GRADE_LEVELS = ["Officer"] * 6 + ["Senior Officer"] * 3 + ["Manager"] * 2 + ["MD"]
+LEAVE_TYPES = ["Annual Leave"] * 6 + ["Sick Leave"] * 2 + ["Maternity Leave", "Paternity Leave", "Compassionate Leave", "Study Leave", "Other"]
+FIRST_NAMES = ["Ada", "Udu", "Abdulahi", "Chidi", "Ngozi", "Tunde", "Bola", "Emeka", "Funmi", "Kemi", "Yusuf", "Zainab", "Ife", "Obinna", "Sade", "Musa"]
+LAST_NAMES = ["Ama", "Aka", "Ibrahim", "Okafor", "Adeyemi", "Bello", "Eze", "Balogun", "Okoro", "Lawal", "Nwosu", "Danjuma", "Olawale", "Usman"]
+
+def generate_users(rng, count, today):
+    # Password hashing is slow by design, so every account shares one precomputed hash
+    staff_hash = pbkdf2_sha256.hash(STAFF_PASSWORD)
+    admin = new_staff_record("Benchmark Admin", ADMIN_USERNAME, "ADM/0000", pbkdf2_sha256.hash(ADMIN_PASSWORD),
+                             department="Admin", grade_level="MD")
+    admin['role'] = "admin"
+    users = [admin]
+    for number in range(1, count):
+        joined = today - timedelta(days=rng.randint(0, 15 * 365))
+        users.append(new_staff_record(
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {number}",
+            f"staff{number:05d}",
+            f"POL/{joined.year}/{number:05d}",
+            staff_hash,
+            department=rng.choice(DEPARTMENTS),
+            grade_level=rng.choice(GRADE_LEVELS),
+            gender=rng.choice(["Male", "Female"]),
+            date_of_birth=str(date(rng.randint(1960, 2003), rng.randint(1, 12), rng.randint(1, 28))),
+            work_anniversary=str(joined),
+        ))
+    return users
+
+def generate_leave_requests(rng, users, count, today):
+    staff = users[1:]
+    requests = []
+    for request_id in range(1, count + 1):
+        user = rng.choice(staff)
+        start_date = today + timedelta(days=rng.randint(-3 * 365, 120))
+        end_date = start_date + timedelta(days=rng.choice([0, 1, 2, 4, 4, 6, 9, 13]))
+        submitted = start_date - timedelta(days=rng.randint(1, 30))
+        if start_date > today:
+            status = rng.choices(["Pending", "Approved", "Rejected"], weights=[6, 3, 1])[0]
+        else:
+            status = rng.choices(["Approved", "Rejected", "Pending"], weights=[85, 10, 5])[0]
+        requests.append({
+            "request_id": request_id,
+            "staff_id": user['staff_id'],
+            "staff_name": user['profile']['name'],
+            "leave_type": rng.choice(LEAVE_TYPES),
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+            "num_days": working_days(start_date, end_date),
+            "reason": "Synthetic benchmark request",
+            "document_path": None,
+            "submission_date": str(submitted),
+            "status": status,
+        })
+    return requests
+
+def generate_requisitions(rng, users, count, today):
+    staff = users[1:]
+    approvers_by_department = {}
+    for user in staff:
+        approvers_by_department.setdefault(user['profile']['department'], []).append(user['profile']['name'])
+    approver_departments = {"admin_manager_approver": "Admin", "hr_manager_approver": "HR",
+                            "finance_manager_approver": "Finance", "md_approver": "Executive"}
+    requisitions = []
+    for req_id in range(1, count + 1):
+        user = rng.choice(staff)
+        quantity = rng.randint(1, 20)
+        unit_price = round(rng.uniform(1_000, 500_000), 2)
+        requisition = {
+            "req_id": req_id,
+            "requester_staff_id": user['staff_id'],
+            "requester_name": user['profile']['name'],
+            "request_type": rng.choice(["OPEX (Operational Expenditure)", "CAPEX (Capital Expenditure)"]),
+            "item_description": "Synthetic benchmark item",
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total_amount": round(quantity * unit_price, 2),
+            "justification": "Synthetic benchmark requisition",
+            "submission_date": str(today - timedelta(days=rng.randint(0, 3 * 365))),
+        }
+        # Approvals happen in order; a requisition stops at its first pending or rejected step
+        # Step statuses use the app's values ("Approve"/"Pending"/"Reject")
+        for approver_field, status_field in OPEX_APPROVAL_STEPS:
+            candidates = approvers_by_department.get(approver_departments[approver_field]) or ["N/A"]
+            requisition[approver_field] = rng.choice(candidates)
+        step_status = "Approve"
+        for approver_field, status_field in OPEX_APPROVAL_STEPS:
+            if step_status != "Approve":
+                requisition[status_field] = "Pending"
+                continue
+            step_status = rng.choices(["Approve", "Pending", "Reject"], weights=[80, 15, 5])[0]
+            requisition[status_field] = step_status
+        requisition["final_status"] = requisition_final_status(requisition)
+        requisitions.append(requisition)
+    return requisitions
+
+def generate_payroll(rng, users, years, today):
+    payroll = []
+    periods = [(year, month) for year in range(today.year - years, today.year) for month in range(1, 13)]
+    for user in users[1:]:
+        basic_salary = round(rng.uniform(150_000, 2_000_000), -3)
+        for year, month in periods:
+            allowances = round(basic_salary * 0.25, 2)
+            deductions = round(basic_salary * rng.uniform(0.08, 0.2), 2)
+            payroll.append({
+                "payslip_id": len(payroll) + 1,
+                "staff_id": user['staff_id'],
+                "month": month,
+                "year": year,
+                "basic_salary": basic_salary,
+                "allowances": allowances,
+                "deductions": deductions,
+                "net_pay": round(basic_salary + allowances - deductions, 2),
+                "generated_date": str(date(year, month, 28)),
+            })
+    return payroll
+
+def generate(output_dir, scale=1.0, seed=42, users=None, leave_requests=None, requisitions=None, payroll_years=None,
+             today=None, verbose=False):
+    # Writes the data files into output_dir and returns {filename: record count}
+    rng = random.Random(seed)
+    today = today or date.today()
+    counts = {
+        "users": users or max(2, int(DEFAULT_USERS * scale)),
+        "leave": leave_requests if leave_requests is not None else int(DEFAULT_LEAVE_REQUESTS * scale),
+        "opex": requisitions if requisitions is not None else int(DEFAULT_REQUISITIONS * scale),
+        "payroll_years": payroll_years if payroll_years is not None else DEFAULT_PAYROLL_YEARS,
+    }
+    datasets = {}
+    datasets["users.json"] = generate_users(rng, counts["users"], today)
+    datasets["leave_requests.json"] = generate_leave_requests(rng, datasets["users.json"], counts["leave"], today)
+    datasets["opex_capex_requests.json"] = generate_requisitions(rng, datasets["users.json"], counts["opex"], today)
+    datasets["payroll.json"] = generate_payroll(rng, datasets["users.json"], counts["payroll_years"], today)
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = {}
+    for filename, records in datasets.items():
+        started = time.perf_counter()
+        write_json_atomic(records, os.path.join(output_dir, filename))
+        written[filename] = len(records)
+        if verbose:
+            size_mb = os.path.getsize(os.path.join(output_dir, filename)) / 1024 / 1024
+            print(f"{filename:<26} {len(records):>9,} records  {size_mb:8.1f} MB  ({time.perf_counter() - started:.1f} s)")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic hr_data at configurable scale")
+    parser.add_argument("--output", required=True, help="hr_data directory to write (existing files are replaced)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for the default counts (1.0 = 10k users)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, help=f"Number of users including the admin (default {DEFAULT_USERS:,} x scale)")
+    parser.add_argument("--leave-requests", type=int, help=f"Default {DEFAULT_LEAVE_REQUESTS:,} x scale")
+    parser.add_argument("--requisitions", type=int, help=f"Default {DEFAULT_REQUISITIONS:,} x scale")
+    parser.add_argument("--payroll-years", type=int, help=f"Years of monthly payroll per staff member (default {DEFAULT_PAYROLL_YEARS})")
+    args = parser.parse_args()
+
+    generate(args.output, scale=args.scale, seed=args.seed, users=args.users, leave_requests=args.leave_requests,
+             requisitions=args.requisitions, payroll_years=args.payroll_years, verbose=True)
+    print(f"Admin login: {ADMIN_USERNAME} / {ADMIN_PASSWORD}; staff: staff00001 ... / {STAFF_PASSWORD}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from websockets.sync.client import connect
+
+from generate_data import ADMIN_PASSWORD, ADMIN_USERNAME, STAFF_PASSWORD, generate
+from startup_benchmark import REPO_ROOT, make_sandbox
+
+sys.path.insert(0, REPO_ROOT)
+
+from hr_store import LEAVE_REQUESTS_FILE, OPEX_CAPEX_REQUESTS_FILE, USERS_FILE, load_json, write_json_atomic
+
+# Concurrent-session load test for hr_app.py.
+# Starts one or more `streamlit run` workers on a generated data set and drives
+# them with headless websocket clients speaking Streamlit's browser protocol,
+# so every virtual user is a real server session. (AppTest cannot be used for
+# this: it swaps a process-wide Runtime on every run, so concurrent AppTest
+# sessions in one process break each other.) Staff sessions log in, open the
+# dashboard and apply for leave; approver sessions log in as the admin and
+# approve OPEX/CAPEX requisitions. Workers share the sandbox's hr_data, as
+# replicas behind a load balancer would. Reports page latency percentiles,
+# CPU and RSS per worker, and updates that were acknowledged on screen but
+# are missing from the JSON files afterwards (lost updates).
+#
+# Needs the benchmark requirements: pip install -r benchmarks/requirements.txt
+#
+# Usage:
+#   python benchmarks/load_test.py --users 10 --approvers 2 --iterations 3
+#   python benchmarks/load_test.py --users 25 --workers 2 --scale 0.1 --output load.json
+
+LEAVE_MARKER = "load-test"
+SERVER_START_TIMEOUT_S = 60
+RERUN_TIMEOUT_S = 300
+
+class LoadTestResults:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {} # action -> [seconds]
+        self.errors = []
+        self.acknowledged_leave = set() # reasons of leave requests the UI reported as submitted
+        self.acknowledged_approvals = set() # req_ids the UI reported as actioned
+
+    def record(self, action, seconds):
+        with self._lock:
+            self.latencies.setdefault(action, []).append(seconds)
+
+    def error(self, session, message):
+        with self._lock:
+            self.errors.append(f"{session}: {message}")
+
+    def acknowledge(self, collection, item):
+        with self._lock:
+            collection.add(item)
+
+def percentile(values, pct):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+# --- Workers ---
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+class Worker:
+    # One `streamlit run hr_app.py` server process
+    def __init__(self, sandbox, app_path):
+        self.port = _free_port()
+        self.log = open(os.path.join(sandbox, f"worker_{self.port}.log"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", app_path, "--server.headless", "true",
+             "--server.port", str(self.port), "--server.fileWatcherType", "none",
+             "--browser.gatherUsageStats", "false"],
+            cwd=sandbox, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        self.rss_samples = []
+
+    @property
+    def url(self):
+        return f"ws://localhost:{self.port}/_stcore/stream"
+
+    def wait_until_ready(self):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT_S
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"worker on port {self.port} exited with code {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://localhost:{self.port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"worker on port {self.port} did not become healthy")
+
+    def cpu_seconds(self):
+        # utime + stime of the server process, from /proc (Linux only)
+        with open(f"/proc/{self.process.pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def memory_kb(self, field):
+        with open(f"/proc/{self.process.pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+        return None
+
+    def sample_rss(self):
+        try:
+            rss = self.memory_kb("VmRSS")
+        except OSError:
+            return
+        if rss:
+            self.rss_samples.append(rss)
+
+    def warm_up(self):
+        # One session renders the login page so module imports and caches are
+        # loaded before the concurrent sessions arrive
+        with open_connection(self.url) as connection:
+            PortalSession(connection, f"warm-up :{self.port}", LoadTestResults()).rerun("warm_up")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+class ResourceSampler(threading.Thread):
+    # Samples every worker's resident set size while the test runs
+    def __init__(self, workers, interval=0.25):
+        super().__init__(daemon=True)
+        self.workers = workers
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for worker in self.workers:
+                worker.sample_rss()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+# --- Headless browser session ---
+def open_connection(url):
+    return connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=SERVER_START_TIMEOUT_S)
+
+class PortalSession:
+    # Speaks enough of Streamlit's websocket protocol to fill in widgets and
+    # click buttons: each rerun sends the widget states a browser would hold
+    # and reads deltas until the script finishes.
+
+    def __init__(self, connection, name, results):
+        self.connection = connection
+        self.name = name
+        self.results = results
+        self.widgets = {} # widget id -> (element type, element proto) from the last rerun
+        self.values = {} # widget id -> (value field, value) set by this client
+        self.alerts = [] # (format, body) shown during the last rerun
+        self.exceptions = []
+
+    def find(self, element_type, label=None, key=None):
+        for widget_id, (widget_type, proto) in self.widgets.items():
+            if widget_type != element_type:
+                continue
+            if key is not None and widget_id.endswith(f"-{key}"):
+                return widget_id, proto
+            if label is not None and proto.label == label:
+                return widget_id, proto
+        raise LookupError(f"{element_type} {label or key!r} not on screen")
+
+    def set_text(self, element_type, value, label=None, key=None):
+        widget_id, _ = self.find(element_type, label=label, key=key)
+        self.values[widget_id] = ("string_value", value)
+
+    def set_option(self, element_type, label, predicate):
+        # Selectbox/radio values travel as the formatted option string
+        widget_id, proto = self.find(element_type, label=label)
+        option = next((option for option in proto.options if predicate(option)), None)
+        if option is None:
+            return None
+        self.values[widget_id] = ("string_value", option)
+        return option
+
+    def set_date(self, label, value):
+        widget_id, _ = self.find("date_input", label=label)
+        self.values[widget_id] = ("string_array_value", [value.isoformat()])
+
+    def alert_bodies(self, alert_format):
+        return [body for fmt, body in self.alerts if fmt == alert_format]
+
+    def rerun(self, action, trigger_id=None):
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.query_string = ""
+        client_state.page_script_hash = ""
+        for widget_id, (field, value) in self.values.items():
+            state = client_state.widget_states.widgets.add()
+            state.id = widget_id
+            if field == "string_array_value":
+                state.string_array_value.data.extend(value)
+            else:
+                setattr(state, field, value)
+        if trigger_id:
+            state = client_state.widget_states.widgets.add()
+            state.id = trigger_id
+            state.trigger_value = True
+
+        started = time.perf_counter()
+        self.connection.send(message.SerializeToString())
+        widgets, self.alerts, self.exceptions = {}, [], []
+        while True:
+            forward_msg = ForwardMsg()
+            forward_msg.ParseFromString(self.connection.recv(timeout=RERUN_TIMEOUT_S))
+            kind = forward_msg.WhichOneof("type")
+            if kind == "new_session":
+                widgets = {} # st.rerun() restarts the page
+            elif kind == "delta" and forward_msg.delta.WhichOneof("type") == "new_element":
+                element = forward_msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                proto = getattr(element, element_type)
+                if element_type == "alert":
+                    self.alerts.append((proto.format, proto.body))
+                elif element_type == "exception":
+                    self.exceptions.append(proto.message)
+                elif getattr(proto, "id", "").startswith("$$ID-"):
+                    widgets[proto.id] = (element_type, proto)
+            elif kind == "script_finished" and forward_msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+        self.results.record(action, time.perf_counter() - started)
+
+        self.widgets = widgets
+        self.values = {widget_id: value for widget_id, value in self.values.items() if widget_id in widgets}
+        if self.exceptions:
+            self.results.error(self.name, f"{action}: {self.exceptions}")
+
+    def click(self, action, element_type="button", label=None, key=None):
+        widget_id, _ = self.find(element_type, label=label, key=key)
+        self.rerun(action, trigger_id=widget_id)
+
+    def login(self, username, password):
+        self.rerun("login_page")
+        self.set_text("text_input", username, key="login_username_input")
+        self.set_text("text_input", password, key="login_password_input")
+        self.click("login_to_dashboard", key="login_button")
+
+def staff_session(url, username, user_number, iterations, think_time, results):
+    try:
+        with open_connection(url) as connection:
+            session = PortalSession(connection, username, results)
+            session.login(username, STAFF_PASSWORD)
+            for iteration in range(iterations):
+                session.click("dashboard", key="nav_dashboard")
+                session.click("leave_form", key="nav_apply_leave")
+                # Non-overlapping dates per user and iteration; "Other" leave has no balance cap
+                start_date = date.today() + timedelta(days=400 + (user_number * iterations + iteration) * 7)
+                reason = f"{LEAVE_MARKER} {username} #{iteration}"
+                session.set_option("selectbox", "Leave Type", lambda option: option == "Other")
+                session.set_date("Start Date", start_date)
+                session.set_date("End Date", start_date + timedelta(days=2))
+                session.set_text("text_area", reason, label="Reason for Leave")
+                session.click("submit_leave", "button", label="Submit Leave Request")
+                if any("submitted successfully" in body for body in session.alert_bodies(Alert.SUCCESS)):
+                    results.acknowledge(results.acknowledged_leave, reason)
+                else:
+                    results.error(username, f"leave not acknowledged: {session.alert_bodies(Alert.ERROR)}")
+                time.sleep(think_time)
+    except Exception as error:
+        results.error(username, repr(error))
+
+def approver_session(url, approver_number, req_ids, think_time, results):
+    session_name = f"approver{approver_number}"
+    try:
+        with open_connection(url) as connection:
+            session = PortalSession(connection, session_name, results)
+            session.login(ADMIN_USERNAME, ADMIN_PASSWORD)
+            for req_id in req_ids:
+                session.click("approvals_page", key="admin_manage_approvals")
+                option = session.set_option("selectbox", "Select Request to Review", lambda option: option.startswith(f"ID: {req_id} - "))
+                if option is None:
+                    results.error(session_name, f"requisition {req_id} not offered for approval")
+                    continue
+                session.rerun("open_requisition")
+                session.click("approve_requisition", key=f"submit_action_{req_id}")
+                if session.alert_bodies(Alert.ERROR):
+                    results.error(session_name, f"approval of {req_id} failed: {session.alert_bodies(Alert.ERROR)}")
+                else:
+                    results.acknowledge(results.acknowledged_approvals, req_id)
+                time.sleep(think_time)
+    except Exception as error:
+        results.error(session_name, repr(error))
+
+# --- Data set up and verification ---
+def assign_requisitions_to_admin(count_per_approver, approvers):
+    # The approvals page only lets the admin act on steps naming them as approver,
+    # so hand the admin-manager step of some pending requisitions to the admin
+    users = load_json(USERS_FILE, [])
+    admin_name = next(user['profile']['name'] for user in users if user['username'] == ADMIN_USERNAME)
+    requisitions = load_json(OPEX_CAPEX_REQUESTS_FILE, [])
+    pending = [req for req in requisitions if req.get('final_status') == 'Pending' and req.get('status_admin_manager') == 'Pending']
+    chosen = pending[:count_per_approver * approvers]
+    for req in chosen:
+        req['admin_manager_approver'] = admin_name
+    write_json_atomic(requisitions, OPEX_CAPEX_REQUESTS_FILE)
+    req_ids = [req['req_id'] for req in chosen]
+    return [req_ids[i::approvers] for i in range(approvers)]
+
+def count_lost_updates(results):
+    leave_requests = load_json(LEAVE_REQUESTS_FILE, [])
+    saved_reasons = {req.get('reason') for req in leave_requests if str(req.get('reason', '')).startswith(LEAVE_MARKER)}
+    requisitions = {req.get('req_id'): req for req in load_json(OPEX_CAPEX_REQUESTS_FILE, [])}
+    request_ids = [req.get('request_id') for req in leave_requests]
+    return {
+        "leave_acknowledged": len(results.acknowledged_leave),
+        "leave_lost": len(results.acknowledged_leave - saved_reasons),
+        "approvals_acknowledged": len(results.acknowledged_approvals),
+        "approvals_lost": sum(1 for req_id in results.acknowledged_approvals
+                              if requisitions.get(req_id, {}).get('status_admin_manager') != 'Approve'),
+        "duplicate_leave_request_ids": len(request_ids) - len(set(request_ids)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent HR portal sessions against local Streamlit workers")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent staff sessions")
+    parser.add_argument("--approvers", type=int, default=2, help="Concurrent admin sessions approving requisitions")
+    parser.add_argument("--iterations", type=int, default=3, help="Leave applications / approvals per session")
+    parser.add_argument("--workers", type=int, default=1, help="Streamlit server processes; sessions are spread round-robin")
+    parser.add_argument("--cold", action="store_true", help="Skip the warm-up session, so concurrent sessions hit a cold worker")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds each session waits between iterations")
+    parser.add_argument("--scale", type=float, default=0.02, help="Data scale passed to generate_data")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    sandbox, app_path = make_sandbox(None)
+    original_cwd = os.getcwd()
+    results = LoadTestResults()
+    workers = []
+    try:
+        counts = generate(os.path.join(sandbox, "hr_data"), scale=args.scale, seed=args.seed,
+                          users=max(args.users + 1, int(10_000 * args.scale)))
+        os.chdir(sandbox)
+        approver_batches = assign_requisitions_to_admin(args.iterations, args.approvers) if args.approvers else []
+
+        workers = [Worker(sandbox, app_path) for _ in range(args.workers)]
+        for worker in workers:
+            worker.wait_until_ready()
+            if not args.cold:
+                worker.warm_up()
+        url_for = lambda session_number: workers[session_number % len(workers)].url
+
+        threads = [threading.Thread(target=staff_session, args=(url_for(number), f"staff{number:05d}", number, args.iterations, args.think_time, results))
+                   for number in range(1, args.users + 1)]
+        threads += [threading.Thread(target=approver_session, args=(url_for(args.users + number), number, batch, args.think_time, results))
+                    for number, batch in enumerate(approver_batches, start=1)]
+
+        sampler = ResourceSampler(workers)
+        sampler.start()
+        cpu_started = [worker.cpu_seconds() for worker in workers]
+        wall_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - wall_started
+        sampler.stop()
+
+        worker_reports = []
+        for worker, cpu_before in zip(workers, cpu_started):
+            cpu_seconds = worker.cpu_seconds() - cpu_before
+            worker_reports.append({
+                "port": worker.port,
+                "cpu_s": cpu_seconds,
+                "cpu_utilisation": cpu_seconds / wall_seconds if wall_seconds else None, # 1.0 = one core fully busy
+                "rss_peak_mb": worker.memory_kb("VmHWM") / 1024,
+                "rss_mean_mb": sum(worker.rss_samples) / len(worker.rss_samples) / 1024 if worker.rss_samples else None,
+            })
+
+        lost_updates = count_lost_updates(results)
+    finally:
+        for worker in workers:
+            worker.stop()
+        os.chdir(original_cwd)
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    all_latencies = [seconds for values in results.latencies.values() for seconds in values]
+    summarise = lambda values: {
+        "count": len(values), "p50_s": percentile(values, 50), "p95_s": percentile(values, 95),
+        "p99_s": percentile(values, 99), "max_s": max(values),
+    }
+    report = {
+        "sessions": {"staff": args.users, "approvers": args.approvers, "iterations": args.iterations, "workers": args.workers},
+        "counts": counts,
+        "wall_s": wall_seconds,
+        "throughput_page_loads_per_s": len(all_latencies) / wall_seconds if wall_seconds else None,
+        "latency": {"all": summarise(all_latencies), **{action: summarise(values) for action, values in sorted(results.latencies.items())}} if all_latencies else {},
+        "workers": worker_reports,
+        "lost_updates": lost_updates,
+        "errors": results.errors,
+    }
+
+    print(f"{args.users} staff + {args.approvers} approver sessions on {args.workers} worker(s), {args.iterations} iterations each, {wall_seconds:.1f} s wall")
+    print(f"{'action':<22} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for action, stats in report["latency"].items():
+        print(f"{action:<22} {stats['count']:>6} {stats['p50_s'] * 1000:7.0f}ms {stats['p95_s'] * 1000:7.0f}ms {stats['p99_s'] * 1000:7.0f}ms")
+    for worker in report["workers"]:
+        print(f"worker :{worker['port']} CPU {worker['cpu_s']:.1f} s ({worker['cpu_utilisation']:.0%} of one core), "
+              f"RSS peak {worker['rss_peak_mb']:.0f} MB")
+    print(f"lost updates: {lost_updates['leave_lost']} of {lost_updates['leave_acknowledged']} leave requests, "
+          f"{lost_updates['approvals_lost']} of {lost_updates['approvals_acknowledged']} approvals; "
+          f"{lost_updates['duplicate_leave_request_ids']} duplicate leave request IDs")
+    if results.errors:
+        print(f"{len(results.errors)} session errors, first: {results.errors[0]}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Startup-time benchmark for hr_app.py.
+# Every trial runs in a fresh interpreter so module imports are cold, renders
+# the login page and then the first dashboard through Streamlit's AppTest,
+# and records which heavy modules had been imported at each point.
+#
+# Usage:
+#   python benchmarks/startup_benchmark.py --runs 5
+#   python benchmarks/startup_benchmark.py --app /tmp/old_hr_app.py   # compare another version
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "plotly.express", "fpdf"]
+
+CHILD_SCRIPT = r"""
+import json, os, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_ready = time.perf_counter()
+
+app_path, username, password = sys.argv[1:4]
+heavy_modules = json.loads(sys.argv[4])
+loaded = lambda: [name for name in heavy_modules if name in sys.modules]
+
+at = AppTest.from_file(app_path, default_timeout=120)
+at.run()
+login_done = time.perf_counter()
+modules_after_login = loaded()
+
+at.text_input(key="login_username_input").input(username)
+at.text_input(key="login_password_input").input(password)
+at.button(key="login_button").click().run()
+dashboard_done = time.perf_counter()
+
+print(json.dumps({
+    "streamlit_import_s": streamlit_ready - start,
+    "login_page_s": login_done - streamlit_ready,
+    "first_dashboard_s": dashboard_done - login_done,
+    "modules_after_login": modules_after_login,
+    "modules_after_dashboard": loaded(),
+    "errors": [str(e.value) for e in at.exception],
+}))
+"""
+
+def make_sandbox(app_file):
+    # The app writes to hr_data on startup, so each benchmark runs on a copy
+    sandbox = tempfile.mkdtemp(prefix="hr_startup_bench_")
+    shutil.copytree(REPO_ROOT, sandbox, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns(".git", "__pycache__", "benchmarks"))
+    app_path = os.path.join(sandbox, "hr_app.py")
+    if app_file:
+        shutil.copyfile(app_file, app_path)
+    return sandbox, app_path
+
+def run_trial(sandbox, app_path, username, password):
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, app_path, username, password, json.dumps(HEAVY_MODULES)],
+        cwd=sandbox, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start and login-page render time of hr_app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--app", help="Path to an alternative hr_app.py to benchmark (e.g. an older revision)")
+    parser.add_argument("--username", default="abdul_bolaji@yahoo.com")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--output", help="Write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    sandbox, app_path = make_sandbox(args.app)
+    try:
+        trials = [run_trial(sandbox, app_path, args.username, args.password) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    summary = {"app": args.app or os.path.join(REPO_ROOT, "hr_app.py"), "runs": args.runs}
+    for metric in ("streamlit_import_s", "login_page_s", "first_dashboard_s"):
+        values = [trial[metric] for trial in trials]
+        summary[metric] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    summary["modules_after_login"] = trials[-1]["modules_after_login"]
+    summary["modules_after_dashboard"] = trials[-1]["modules_after_dashboard"]
+    summary["errors"] = sorted({error for trial in trials for error in trial["errors"]})
+
+    for metric in ("streamlit_import_s", "login_page_s", "first_dashboard_s"):
+        print(f"{metric:<20} median {summary[metric]['median'] * 1000:8.1f} ms  (min {summary[metric]['min'] * 1000:.1f}, max {summary[metric]['max'] * 1000:.1f})")
+    print(f"heavy modules after login page: {summary['modules_after_login'] or 'none'}")
+    print(f"heavy modules after dashboard:  {summary['modules_after_dashboard'] or 'none'}")
+    if summary["errors"]:
+        print(f"app errors: {summary['errors']}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=4)
+
+if __name__ == "__main__":
+    main()
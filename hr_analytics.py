@@ -0,0 +1,507 @@
+import random
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import date, timedelta
+
+from hr_store import (
+    USERS_FILE, LEAVE_REQUESTS_FILE, OPEX_CAPEX_REQUESTS_FILE, PUBLIC_HOLIDAYS_FILE, file_signature, get_staff_id
+)
+
+# Precomputed dashboard aggregates. Instead of recounting every user and leave
+# request on each dashboard visit, the counts are built once and then adjusted
+# by the app whenever it adds, changes or removes a record (apply()). The file
+# signatures seen at the last sync are kept, so a change made outside this
+# process (another worker, a script) is detected and triggers a full rebuild.
+
+# OPEX/CAPEX approval steps as (approver field, status field)
+OPEX_APPROVAL_STEPS = [
+    ("admin_manager_approver", "status_admin_manager"),
+    ("hr_manager_approver", "status_hr_manager"),
+    ("finance_manager_approver", "status_finance_manager"),
+    ("md_approver", "status_md"),
+]
+
+AGGREGATE_GROUPS = ["department", "gender", "leave", "opex"]
+
+AGGREGATE_FILES = {
+    "users": USERS_FILE,
+    "leave": LEAVE_REQUESTS_FILE,
+    "opex": OPEX_CAPEX_REQUESTS_FILE,
+}
+
+def leave_date_range(leave_request):
+    # (start, end) dates of a leave request, or None if its dates are malformed
+    try:
+        start_date = date.fromisoformat(str(leave_request.get('start_date')))
+        end_date = date.fromisoformat(str(leave_request.get('end_date')))
+    except ValueError:
+        return None
+    return (start_date, end_date) if start_date <= end_date else None
+
+def leave_days(leave_request):
+    # Calendar days covered by a leave request, or [] if its dates are malformed
+    date_range = leave_date_range(leave_request)
+    if date_range is None:
+        return []
+    start_date, end_date = date_range
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+class DashboardAggregates:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built = False
+        self.signatures = {}
+        # Bumped whenever a group of counts ("department", "gender", "leave", "opex")
+        # actually changes, so they can be used as cache keys for derived views
+        self.versions = Counter()
+        self._reset()
+
+    def _reset(self):
+        self.total_users = 0
+        self.department_counts = Counter()
+        self.gender_counts = Counter()
+        self.approved_leave_by_day = Counter() # date -> approved requests covering it
+        self.pending_leave_by_staff = Counter()
+        self.pending_opex_by_requester = Counter()
+        self.pending_approvals_by_name = Counter() # approver name -> requests awaiting them
+
+    # --- Building ---
+    def rebuild(self, users, leave_requests, opex_requests):
+        with self._lock:
+            self._reset()
+            for user in users:
+                self._contribute("users", user, 1)
+            for leave_request in leave_requests:
+                self._contribute("leave", leave_request, 1)
+            for opex_request in opex_requests:
+                self._contribute("opex", opex_request, 1)
+            self.signatures = {kind: file_signature(filename) for kind, filename in AGGREGATE_FILES.items()}
+            self.versions.update(AGGREGATE_GROUPS)
+            self.built = True
+
+    def is_current(self):
+        return self.built and all(
+            self.signatures.get(kind) == file_signature(filename) for kind, filename in AGGREGATE_FILES.items()
+        )
+
+    def mark_synced(self, filename, previous_signature):
+        # Called after the app saved `filename` and applied its deltas. The new
+        # signature is only adopted if the counts matched the file before the
+        # write; otherwise they stay stale and the next read rebuilds them.
+        with self._lock:
+            for kind, aggregate_file in AGGREGATE_FILES.items():
+                if self.built and aggregate_file == filename and self.signatures.get(kind) == previous_signature:
+                    self.signatures[kind] = file_signature(filename)
+
+    # --- Incremental updates ---
+    def apply(self, kind, before=None, after=None):
+        # Replaces one record's contribution: before=None for an insert, after=None for a delete.
+        # `before` must be a copy taken before the record was modified in place.
+        with self._lock:
+            if not self.built:
+                return
+            if before is not None:
+                self._contribute(kind, before, -1)
+            if after is not None:
+                self._contribute(kind, after, 1)
+            for group in _changed_groups(kind, before, after):
+                self.versions[group] += 1
+
+    def _contribute(self, kind, record, sign):
+        if kind == "users":
+            profile = record.get('profile', {})
+            self.total_users += sign
+            _bump(self.department_counts, profile.get('department') or 'Unassigned', sign)
+            _bump(self.gender_counts, profile.get('gender') or 'N/A', sign)
+        elif kind == "leave":
+            if record.get('status') == 'Approved':
+                for day in leave_days(record):
+                    _bump(self.approved_leave_by_day, day, sign)
+            elif record.get('status') == 'Pending':
+                _bump(self.pending_leave_by_staff, record.get('staff_id'), sign)
+        elif kind == "opex":
+            if record.get('final_status') == 'Pending':
+                _bump(self.pending_opex_by_requester, record.get('requester_staff_id'), sign)
+            pending_approvers = {record.get(approver_field) for approver_field, status_field in OPEX_APPROVAL_STEPS
+                                 if record.get(status_field) == 'Pending' and record.get(approver_field)}
+            for approver_name in pending_approvers:
+                _bump(self.pending_approvals_by_name, approver_name, sign)
+
+    # --- Reads ---
+    def on_leave(self, day=None):
+        return self.approved_leave_by_day.get(day or date.today(), 0)
+
+    def pending_for_user(self, user):
+        staff_id = get_staff_id(user)
+        return {
+            "leave": self.pending_leave_by_staff.get(staff_id, 0),
+            "opex": self.pending_opex_by_requester.get(staff_id, 0),
+            "approvals": self.pending_approvals_by_name.get(user.get('profile', {}).get('name'), 0),
+        }
+
+# --- Leave Overlap Detection ---
+class _IntervalNode:
+    __slots__ = ("entry", "key", "priority", "max_end", "left", "right")
+
+    def __init__(self, entry, priority):
+        self.entry = entry
+        self.key = _interval_key(entry)
+        self.priority = priority
+        self.max_end = entry[1]
+        self.left = self.right = None
+
+def _interval_key(entry):
+    # Total order even when staff or request IDs mix types or are missing
+    return (entry[0], entry[1], str(entry[2]), str(entry[3]))
+
+def _max_end(node):
+    return node.max_end if node else None
+
+def _refresh(node):
+    node.max_end = max(end for end in (node.entry[1], _max_end(node.left), _max_end(node.right)) if end is not None)
+    return node
+
+def _rotate_right(node):
+    child = node.left
+    node.left, child.right = child.right, node
+    _refresh(node)
+    return _refresh(child)
+
+def _rotate_left(node):
+    child = node.right
+    node.right, child.left = child.left, node
+    _refresh(node)
+    return _refresh(child)
+
+class SortedIntervals:
+    # Date intervals in a treap (a randomly balanced search tree) ordered by
+    # start, each node holding the latest end in its subtree. Adding or removing
+    # an interval is O(log n) expected, and "what overlaps [start, end]?" skips
+    # every subtree that ends before `start` or starts after `end`.
+    def __init__(self, entries=()):
+        # Bulk build: sort once, then hang the sorted entries off a balanced tree
+        entries = sorted(entries, key=_interval_key)
+        self._random = random.Random()
+        self.size = len(entries)
+        self.root = self._build(entries, 0, len(entries))
+        # Heap order for later inserts: higher priorities nearer the root, level by level
+        priorities = sorted((self._random.random() for _ in entries), reverse=True)
+        level = [self.root] if self.root else []
+        position = 0
+        while level:
+            for node in level:
+                node.priority = priorities[position]
+                position += 1
+            level = [child for node in level for child in (node.left, node.right) if child]
+
+    def _build(self, entries, low, high):
+        if low >= high:
+            return None
+        middle = (low + high) // 2
+        node = _IntervalNode(entries[middle], 0.0)
+        node.left = self._build(entries, low, middle)
+        node.right = self._build(entries, middle + 1, high)
+        return _refresh(node)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, entry):
+        self.root = self._insert(self.root, _IntervalNode(entry, self._random.random()))
+        self.size += 1
+
+    def _insert(self, node, new_node):
+        if node is None:
+            return new_node
+        if new_node.key < node.key:
+            node.left = self._insert(node.left, new_node)
+            if node.left.priority > node.priority:
+                return _rotate_right(node)
+        else:
+            node.right = self._insert(node.right, new_node)
+            if node.right.priority > node.priority:
+                return _rotate_left(node)
+        return _refresh(node)
+
+    def remove(self, entry):
+        removed = []
+        self.root = self._delete(self.root, entry, _interval_key(entry), removed)
+        self.size -= len(removed)
+
+    def _delete(self, node, entry, key, removed):
+        if node is None:
+            return None
+        if key < node.key:
+            node.left = self._delete(node.left, entry, key, removed)
+        elif key > node.key:
+            node.right = self._delete(node.right, entry, key, removed)
+        elif node.entry == entry:
+            removed.append(node)
+            return self._merge(node.left, node.right)
+        else: # Same key, different entry (e.g. request IDs 1 and "1"); either side may hold it
+            node.left = self._delete(node.left, entry, key, removed)
+            if not removed:
+                node.right = self._delete(node.right, entry, key, removed)
+        return _refresh(node)
+
+    def _merge(self, left, right):
+        # Joins two subtrees whose keys are already in order
+        if left is None or right is None:
+            return left or right
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            return _refresh(left)
+        right.left = self._merge(left, right.left)
+        return _refresh(right)
+
+    def overlapping(self, start, end):
+        # Entries sharing at least one day with [start, end], by start date
+        matches = []
+        stack, node = [], self.root
+        while stack or node:
+            if node is not None and node.max_end >= start: # Otherwise nothing below reaches `start`
+                stack.append(node)
+                node = node.left
+                continue
+            if not stack:
+                break
+            node = stack.pop()
+            if node.entry[0] > end: # Everything further right starts later still
+                break
+            if node.entry[1] >= start:
+                matches.append(node.entry)
+            node = node.right
+        return matches
+
+class LeaveIntervalIndex:
+    # Pending and approved leave as sorted intervals per staff member and per
+    # department, used to reject self-overlapping requests and warn about
+    # department coverage at submission time. Kept in sync like DashboardAggregates.
+    ACTIVE_STATUSES = ("Pending", "Approved")
+
+    def __init__(self, leave_requests, department_by_staff_id):
+        self._lock = threading.RLock()
+        self.department_by_staff_id = department_by_staff_id
+        entries_by_staff, entries_by_department = {}, {}
+        for leave_request in leave_requests:
+            entry, staff_id, department = self._entry(leave_request)
+            if entry is None:
+                continue
+            for entries_by_key, key in ((entries_by_staff, staff_id), (entries_by_department, department)):
+                if key is not None:
+                    entries_by_key.setdefault(key, []).append(entry)
+        self.by_staff = {staff_id: SortedIntervals(entries) for staff_id, entries in entries_by_staff.items()}
+        self.by_department = {department: SortedIntervals(entries) for department, entries in entries_by_department.items()}
+        self.signatures = {filename: file_signature(filename) for filename in (LEAVE_REQUESTS_FILE, USERS_FILE)}
+
+    def is_current(self):
+        # Department membership comes from users.json, so a change there also means a rebuild
+        return all(self.signatures[filename] == file_signature(filename) for filename in self.signatures)
+
+    def mark_synced(self, filename, previous_signature):
+        with self._lock:
+            if filename == LEAVE_REQUESTS_FILE and self.signatures[filename] == previous_signature:
+                self.signatures[filename] = file_signature(filename)
+
+    def apply(self, kind, before=None, after=None):
+        if kind != "leave":
+            return
+        with self._lock:
+            if before is not None:
+                self._contribute(before, -1)
+            if after is not None:
+                self._contribute(after, 1)
+
+    def _entry(self, leave_request):
+        # (interval entry, staff ID, department), or (None, ...) for inactive or undated requests
+        staff_id = leave_request.get('staff_id')
+        date_range = leave_date_range(leave_request) if leave_request.get('status') in self.ACTIVE_STATUSES else None
+        if date_range is None:
+            return None, staff_id, None
+        entry = (date_range[0], date_range[1], staff_id, leave_request.get('request_id'))
+        return entry, staff_id, self.department_by_staff_id.get(staff_id)
+
+    def _contribute(self, leave_request, sign):
+        entry, staff_id, department = self._entry(leave_request)
+        if entry is None:
+            return
+        for intervals_by_key, key in ((self.by_staff, staff_id), (self.by_department, department)):
+            if key is None:
+                continue
+            intervals = intervals_by_key.setdefault(key, SortedIntervals())
+            if sign > 0:
+                intervals.add(entry)
+            else:
+                intervals.remove(entry)
+
+    def staff_overlaps(self, staff_id, start_date, end_date):
+        # The applicant's own pending/approved requests that clash with [start_date, end_date]
+        intervals = self.by_staff.get(staff_id)
+        return intervals.overlapping(start_date, end_date) if intervals else []
+
+    def department_peak_out(self, department, start_date, end_date, extra_staff_id=None):
+        # Most distinct staff of `department` away on any single day of the range,
+        # counting `extra_staff_id` as away for the whole range (the new request)
+        intervals = self.by_department.get(department)
+        clipped_by_staff = {}
+        for start, end, staff_id, _ in (intervals.overlapping(start_date, end_date) if intervals else []):
+            clipped_by_staff.setdefault(staff_id, []).append((max(start, start_date), min(end, end_date)))
+        if extra_staff_id is not None:
+            clipped_by_staff[extra_staff_id] = [(start_date, end_date)]
+
+        events = []
+        for staff_intervals in clipped_by_staff.values():
+            # Merge each person's own intervals so nobody is counted twice on a day
+            staff_intervals.sort()
+            merged_start, merged_end = staff_intervals[0]
+            for start, end in staff_intervals[1:]:
+                if start <= merged_end + timedelta(days=1):
+                    merged_end = max(merged_end, end)
+                else:
+                    events += [(merged_start, 1), (merged_end + timedelta(days=1), -1)]
+                    merged_start, merged_end = start, end
+            events += [(merged_start, 1), (merged_end + timedelta(days=1), -1)]
+
+        peak = current = 0
+        for _, change in sorted(events, key=lambda event: (event[0], event[1])):
+            current += change
+            peak = max(peak, current)
+        return peak
+
+# --- Leave Balances ---
+# Yearly entitlement in working days by leave type, then by grade level ("default"
+# for any other grade). Types missing here (e.g. "Other") are not capped.
+LEAVE_ENTITLEMENTS = {
+    "Annual Leave": {"MD": 30, "Manager": 25, "default": 20},
+    "Sick Leave": {"default": 12},
+    "Maternity Leave": {"default": 60},
+    "Paternity Leave": {"default": 10},
+    "Compassionate Leave": {"default": 5},
+    "Study Leave": {"default": 10},
+}
+# Leave types earned month by month; the rest are granted in full on 1 January
+MONTHLY_ACCRUAL_LEAVE_TYPES = {"Annual Leave"}
+
+def parse_holidays(values):
+    # Sorted weekday holidays from ISO date strings (weekend holidays never count anyway)
+    holidays = set()
+    for value in values or []:
+        try:
+            holiday = date.fromisoformat(str(value).strip())
+        except ValueError:
+            continue
+        if holiday.weekday() < 5:
+            holidays.add(holiday)
+    return sorted(holidays)
+
+def working_days(start_date, end_date, holidays=()):
+    # Weekdays from start_date to end_date inclusive, minus `holidays` (sorted weekday dates)
+    if start_date > end_date:
+        return 0
+    full_weeks, extra_days = divmod((end_date - start_date).days + 1, 7)
+    weekdays = full_weeks * 5 + sum(1 for offset in range(extra_days) if (start_date.weekday() + offset) % 7 < 5)
+    return weekdays - (bisect_right(holidays, end_date) - bisect_left(holidays, start_date))
+
+def leave_entitlement(leave_type, grade_level):
+    # Yearly entitlement in working days, or None when the leave type is uncapped
+    by_grade = LEAVE_ENTITLEMENTS.get(leave_type)
+    if by_grade is None:
+        return None
+    return by_grade.get(grade_level, by_grade["default"])
+
+def accrued_entitlement(leave_type, grade_level, today=None, joined_on=None):
+    # Entitlement earned so far this year. Monthly types earn 1/12 at the start of each
+    # month, counted from the joining month for staff who joined this year.
+    entitlement = leave_entitlement(leave_type, grade_level)
+    if entitlement is None or leave_type not in MONTHLY_ACCRUAL_LEAVE_TYPES:
+        return entitlement
+    today = today or date.today()
+    first_month = joined_on.month if joined_on and joined_on.year == today.year else 1
+    if joined_on and joined_on > today:
+        return 0
+    return round(entitlement * (today.month - first_month + 1) / 12, 1)
+
+class LeaveLedger:
+    # Working days of approved and pending leave per (staff_id, year, leave_type),
+    # maintained incrementally like DashboardAggregates so a balance is a dict lookup
+    # rather than a pass over the employee's whole leave history.
+    def __init__(self, leave_requests, holidays=()):
+        self._lock = threading.RLock()
+        self.holidays = list(holidays)
+        self.usage = {} # (staff_id, year, leave_type) -> {"Approved": days, "Pending": days}
+        for leave_request in leave_requests:
+            self._contribute(leave_request, 1)
+        self.signatures = {filename: file_signature(filename) for filename in (LEAVE_REQUESTS_FILE, PUBLIC_HOLIDAYS_FILE)}
+
+    def is_current(self):
+        return all(self.signatures[filename] == file_signature(filename) for filename in self.signatures)
+
+    def mark_synced(self, filename, previous_signature):
+        with self._lock:
+            if filename == LEAVE_REQUESTS_FILE and self.signatures[filename] == previous_signature:
+                self.signatures[filename] = file_signature(filename)
+
+    def apply(self, kind, before=None, after=None):
+        if kind != "leave":
+            return
+        with self._lock:
+            if before is not None:
+                self._contribute(before, -1)
+            if after is not None:
+                self._contribute(after, 1)
+
+    def _contribute(self, leave_request, sign):
+        status = leave_request.get('status')
+        if status not in ("Approved", "Pending"):
+            return
+        date_range = leave_date_range(leave_request)
+        if date_range is None:
+            return
+        for year, days in self.working_days_by_year(*date_range).items():
+            key = (leave_request.get('staff_id'), year, leave_request.get('leave_type'))
+            totals = self.usage.setdefault(key, {"Approved": 0, "Pending": 0})
+            totals[status] += sign * days
+
+    def working_days(self, start_date, end_date):
+        return working_days(start_date, end_date, self.holidays)
+
+    def working_days_by_year(self, start_date, end_date):
+        # Leave spanning New Year counts against each year's entitlement separately
+        return {year: working_days(max(start_date, date(year, 1, 1)), min(end_date, date(year, 12, 31)), self.holidays)
+                for year in range(start_date.year, end_date.year + 1)}
+
+    def balance(self, staff_id, leave_type, grade_level, year=None, today=None, joined_on=None):
+        # {"entitlement", "accrued", "approved", "pending", "available"} for `year` (default
+        # this year); entitlement/accrued/available are None for uncapped leave types
+        today = today or date.today()
+        year = year or today.year
+        totals = self.usage.get((staff_id, year, leave_type), {})
+        approved, pending = totals.get("Approved", 0), totals.get("Pending", 0)
+        # Other years are judged on everything accrued by their 31 December
+        as_of = today if year == today.year else date(year, 12, 31)
+        accrued = accrued_entitlement(leave_type, grade_level, as_of, joined_on)
+        return {
+            "entitlement": leave_entitlement(leave_type, grade_level),
+            "accrued": accrued,
+            "approved": approved,
+            "pending": pending,
+            "available": None if accrued is None else round(accrued - approved - pending, 1),
+        }
+
+def _changed_groups(kind, before, after):
+    if kind != "users":
+        return [kind]
+    # Edits that leave department and gender alone (address, phone, ...) don't touch the charts
+    profile_before = (before or {}).get('profile', {})
+    profile_after = (after or {}).get('profile', {})
+    return [
+        group for group, field in (("department", "department"), ("gender", "gender"))
+        if before is None or after is None or profile_before.get(field) != profile_after.get(field)
+    ]
+
+def _bump(counter, key, amount):
+    # Keeps counters free of zero entries so charts and totals stay clean
+    counter[key] += amount
+    if counter[key] <= 0:
+        del counter[key]
@@ -0,0 +1,356 @@
+import argparse
+import gzip
+import hmac
+import json
+import os
+import threading
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from hr_indexes import StaffDirectory, paginate
+from hr_store import (
+    USERS_FILE, LEAVE_REQUESTS_FILE, OPEX_CAPEX_REQUESTS_FILE, PAYROLL_FILE, DEFAULT_STAFF_PASSWORD,
+    REQUISITION_APPROVAL_STEPS, REQUISITION_STEP_STATUSES, load_json, write_json_atomic, file_signature,
+    build_index, import_payroll_rows, import_staff_rows, requisition_final_status
+)
+
+# Local JSON HTTP API over the HR data files, for finance/ERP integrations.
+# It runs as its own process next to the Streamlit app, reads and writes the
+# same files through hr_store, and the app picks up its writes through the
+# file signatures as it does for the CLI. Bound to localhost by default.
+#
+#   GET  /api                              resources and their current ETags
+#   GET  /api/<resource>?page=&page_size=&sort=&<field>=&<field>__gte=&<field>__lte=
+#   GET  /api/<resource>/<id>
+#   POST /api/<resource>/batch             see HRDataService.batch
+#
+# Resources: leave-requests, requisitions, payroll, users. Fields of nested
+# objects are addressed with dots (profile.department). Every GET carries an
+# ETag derived from the data file's signature; send it back in If-None-Match
+# to get a bodiless 304 while nothing has changed, or in If-Match on a batch
+# write to have it refused (412) if someone else wrote first.
+#
+# Usage:
+#   python hr_api.py --port 8502
+#   python hr_api.py --port 8502 --token-file /etc/hr_portal/api_token   # require "Authorization: Bearer <token>"
+
+API_RESOURCES = {
+    "leave-requests": {
+        "file": LEAVE_REQUESTS_FILE, "id_field": "request_id",
+        "updatable": {"status": ("Pending", "Approved", "Rejected")},
+    },
+    "requisitions": {
+        "file": OPEX_CAPEX_REQUESTS_FILE, "id_field": "req_id",
+        "updatable": {step: REQUISITION_STEP_STATUSES for step in REQUISITION_APPROVAL_STEPS},
+    },
+    "payroll": {"file": PAYROLL_FILE, "id_field": "payslip_id", "updatable": {}},
+    "users": {"file": USERS_FILE, "id_field": "username", "updatable": {}},
+}
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BODY_BYTES = 10 * 1024 * 1024
+GZIP_MIN_BYTES = 1024
+RESERVED_PARAMS = {"page", "page_size", "sort", "q"}
+
+class APIError(Exception):
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+def _field(record, path):
+    value = record
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _compare_key(value):
+    # Numbers compare as numbers, everything else (ISO dates included) as text
+    try:
+        return (0, float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(value))
+
+def _public_user(user):
+    return {field: value for field, value in user.items() if field != 'password'}
+
+def _positions_by_id(records, id_field):
+    # Records without an ID (e.g. old sample rows) cannot be addressed by one
+    return {str(record[id_field]): position for position, record in enumerate(records) if record.get(id_field) is not None}
+
+class HRDataService:
+    def __init__(self):
+        self._write_lock = threading.Lock() # Serialises read-modify-write batches within this process
+        self._cache_lock = threading.Lock()
+        self._cache = {} # resource -> {"signature", "records", "positions", "indexes", "directory"}
+
+    # --- Reads ---
+    def etag(self, resource):
+        signature = file_signature(API_RESOURCES[resource]['file'])
+        return 'W/"{:x}-{:x}"'.format(*signature) if signature else 'W/"empty"'
+
+    def _snapshot(self, resource):
+        # Records as of the file's current signature; reloaded only after it changes
+        spec = API_RESOURCES[resource]
+        signature = file_signature(spec['file'])
+        with self._cache_lock:
+            cached = self._cache.get(resource)
+            if cached is None or cached['signature'] != signature:
+                records = load_json(spec['file'], [])
+                if resource == "users":
+                    records = [_public_user(user) for user in records]
+                cached = {
+                    "signature": signature, "records": records,
+                    "positions": _positions_by_id(records, spec['id_field']),
+                    "indexes": {}, "directory": None,
+                }
+                self._cache[resource] = cached
+            return cached
+
+    def _matching_positions(self, snapshot, field, values):
+        # Exact-match filters go through a build_index() on the field, built on first use
+        with self._cache_lock:
+            index = snapshot['indexes'].get(field)
+            if index is None:
+                index = snapshot['indexes'][field] = build_index(snapshot['records'], lambda record: str(_field(record, field)))
+        return {position for value in values for position in index.get(value, [])}
+
+    def list(self, resource, params):
+        snapshot = self._snapshot(resource)
+        records = snapshot['records']
+        try:
+            page = int(params.get("page", ["1"])[0])
+            page_size = min(int(params.get("page_size", [str(DEFAULT_PAGE_SIZE)])[0]), MAX_PAGE_SIZE)
+        except ValueError:
+            raise APIError(HTTPStatus.BAD_REQUEST, "page and page_size must be integers")
+        if page_size < 1:
+            raise APIError(HTTPStatus.BAD_REQUEST, "page_size must be at least 1")
+
+        positions = None
+        if resource == "users" and params.get("q"):
+            # Same prefix/trigram search as the staff directory page
+            if snapshot['directory'] is None:
+                snapshot['directory'] = StaffDirectory(records)
+            positions = {entry['position'] for entry in snapshot['directory'].search(params["q"][0], include_admins=True)}
+        for name, values in params.items():
+            if name in RESERVED_PARAMS or name.endswith(("__gte", "__lte")):
+                continue
+            matches = self._matching_positions(snapshot, name, values)
+            positions = matches if positions is None else positions & matches
+        selected = [records[position] for position in sorted(positions)] if positions is not None else records
+
+        for name, values in params.items():
+            if name.endswith("__gte") or name.endswith("__lte"):
+                field, bound = name[:-5], _compare_key(values[0])
+                keep = (lambda key: key >= bound) if name.endswith("__gte") else (lambda key: key <= bound)
+                selected = [record for record in selected if _field(record, field) is not None and keep(_compare_key(_field(record, field)))]
+
+        sort = params.get("sort", [None])[0]
+        if sort:
+            field = sort.lstrip("-")
+            selected = sorted(selected, key=lambda record: _compare_key(_field(record, field)), reverse=sort.startswith("-"))
+
+        items, total_pages = paginate(selected, page, page_size)
+        return {"items": items, "page": min(max(1, page), total_pages), "page_size": page_size,
+                "total": len(selected), "total_pages": total_pages}
+
+    def get(self, resource, record_id):
+        snapshot = self._snapshot(resource)
+        position = snapshot['positions'].get(record_id)
+        if position is None:
+            raise APIError(HTTPStatus.NOT_FOUND, f"No {resource} record with ID {record_id}")
+        return snapshot['records'][position]
+
+    # --- Writes ---
+    def batch(self, resource, body, if_match=None):
+        # payroll:  {"rows": [CSV-style payroll rows]}; replaces payslips for the same staff/month/year
+        # users:    {"rows": [staff import rows], "password": optional first-login password}
+        # leave-requests, requisitions: {"updates": [{<id field>: id, <field>: value, ...}]}
+        # Update batches are validated as a whole and written with one save, or not at all.
+        spec = API_RESOURCES[resource]
+        with self._write_lock:
+            if if_match and if_match.strip() != "*" and self.etag(resource) not in [tag.strip() for tag in if_match.split(",")]:
+                raise APIError(HTTPStatus.PRECONDITION_FAILED, f"{resource} changed since the given ETag")
+
+            if resource in ("payroll", "users"):
+                rows = body.get("rows")
+                if not isinstance(rows, list):
+                    raise APIError(HTTPStatus.BAD_REQUEST, '"rows" must be a list')
+                not_objects = [number for number, row in enumerate(rows, start=1) if not isinstance(row, dict)]
+                if not_objects:
+                    raise APIError(HTTPStatus.BAD_REQUEST, '"rows" must be a list of objects',
+                                   [{"row": number, "error": "Not an object"} for number in not_objects[:100]])
+                if body.get("password") is not None and not isinstance(body["password"], str):
+                    raise APIError(HTTPStatus.BAD_REQUEST, '"password" must be a string')
+                if resource == "payroll":
+                    payroll_data, report = import_payroll_rows(load_json(PAYROLL_FILE, []), rows, load_json(USERS_FILE, []))
+                    if any(entry['status'] != "Skipped" for entry in report):
+                        write_json_atomic(payroll_data, PAYROLL_FILE)
+                else:
+                    _, report = import_staff_rows(load_json(USERS_FILE, []), rows, password=body.get("password") or DEFAULT_STAFF_PASSWORD)
+                return {"report": report, "etag": self.etag(resource)}
+
+            updates = body.get("updates")
+            if not isinstance(updates, list):
+                raise APIError(HTTPStatus.BAD_REQUEST, '"updates" must be a list')
+            records = load_json(spec['file'], [])
+            position_by_id = _positions_by_id(records, spec['id_field'])
+            errors = []
+            for number, update in enumerate(updates, start=1):
+                if not isinstance(update, dict) or update.get(spec['id_field']) is None:
+                    errors.append({"update": number, "error": f"Missing {spec['id_field']}"})
+                    continue
+                record_id = str(update[spec['id_field']])
+                if record_id not in position_by_id:
+                    errors.append({"update": number, "error": f"Unknown {spec['id_field']} {record_id}"})
+                    continue
+                for field, value in update.items():
+                    if field == spec['id_field']:
+                        continue
+                    if field not in spec['updatable']:
+                        errors.append({"update": number, "error": f"{field} cannot be updated"})
+                    elif value not in spec['updatable'][field]:
+                        errors.append({"update": number, "error": f"{field} must be one of {', '.join(spec['updatable'][field])}"})
+            if errors:
+                raise APIError(HTTPStatus.UNPROCESSABLE_ENTITY, "Batch rejected; nothing was saved", errors)
+
+            for update in updates:
+                record = records[position_by_id[str(update[spec['id_field']])]]
+                record.update({field: value for field, value in update.items() if field != spec['id_field']})
+                if resource == "requisitions":
+                    record['final_status'] = requisition_final_status(record)
+            write_json_atomic(records, spec['file'])
+            return {"updated": len(updates), "etag": self.etag(resource)}
+
+def make_handler(service, token=None):
+    class APIHandler(BaseHTTPRequestHandler):
+        server_version = "HRPortalAPI/1.0"
+
+        def _send_json(self, status, payload, etag=None):
+            body = json.dumps(payload, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            if etag:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache") # Revalidate with If-None-Match every time
+            if len(body) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=5)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_not_modified(self, etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+
+        def _route(self):
+            if token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                raise APIError(HTTPStatus.UNAUTHORIZED, "Missing or invalid bearer token")
+            url = urlsplit(self.path)
+            parts = [unquote(part) for part in url.path.strip("/").split("/")]
+            if not parts or parts[0] != "api":
+                raise APIError(HTTPStatus.NOT_FOUND, "Unknown path")
+            if len(parts) > 1 and parts[1] not in API_RESOURCES:
+                raise APIError(HTTPStatus.NOT_FOUND, f"Unknown resource {parts[1]}")
+            return parts[1:], parse_qs(url.query)
+
+        def _handle(self, method):
+            try:
+                parts, params = self._route()
+                if method == "GET":
+                    self._get(parts, params)
+                elif len(parts) == 2 and parts[1] == "batch":
+                    self._post_batch(parts[0])
+                else:
+                    raise APIError(HTTPStatus.METHOD_NOT_ALLOWED, "Only POST /api/<resource>/batch accepts writes")
+            except APIError as error:
+                self._send_json(error.status, {"error": str(error), **({"details": error.details} if error.details else {})})
+            except Exception: # Answer rather than drop the connection, whatever the input
+                self.log_error("Unhandled error for %s %s", method, self.path)
+                traceback.print_exc()
+                self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"})
+
+        def _get(self, parts, params):
+            if not parts:
+                self._send_json(HTTPStatus.OK, {"resources": {resource: {"etag": service.etag(resource), "id_field": spec['id_field']}
+                                                              for resource, spec in API_RESOURCES.items()}})
+                return
+            resource = parts[0]
+            etag = service.etag(resource)
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+                self._send_not_modified(etag) # Nothing is loaded from disk
+                return
+            if len(parts) == 1:
+                self._send_json(HTTPStatus.OK, service.list(resource, params), etag=etag)
+            elif len(parts) == 2:
+                self._send_json(HTTPStatus.OK, service.get(resource, parts[1]), etag=etag)
+            else:
+                raise APIError(HTTPStatus.NOT_FOUND, "Unknown path")
+
+        def _post_batch(self, resource):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise APIError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+            if length > MAX_BODY_BYTES:
+                raise APIError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Batches are limited to {MAX_BODY_BYTES // (1024 * 1024)} MB")
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as error:
+                raise APIError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {error}")
+            if not isinstance(body, dict):
+                raise APIError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+            result = service.batch(resource, body, if_match=self.headers.get("If-Match"))
+            self._send_json(HTTPStatus.OK, result, etag=result['etag'])
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+    return APIHandler
+
+def make_server(host="127.0.0.1", port=8502, token=None):
+    return ThreadingHTTPServer((host, port), make_handler(HRDataService(), token))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local JSON HTTP API over the HR portal data")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--token-file", help="File holding a bearer token that every request must present")
+    parser.add_argument("-C", "--directory", help="Portal directory containing hr_data (default: current directory)")
+    args = parser.parse_args(argv)
+
+    token = None
+    if args.token_file:
+        with open(args.token_file) as file:
+            token = file.readline().strip()
+    if args.directory:
+        os.chdir(args.directory) # Data paths in hr_store are relative to the portal directory
+    server = make_server(args.host, args.port, token)
+    print(f"HR portal API listening on http://{args.host}:{server.server_address[1]}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
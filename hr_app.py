@@ -2,10 +2,12 @@ import streamlit as st
 import json
 from datetime import datetime, timedelta, date
 import os
-import pandas as pd
-import plotly.express as px
-from fpdf import FPDF
+import importlib
+import functools
+import copy
+from contextlib import contextmanager
 import base64
+import uuid
 from passlib.hash import pbkdf2_sha256 # For password hashing
 
 # --- SET STREAMLIT PAGE CONFIG (MUST BE THE VERY FIRST STREAMLIT COMMAND) ---
@@ -17,15 +19,25 @@ st.set_page_config(
 # --- END CORRECT PLACEMENT ---
 
 # --- Configuration & Paths ---
-DATA_DIR = "hr_data"
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-LEAVE_REQUESTS_FILE = os.path.join(DATA_DIR, "leave_requests.json")
-OPEX_CAPEX_REQUESTS_FILE = os.path.join(DATA_DIR, "opex_capex_requests.json")
-PERFORMANCE_GOALS_FILE = os.path.join(DATA_DIR, "performance_goals.json")
-SELF_APPRAISALS_FILE = os.path.join(DATA_DIR, "self_appraisals.json")
-PAYROLL_FILE = os.path.join(DATA_DIR, "payroll.json")
-BENEFICIARIES_FILE = os.path.join(DATA_DIR, "beneficiaries.json")
-HR_POLICIES_FILE = os.path.join(DATA_DIR, "hr_policies.json") # New
+# Data file paths live in hr_store so scripts can share them without importing Streamlit
+from hr_store import (
+    DATA_DIR, USERS_FILE, LEAVE_REQUESTS_FILE, OPEX_CAPEX_REQUESTS_FILE, PERFORMANCE_GOALS_FILE,
+    SELF_APPRAISALS_FILE, PAYROLL_FILE, BENEFICIARIES_FILE, HR_POLICIES_FILE, PUBLIC_HOLIDAYS_FILE,
+    DEFAULT_STAFF_PASSWORD, BULK_IMPORT_REQUIRED_COLUMNS, BULK_IMPORT_OPTIONAL_COLUMNS,
+    write_json_atomic, file_signature, recover_pending_transaction, get_staff_id, offboard_staff, finish_offboarding, new_staff_record,
+    import_staff_rows, TrainingStore, migrate_training_records, training_attendance_report,
+    BlobStore, document_ref, migrate_legacy_documents, PAYROLL_REQUIRED_COLUMNS, import_payroll_file, offboard_staff_files,
+    requisition_final_status, SubmissionTokenIndex, submission_key, SUBMISSION_TOKEN_TTL_S,
+    RecordArchive, record_key, archive_closed_records, DEFAULT_ARCHIVE_AFTER_MONTHS
+)
+from hr_jobs import JobRunner
+from hr_metrics import MetricsRegistry, start_metrics_server
+from hr_profiling import SlowRerunProfiler
+from hr_indexes import StaffDirectory, AnnualDateIndex, paginate
+from hr_export import EXPORT_FORMATS, available_export_formats, export_bytes
+from hr_analytics import (
+    DashboardAggregates, LeaveIntervalIndex, LeaveLedger, LEAVE_ENTITLEMENTS, leave_date_range, parse_holidays
+)
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -43,42 +55,210 @@ ABDULAHI_IMAGE_PATH = os.path.join(ICON_BASE_DIR, ABDULAHI_IMAGE_FILE_NAME)
 # --- Define Approval Route Roles and simulate emails (Updated to fetch from users) ---
 APPROVAL_ROLES = ["Admin", "HR", "Finance", "MD"] # These correspond to departments for approval logic
 
-# --- Data Loading/Saving Functions ---
-class DateEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (date, datetime)):
-            return obj.isoformat()
-        return super().default(obj)
+# Departments whose staff can act on each OPEX/CAPEX approval step (mirrors manage_opex_capex_approvals)
+APPROVER_DEPARTMENTS = {
+    "admin_manager_approver": ["Admin"],
+    "hr_manager_approver": ["HR"],
+    "finance_manager_approver": ["Finance"],
+    "md_approver": ["Executive", "MD"],
+}
+
+STAFF_DIRECTORY_PAGE_SIZE = 25
+
+# Warn a leave applicant when their department would have more than this share of staff away at once
+DEPARTMENT_LEAVE_WARNING_PERCENT = 30
+
+# Prometheus text export of the System Metrics histograms (both off when None)
+METRICS_EXPORT_FILE = None # e.g. "/var/lib/node_exporter/textfile/hr_portal.prom"
+METRICS_EXPORT_PORT = None # e.g. 9464 serves http://127.0.0.1:9464/metrics
+METRICS_EXPORT_INTERVAL_S = 15 # Minimum gap between file exports
+
+# --- System Metrics ---
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    # One registry per server process, shared by every session
+    return MetricsRegistry()
+
+@st.cache_resource(show_spinner=False)
+def get_metrics_server():
+    # Returns (server, error); the server is only started when METRICS_EXPORT_PORT is set
+    if not METRICS_EXPORT_PORT:
+        return None, None
+    try:
+        return start_metrics_server(get_metrics(), METRICS_EXPORT_PORT), None
+    except OSError as error: # Port already taken, e.g. by another worker
+        return None, str(error)
+
+def export_metrics():
+    get_metrics_server()
+    if METRICS_EXPORT_FILE:
+        get_metrics().export_to_file(METRICS_EXPORT_FILE, min_interval_s=METRICS_EXPORT_INTERVAL_S)
+
+@st.cache_resource(show_spinner=False)
+def get_profiler():
+    # Slow-rerun profiler; switched on and off from the Slow Rerun Profiles page
+    return SlowRerunProfiler()
 
+def verify_password(password, password_hash):
+    with get_metrics().timer("password_verify"):
+        return pbkdf2_sha256.verify(password, password_hash)
+
+# --- Data Loading/Saving Functions ---
 def load_data(filename, default_value=None):
     if default_value is None:
         default_value = []
-    try:
-        if os.path.exists(filename) and os.path.getsize(filename) > 0:
-            with open(filename, "r") as file:
-                return json.load(file)
-        return default_value
-    except json.JSONDecodeError:
-        st.warning(f"Error decoding JSON from {filename}. File might be corrupted or empty. Resetting data.")
-        return default_value
-    except FileNotFoundError:
-        return default_value
+    with get_metrics().timer("data_load", file=os.path.basename(filename)) as sample:
+        try:
+            if os.path.exists(filename) and os.path.getsize(filename) > 0:
+                with open(filename, "r") as file:
+                    data = json.load(file)
+                    sample['bytes'] = file.tell()
+                    return data
+            return default_value
+        except json.JSONDecodeError:
+            st.warning(f"Error decoding JSON from {filename}. File might be corrupted or empty. Resetting data.")
+            return default_value
+        except FileNotFoundError:
+            return default_value
 
 def save_data(data, filename):
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4, cls=DateEncoder)
-
-def save_uploaded_file(uploaded_file, destination_folder="uploaded_documents"):
+    previous_signature = file_signature(filename)
+    with get_metrics().timer("data_save", file=os.path.basename(filename)) as sample:
+        write_json_atomic(data, filename)
+        sample['bytes'] = os.path.getsize(filename)
+    mark_derived_views_synced(filename, previous_signature)
+    loaded_signatures = st.session_state.get('data_signatures', {})
+    if loaded_signatures.get(filename) == previous_signature: # Our own write; the session copy is still current
+        loaded_signatures[filename] = file_signature(filename)
+
+def load_session_data(key, filename, default_value=None):
+    # Loads a data file into st.session_state[key], noting the file signature it was read at
+    signature = file_signature(filename)
+    st.session_state[key] = load_data(filename, default_value)
+    if 'data_signatures' not in st.session_state:
+        st.session_state.data_signatures = {}
+    st.session_state.data_signatures[filename] = signature
+
+def reload_if_changed(key, filename, default_value=None):
+    # Callbacks run before the script reloads the data files, and fragment reruns never
+    # reload them, so a callback about to save first picks up writes made meanwhile by
+    # other sessions, background jobs or the CLI instead of saving a stale copy over them
+    if st.session_state.get('data_signatures', {}).get(filename) != file_signature(filename):
+        load_session_data(key, filename, default_value)
+    return st.session_state[key]
+
+def save_uploaded_file(uploaded_file, ref):
+    # Stores the upload in the content-addressed blob store, linked to `ref`
+    # (see document_ref), and returns the document fields for the record
     if uploaded_file is not None:
-        if not os.path.exists(destination_folder):
-            os.makedirs(destination_folder)
-        
-        file_path = os.path.join(destination_folder, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return file_path
+        blob_store = get_blob_store()
+        uploaded_file.seek(0)
+        sha256 = blob_store.put(uploaded_file, uploaded_file.name, ref, content_type=uploaded_file.type)
+        get_preview_cache().request(sha256) # Ready by the time a reviewer opens it
+        return {"document_path": blob_store.path(sha256), "document_sha256": sha256, "document_name": uploaded_file.name}
+    return {"document_path": None}
+
+def document_download_button(record, label="Download Supporting Document", key=None):
+    # Cached preview thumbnail plus a download button for a record's attached
+    # document. The file itself is only read when the button is clicked, not on
+    # every rerun of the page showing it.
+    # Returns False when the record has no document on disk.
+    document_path = record.get('document_path')
+    if not document_path or not os.path.exists(document_path):
+        return False
+    metadata = get_blob_store().metadata(record.get('document_sha256') or "") or {}
+
+    def read_document():
+        with open(document_path, "rb") as file:
+            return file.read()
+
+    preview_path = get_preview_cache().get(record.get('document_sha256'))
+    if preview_path:
+        st.image(preview_path, caption=record.get('document_name'), width=240)
+    elif get_preview_cache().is_pending(record.get('document_sha256')):
+        st.caption("Preview is being generated; it will appear on the next refresh.")
+    elif metadata.get('content_type') == "application/pdf" and st.session_state.current_user['role'] == 'admin':
+        from hr_previews import pdf_previews_available
+        if not pdf_previews_available():
+            st.caption("PDF previews are off: install PyMuPDF (`pip install pymupdf`) to enable them.")
+
+    size_kb = os.path.getsize(document_path) / 1024
+    st.download_button(
+        label=f"{label} ({size_kb:,.0f} KB)",
+        data=read_document,
+        file_name=record.get('document_name') or os.path.basename(document_path),
+        mime=metadata.get('content_type', "application/octet-stream"),
+        key=key
+    )
+    return True
+
+def table_export_controls(df, table_name, key):
+    # Format picker plus a download of exactly the rows and columns the table
+    # shows. The file is only built when the button is clicked, streaming the
+    # DataFrame's rows through hr_export in chunks rather than copying it.
+    export_format_col, export_button_col = st.columns([1, 3])
+    with export_format_col:
+        export_format = st.selectbox(
+            "Export format", available_export_formats(), format_func=lambda fmt: EXPORT_FORMATS[fmt]['label'],
+            key=f"{key}_export_format", label_visibility="collapsed"
+        )
+    columns = [str(column) for column in df.columns]
+
+    def build_export():
+        with get_metrics().timer("table_export", table=table_name, format=export_format) as sample:
+            data = export_bytes(lambda: df.itertuples(index=False, name=None), columns, export_format, sheet_name=table_name)
+            sample['bytes'] = len(data)
+        return data
+
+    with export_button_col:
+        st.download_button(
+            label=f"⬇️ Export {len(df):,} rows",
+            data=build_export,
+            file_name=f"{table_name.lower().replace(' ', '_')}_{date.today().isoformat()}.{export_format}",
+            mime=EXPORT_FORMATS[export_format]['mime'],
+            key=f"{key}_export"
+        )
+
+# --- Idempotent Submissions ---
+@st.cache_resource(show_spinner=False)
+def get_submission_tokens():
+    # One index per server process is enough: a session's reruns all run in the same process
+    return SubmissionTokenIndex()
+
+def claim_submission(form_name, *values):
+    # Idempotency token for a create form: this session's token and user plus the
+    # form and the submitted values. Returns the key if this is the first such submission,
+    # or None for a repeat (double-click, or a rerun replaying the submit), which
+    # the caller must not write. Claim right before writing: a rerun requested
+    # meanwhile only stops the script at its next st.* element.
+    # The key is built from the values rather than a token issued when the form is drawn:
+    # the browser cannot hand such a token back, so a server-side one rotated after each
+    # save would already be new when a double-click's second submit arrives. The price is
+    # that a genuinely identical second submission within SUBMISSION_TOKEN_TTL_S is
+    # refused too, which the message below tells the user.
+    session_token = st.session_state.setdefault('submission_session_token', uuid.uuid4().hex)
+    username = (st.session_state.current_user or {}).get('username')
+    key = submission_key(session_token, username, form_name, *values)
+    if get_submission_tokens().claim(key):
+        return key
+    st.info(f"An identical submission was made in the last {SUBMISSION_TOKEN_TTL_S // 60} minutes, so this one was ignored. "
+            "To submit the same details again on purpose, change one of the fields (e.g. add a note).")
     return None
 
+def release_submission(key):
+    # For submissions claimed before a check that then rejected them, so they can be retried
+    get_submission_tokens().release(key)
+
+@contextmanager
+def submission_write(key):
+    # Wraps the write of a claimed submission: if it raises, the claim is released so the
+    # user's retry is not refused as a repeat. st.rerun()/st.stop() are not Exceptions.
+    try:
+        yield
+    except Exception:
+        release_submission(key)
+        raise
+
 # --- Initial Data Setup (Users, Policies, Beneficiaries) ---
 def setup_initial_data():
     # Initial Users (Admin + 6 Staff Members)
@@ -100,7 +280,6 @@ def setup_initial_data():
                 "address": "123 Admin Lane, Lagos",
                 "phone_number": "+2348011112222",
                 "email_address": "abdul_bolaji@yahoo.com",
-                "training_attended": [],
                 "work_anniversary": "2010-09-01"
             }
         },
@@ -121,7 +300,6 @@ def setup_initial_data():
                 "address": "",
                 "phone_number": "",
                 "email_address": "ada.ama@example.com",
-                "training_attended": [],
                 "work_anniversary": "2024-01-15"
             }
         },
@@ -141,7 +319,6 @@ def setup_initial_data():
                 "address": "",
                 "phone_number": "",
                 "email_address": "udu.aka@example.com",
-                "training_attended": [],
                 "work_anniversary": "2024-03-01"
             }
         },
@@ -161,7 +338,6 @@ def setup_initial_data():
                 "address": "",
                 "phone_number": "",
                 "email_address": "abdulahi.ibrahim@example.com",
-                "training_attended": [],
                 "work_anniversary": "2024-02-10"
             }
         },
@@ -181,7 +357,6 @@ def setup_initial_data():
                 "address": "",
                 "phone_number": "",
                 "email_address": "addidas.puma@example.com",
-                "training_attended": [],
                 "work_anniversary": "2023-07-20"
             }
         },
@@ -201,7 +376,6 @@ def setup_initial_data():
                 "address": "",
                 "phone_number": "",
                 "email_address": "big.kola@example.com",
-                "training_attended": [],
                 "work_anniversary": "2022-04-05"
             }
         },
@@ -221,7 +395,6 @@ def setup_initial_data():
                 "address": "",
                 "phone_number": "",
                 "email_address": "king.queen@example.com",
-                "training_attended": [],
                 "work_anniversary": "2023-11-01"
             }
         }
@@ -265,21 +438,297 @@ if 'current_user' not in st.session_state: # Stores full user object if logged i
 if 'current_page' not in st.session_state:
     st.session_state.current_page = "login"
 
+# Profile this whole rerun, data loading included, if slow-rerun profiling is on
+rerun_profile = get_profiler().start(
+    st.session_state.current_page if st.session_state.logged_in else "login",
+    (st.session_state.current_user or {}).get('role', 'anonymous')
+)
+
+# Finish any multi-file write that was interrupted before loading data
+recover_pending_transaction()
+
 # Load all persistent data into session state
-st.session_state.users = load_data(USERS_FILE)
-st.session_state.leave_requests = load_data(LEAVE_REQUESTS_FILE, [])
-st.session_state.opex_capex_requests = load_data(OPEX_CAPEX_REQUESTS_FILE, [])
-st.session_state.performance_goals = load_data(PERFORMANCE_GOALS_FILE, [])
-st.session_state.self_appraisals = load_data(SELF_APPRAISALS_FILE, [])
-st.session_state.payroll_data = load_data(PAYROLL_FILE, []) # New payroll data
-st.session_state.beneficiaries = load_data(BENEFICIARIES_FILE, {}) # New beneficiaries data
-st.session_state.hr_policies = load_data(HR_POLICIES_FILE, {}) # New policies data
+load_session_data("users", USERS_FILE)
+load_session_data("leave_requests", LEAVE_REQUESTS_FILE, [])
+load_session_data("opex_capex_requests", OPEX_CAPEX_REQUESTS_FILE, [])
+load_session_data("performance_goals", PERFORMANCE_GOALS_FILE, [])
+load_session_data("self_appraisals", SELF_APPRAISALS_FILE, [])
+load_session_data("payroll_data", PAYROLL_FILE, []) # New payroll data
+load_session_data("beneficiaries", BENEFICIARIES_FILE, {}) # New beneficiaries data
+load_session_data("hr_policies", HR_POLICIES_FILE, {}) # New policies data
+load_session_data("public_holidays", PUBLIC_HOLIDAYS_FILE, []) # ISO dates, excluded from leave day counts
 
 # Ensure payroll data has necessary columns for DataFrame creation
 # This handles cases where payroll.json might be empty or malformed initially
 if not st.session_state.payroll_data:
     st.session_state.payroll_data = [] # Ensure it's an empty list if data is missing
 
+# --- Dashboard Aggregates ---
+@st.cache_resource(show_spinner=False)
+def _dashboard_aggregates():
+    return DashboardAggregates()
+
+def get_dashboard_aggregates():
+    aggregates = _dashboard_aggregates()
+    if not aggregates.is_current(): # First use, or a data file was changed outside this process
+        aggregates.rebuild(st.session_state.users, st.session_state.leave_requests, st.session_state.opex_capex_requests)
+    return aggregates
+
+# --- Leave Calendar ---
+@st.cache_resource(show_spinner=False)
+def _leave_calendar_holder():
+    return {} # "calendar" -> hr_calendar.LeaveCalendar, once a page has needed it
+
+def get_leave_calendar():
+    # Only called from pages that declare the "hr_calendar" import
+    holder = _leave_calendar_holder()
+    if holder.get("calendar") is None or not holder["calendar"].is_current():
+        holder["calendar"] = hr_calendar.LeaveCalendar(st.session_state.leave_requests)
+    return holder["calendar"]
+
+# --- Leave Interval Index ---
+@st.cache_resource(show_spinner=False)
+def _leave_interval_index_holder():
+    return {} # "index" -> LeaveIntervalIndex, once leave has been checked for clashes
+
+def get_leave_interval_index():
+    holder = _leave_interval_index_holder()
+    if holder.get("index") is None or not holder["index"].is_current():
+        department_by_staff_id = {entry['staff_id']: entry['department'] for entry in get_staff_directory().entries}
+        holder["index"] = LeaveIntervalIndex(st.session_state.leave_requests, department_by_staff_id)
+    return holder["index"]
+
+def check_leave_clashes(staff_id, department, start_date, end_date, request_id=None):
+    # Returns (the applicant's own clashing requests, peak staff of the department away
+    # during the range including the applicant, department headcount)
+    leave_index = get_leave_interval_index()
+    own_clashes = [
+        clash for clash in leave_index.staff_overlaps(staff_id, start_date, end_date)
+        if request_id is None or clash[3] != request_id
+    ]
+    peak_out = leave_index.department_peak_out(department, start_date, end_date, extra_staff_id=staff_id)
+    return own_clashes, peak_out, get_dashboard_aggregates().department_counts.get(department, 0)
+
+# --- Leave Balances ---
+@st.cache_resource(show_spinner=False)
+def _leave_ledger_holder():
+    return {} # "ledger" -> LeaveLedger, once a balance has been needed
+
+def get_leave_ledger():
+    holder = _leave_ledger_holder()
+    if holder.get("ledger") is None or not holder["ledger"].is_current():
+        holder["ledger"] = LeaveLedger(st.session_state.leave_requests, parse_holidays(st.session_state.public_holidays))
+    return holder["ledger"]
+
+def get_leave_balance(user, leave_type, year=None):
+    profile = user.get('profile', {})
+    try:
+        joined_on = date.fromisoformat(str(profile.get('work_anniversary')))
+    except ValueError:
+        joined_on = None
+    return get_leave_ledger().balance(get_staff_id(user), leave_type, profile.get('grade_level', ''), year=year, joined_on=joined_on)
+
+# --- Keeping Derived Views in Sync ---
+def _derived_views():
+    views = [_dashboard_aggregates()]
+    for holder, key in ((_leave_calendar_holder(), "calendar"), (_leave_interval_index_holder(), "index"), (_leave_ledger_holder(), "ledger")):
+        if holder.get(key) is not None:
+            views.append(holder[key])
+    return views
+
+def record_change(kind, before=None, after=None):
+    # Keeps the dashboard aggregates and leave indexes in step with a user ("users"), leave
+    # request ("leave") or requisition ("opex") added, changed or removed by this app.
+    # `before` must be a copy taken before any in-place edit. Call before save_data.
+    for view in _derived_views():
+        view.apply(kind, before, after)
+
+def mark_derived_views_synced(filename, previous_signature):
+    for view in _derived_views():
+        view.mark_synced(filename, previous_signature)
+
+# --- Figure Cache ---
+# Built Plotly figures shared by all sessions, keyed by chart ID and the version of
+# the data behind them. Building a figure with plotly.express dominates chart render
+# time; handing Streamlit the cached figure only costs its final JSON serialisation.
+@st.cache_resource(show_spinner=False)
+def _figure_cache():
+    return {} # chart_id -> (data_version, figure)
+
+def cached_figure(chart_id, data_version, build_figure):
+    figure_cache = _figure_cache()
+    cached = figure_cache.get(chart_id)
+    if cached is None or cached[0] != data_version:
+        cached = (data_version, build_figure())
+        figure_cache[chart_id] = cached
+    return cached[1]
+
+# --- Training Records ---
+@st.cache_resource(show_spinner=False)
+def _open_training_store():
+    return TrainingStore()
+
+def get_training_store():
+    training_store = _open_training_store()
+    training_store.refresh()
+    return training_store
+
+# One-off move of training records that used to live inside users.json
+if migrate_training_records(st.session_state.users, get_training_store()):
+    save_data(st.session_state.users, USERS_FILE)
+
+# --- Document Blob Store ---
+@st.cache_resource(show_spinner=False)
+def _open_blob_store():
+    return BlobStore()
+
+def get_blob_store():
+    blob_store = _open_blob_store()
+    blob_store.refresh()
+    return blob_store
+
+# --- Record Archive ---
+@st.cache_resource(show_spinner=False)
+def get_record_archive():
+    return RecordArchive()
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_archive_partition(table, period, partition_signature):
+    # Keyed by the partition's file signature, so a re-archived month is read afresh
+    return get_record_archive().read(table, period)
+
+def archived_records_picker(table, hot_records, key, belongs=None):
+    # Lets a history view reach back into the record archive: the user picks how
+    # far back to go and only those monthly partitions are read. Returns the
+    # archived records `belongs` accepts, minus any still in `hot_records`.
+    record_archive = get_record_archive()
+    periods = record_archive.periods(table)
+    if not periods:
+        return []
+    back_to = st.selectbox(
+        "Include archived records back to", ["None (open and recent only)"] + periods, key=f"{key}_archive_back_to",
+        format_func=lambda period: datetime.strptime(period, "%Y-%m").strftime("%B %Y") if period in periods else period,
+        help="Closed records are moved to the archive after a while. Older months are only read when selected."
+    )
+    if back_to not in periods:
+        return []
+    hot_keys = {record_key(table, record) for record in hot_records}
+    archived = []
+    for period in periods[:periods.index(back_to) + 1]:
+        partition_signature = file_signature(record_archive.partition_path(table, period))
+        archived.extend(record for record in read_archive_partition(table, period, partition_signature)
+                        if (belongs is None or belongs(record)) and record_key(table, record) not in hot_keys)
+    return archived
+
+@st.cache_resource(show_spinner=False)
+def get_preview_cache():
+    from hr_previews import PreviewCache # Pillow is only needed once a document is shown
+    return PreviewCache(_open_blob_store())
+
+# --- Background Jobs ---
+@st.cache_resource(show_spinner=False)
+def get_job_runner():
+    # One runner per server process, shared by every session
+    return JobRunner()
+
+def submit_job(kind, description, func, *args, **kwargs):
+    job_id = get_job_runner().submit(kind, description, func, *args, submitted_by=st.session_state.current_user.get('username'), **kwargs)
+    st.session_state.last_job_id = job_id
+    return job_id
+
+# One-off move of supporting documents saved under their upload name into the blob store
+if migrate_legacy_documents(st.session_state.leave_requests, "leave", "request_id", get_blob_store()):
+    save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
+if migrate_legacy_documents(st.session_state.opex_capex_requests, "opex", "req_id", get_blob_store()):
+    save_data(st.session_state.opex_capex_requests, OPEX_CAPEX_REQUESTS_FILE)
+
+# Finish an offboarding that committed but died before purging archived and training records
+finish_offboarding(get_record_archive(), get_training_store())
+
+# --- Staff Directory ---
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _build_staff_directory(users_signature, _users):
+    return StaffDirectory(_users)
+
+def get_staff_directory():
+    # Rebuilt only when users.json changes on disk
+    return _build_staff_directory(file_signature(USERS_FILE), st.session_state.users)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _build_annual_date_indexes(users_signature, _users):
+    return {field: AnnualDateIndex(_users, field) for field in ("date_of_birth", "work_anniversary")}
+
+def get_annual_date_indexes():
+    # Birthday and work anniversary indexes, rebuilt only when users.json changes
+    return _build_annual_date_indexes(file_signature(USERS_FILE), st.session_state.users)
+
+def get_approver_options(approver_field):
+    staff_directory = get_staff_directory()
+    eligible = staff_directory.search(departments=APPROVER_DEPARTMENTS[approver_field], include_admins=True)
+    if not eligible: # Nobody in the approving department yet, so don't block submissions
+        eligible = staff_directory.search()
+    return [""] + [entry['name'] for entry in eligible]
+
+# --- Lazy Heavy Imports ---
+# pandas, plotly, fpdf and numpy are only imported once a page that needs them is shown,
+# so the login screen and light pages never pay for them. Pages list the names
+# they use in their @page_route declaration.
+LAZY_IMPORTS = {
+    "pd": ("pandas", None),
+    "px": ("plotly.express", None),
+    "hr_payslips": ("hr_payslips", None), # Pulls in fpdf
+    "hr_calendar": ("hr_calendar", None), # Pulls in numpy
+}
+pd = px = hr_payslips = hr_calendar = None
+
+def ensure_imports(*names):
+    for name in names:
+        if globals()[name] is None:
+            module_name, attribute = LAZY_IMPORTS[name]
+            module = importlib.import_module(module_name)
+            globals()[name] = getattr(module, attribute) if attribute else module
+
+# --- Page Registry ---
+# current_page -> {"handler", "roles", "imports"}; filled by @page_route below
+PAGE_REGISTRY = {}
+
+def page_route(name, roles=None, imports=()):
+    # roles=None means any logged-in user may open the page
+    def register(handler):
+        PAGE_REGISTRY[name] = {"handler": handler, "roles": roles, "imports": imports}
+        return handler
+    return register
+
+def render_page(page_name):
+    page = PAGE_REGISTRY.get(page_name)
+    if page is None:
+        return
+    current_user = st.session_state.current_user
+    if page["roles"] is not None and not (current_user and current_user['role'] in page["roles"]):
+        st.error("Access Denied: You do not have permission to view this page.")
+        st.session_state.current_page = "dashboard" # Redirect to dashboard
+        st.rerun()
+    with get_metrics().timer("page_render", page=page_name): # Includes the page's first-use imports
+        ensure_imports(*page["imports"])
+        page["handler"]()
+
+def page_fragment(panel):
+    # st.fragment for a panel within a page: widgets inside it rerun only the
+    # panel, skipping the data loading, sidebar and rest of the page. Those
+    # reruns are timed as "fragment_render" (full reruns also count them).
+    @functools.wraps(panel)
+    def timed_panel(*args, **kwargs):
+        with get_metrics().timer("fragment_render", fragment=panel.__name__):
+            for message, icon in st.session_state.pop('queued_toasts', []):
+                st.toast(message, icon=icon)
+            return panel(*args, **kwargs)
+    return st.fragment(timed_panel)
+
+def queue_toast(message, icon=None):
+    # For widget callbacks, which must not draw anything during a fragment rerun;
+    # the panel shows the toast as it reruns
+    st.session_state.setdefault('queued_toasts', []).append((message, icon))
+
 # --- Common UI Elements ---
 def display_logo():
     if os.path.exists(LOGO_PATH):
@@ -298,6 +747,7 @@ def display_sidebar():
         st.sidebar.button("📊 Dashboard", key="nav_dashboard", on_click=lambda: st.session_state.update(current_page="dashboard"))
         st.sidebar.button("📝 My Profile", key="nav_my_profile", on_click=lambda: st.session_state.update(current_page="my_profile"))
         st.sidebar.button("🏖️ Apply for Leave", key="nav_apply_leave", on_click=lambda: st.session_state.update(current_page="leave_request"))
+        st.sidebar.button("📅 Leave Calendar", key="nav_leave_calendar", on_click=lambda: st.session_state.update(current_page="leave_calendar"))
         st.sidebar.button("📈 Performance Goal Setting", key="nav_performance_goals", on_click=lambda: st.session_state.update(current_page="performance_goal_setting"))
         st.sidebar.button("✍️ Self-Appraisal", key="nav_self_appraisal", on_click=lambda: st.session_state.update(current_page="self_appraisal"))
         st.sidebar.button("📄 HR Policies", key="nav_hr_policies", on_click=lambda: st.session_state.update(current_page="hr_policies"))
@@ -312,6 +762,11 @@ def display_sidebar():
             st.sidebar.button("✅ Manage OPEX/CAPEX Approvals", key="admin_manage_approvals", on_click=lambda: st.session_state.update(current_page="manage_opex_capex_approvals")) # New
             st.sidebar.button("🏦 Manage Beneficiaries", key="admin_manage_beneficiaries", on_click=lambda: st.session_state.update(current_page="manage_beneficiaries")) # New
             st.sidebar.button("📜 Manage HR Policies", key="admin_manage_policies", on_click=lambda: st.session_state.update(current_page="manage_hr_policies")) # New
+            st.sidebar.button("🎓 Training Reports", key="admin_training_reports", on_click=lambda: st.session_state.update(current_page="training_reports"))
+            st.sidebar.button("📉 System Metrics", key="admin_system_metrics", on_click=lambda: st.session_state.update(current_page="system_metrics"))
+            st.sidebar.button("🔬 Slow Rerun Profiles", key="admin_profiles", on_click=lambda: st.session_state.update(current_page="profiles"))
+            active_jobs = get_job_runner().active_count()
+            st.sidebar.button(f"⚙️ Background Jobs{f' ({active_jobs} running)' if active_jobs else ''}", key="admin_jobs", on_click=lambda: st.session_state.update(current_page="jobs"))
 
         st.sidebar.markdown("---")
         st.sidebar.button("Logout", key="nav_logout", on_click=logout)
@@ -337,7 +792,7 @@ def login_form():
             for user in st.session_state.users:
                 # Check for both username and email (for admin login)
                 if user['username'] == username_input:
-                    if pbkdf2_sha256.verify(password_input, user['password']):
+                    if verify_password(password_input, user['password']):
                         found_user = user
                         break
             
@@ -351,130 +806,91 @@ def login_form():
                 st.error("Invalid credentials")
 
 # --- Dashboard Display ---
+@page_route("dashboard", imports=("pd", "px"))
 def display_dashboard():
     st.title("📊 Polaris Digitech HR Portal - Dashboard")
 
     if st.session_state.current_user:
         current_user_profile = st.session_state.current_user.get('profile', {})
         st.markdown(f"## Welcome, {current_user_profile.get('name', st.session_state.current_user['username']).title()}!")
-        st.write(f"Your Staff ID: **{current_user_profile.get('staff_id', 'N/A')}**")
+        st.write(f"Your Staff ID: **{get_staff_id(st.session_state.current_user) or 'N/A'}**")
         st.write(f"Department: **{current_user_profile.get('department', 'N/A')}**")
 
         st.markdown("---")
         st.subheader("Upcoming Birthdays")
         today = date.today()
-        upcoming_birthdays = []
-        for user in st.session_state.users:
-            profile = user.get('profile', {})
-            dob_str = profile.get('date_of_birth')
-            name = profile.get('name')
-            if dob_str and name:
-                try:
-                    dob = datetime.strptime(dob_str, '%Y-%m-%d').date()
-                    # Calculate birthday for current year
-                    birthday_this_year = dob.replace(year=today.year)
-                    # If birthday already passed this year, check next year
-                    if birthday_this_year < today:
-                        birthday_this_year = dob.replace(year=today.year + 1)
-                    
-                    days_until_birthday = (birthday_this_year - today).days
-
-                    if 0 <= days_until_birthday <= 30: # Within next 30 days
-                        upcoming_birthdays.append({
-                            "Name": name,
-                            "Birthday": birthday_this_year.strftime('%B %d'),
-                            "Days Until": days_until_birthday
-                        })
-                except ValueError:
-                    continue # Skip if DOB is malformed
+        date_indexes = get_annual_date_indexes()
+        upcoming_birthdays = [
+            {"Name": name, "Birthday": occurrence.strftime('%B %d'), "Days Until": days_until}
+            for occurrence, days_until, name, _ in date_indexes['date_of_birth'].upcoming(today, days=30)
+        ]
 
         if upcoming_birthdays:
-            df_birthdays = pd.DataFrame(upcoming_birthdays).sort_values(by="Days Until")
+            df_birthdays = pd.DataFrame(upcoming_birthdays) # Already sorted by days until
             st.dataframe(df_birthdays, use_container_width=True, hide_index=True)
-            if any(b['Days Until'] == 0 for b in upcoming_birthdays):
+            if upcoming_birthdays[0]['Days Until'] == 0:
                 st.balloons()
                 st.success("🎉 Happy Birthday to our staff members today! 🎉")
         else:
             st.info("No upcoming birthdays in the next 30 days.")
 
+        st.subheader("Upcoming Work Anniversaries")
+        upcoming_anniversaries = [
+            {"Name": name, "Anniversary": occurrence.strftime('%B %d'), "Years": occurrence.year - joined.year, "Days Until": days_until}
+            for occurrence, days_until, name, joined in date_indexes['work_anniversary'].upcoming(today, days=30)
+            if occurrence.year > joined.year # Skip staff who only joined this year
+        ]
+        if upcoming_anniversaries:
+            st.dataframe(pd.DataFrame(upcoming_anniversaries), use_container_width=True, hide_index=True)
+            if upcoming_anniversaries[0]['Days Until'] == 0:
+                st.success("🏅 Happy work anniversary to our staff members celebrating today! 🏅")
+        else:
+            st.info("No work anniversaries in the next 30 days.")
+
         st.markdown("---")
         st.subheader("HR Analytics Overview")
 
-        total_employees = len(st.session_state.users)
-        st.metric("Total Employees", total_employees)
+        # All counts come from the precomputed aggregates, not from scanning the data
+        aggregates = get_dashboard_aggregates()
+        st.metric("Total Employees", aggregates.total_users)
 
         # Staff Distribution by Department
-        if st.session_state.users:
-            departments = [user.get('profile', {}).get('department', 'Unassigned') for user in st.session_state.users]
-            df_departments = pd.DataFrame(departments, columns=['Department'])
-            dept_counts = df_departments['Department'].value_counts().reset_index()
-            dept_counts.columns = ['Department', 'Count']
-            fig_dept = px.pie(dept_counts, values='Count', names='Department', title='Staff Distribution by Department', hole=0.3)
+        if aggregates.department_counts:
+            fig_dept = cached_figure("dashboard_department_pie", aggregates.versions["department"], lambda: px.pie(
+                pd.DataFrame(aggregates.department_counts.most_common(), columns=['Department', 'Count']),
+                values='Count', names='Department', title='Staff Distribution by Department', hole=0.3))
             st.plotly_chart(fig_dept, use_container_width=True)
 
             # Staff Distribution by Gender
-            genders = [user.get('profile', {}).get('gender', 'N/A') for user in st.session_state.users]
-            df_genders = pd.DataFrame(genders, columns=['Gender'])
-            gender_counts = df_genders['Gender'].value_counts().reset_index()
-            gender_counts.columns = ['Gender', 'Count']
-            fig_gender = px.pie(gender_counts, values='Count', names='Gender', title='Staff Distribution by Gender', hole=0.3)
+            fig_gender = cached_figure("dashboard_gender_pie", aggregates.versions["gender"], lambda: px.pie(
+                pd.DataFrame(aggregates.gender_counts.most_common(), columns=['Gender', 'Count']),
+                values='Count', names='Gender', title='Staff Distribution by Gender', hole=0.3))
             st.plotly_chart(fig_gender, use_container_width=True)
         else:
             st.info("No staff data to display distributions.")
 
         # Staff On Leave
-        current_on_leave = 0
-        today = date.today()
-        for req in st.session_state.leave_requests:
-            try:
-                start_date = datetime.strptime(req.get('start_date', '1900-01-01'), '%Y-%m-%d').date()
-                end_date = datetime.strptime(req.get('end_date', '1900-01-01'), '%Y-%m-%d').date()
-                if start_date <= today <= end_date and req.get('status') == 'Approved':
-                    current_on_leave += 1
-            except ValueError:
-                continue # Skip malformed date entries
-        st.metric("Staff Currently On Leave (Approved)", current_on_leave)
+        st.metric("Staff Currently On Leave (Approved)", aggregates.on_leave(date.today()))
 
         st.markdown("---")
         st.subheader("Your Pending Requests")
-    # 🔔 Notify if current user is an approver on any pending requests
-    approver_name = st.session_state.current_user.get('profile', {}).get('name')
-    pending_approver_tasks = []
-
-    for req in st.session_state.opex_capex_requests:
-        if (
-            (req.get('admin_manager_approver') == approver_name and req.get('status_admin_manager') == "Pending") or
-            (req.get('hr_manager_approver') == approver_name and req.get('status_hr_manager') == "Pending") or
-            (req.get('finance_manager_approver') == approver_name and req.get('status_finance_manager') == "Pending") or
-            (req.get('md_approver') == approver_name and req.get('status_md') == "Pending")
-        ):
-            pending_approver_tasks.append(req)
-
-    if pending_approver_tasks:
-        st.warning(f"🔔 You have {len(pending_approver_tasks)} OPEX/CAPEX requisition(s) awaiting your approval.")
+        pending_counts = aggregates.pending_for_user(st.session_state.current_user)
 
-        
-        user_pending_leave = [
-            req for req in st.session_state.leave_requests 
-            if req.get('staff_id') == current_user_profile.get('staff_id') and req.get('status') == 'Pending'
-        ]
-        user_pending_opex_capex = [
-            req for req in st.session_state.opex_capex_requests 
-            if req.get('requester_staff_id') == current_user_profile.get('staff_id') and req.get('final_status') == 'Pending'
-        ]
+        # 🔔 Notify if current user is an approver on any pending requests
+        if pending_counts['approvals']:
+            st.warning(f"🔔 You have {pending_counts['approvals']} OPEX/CAPEX requisition(s) awaiting your approval.")
 
-        if user_pending_leave:
-            st.info(f"You have {len(user_pending_leave)} pending leave requests.")
-        if user_pending_opex_capex:
-            st.info(f"You have {len(user_pending_opex_capex)} pending OPEX/CAPEX requests.")
-        if not user_pending_leave and not user_pending_opex_capex:
+        if pending_counts['leave']:
+            st.info(f"You have {pending_counts['leave']} pending leave requests.")
+        if pending_counts['opex']:
+            st.info(f"You have {pending_counts['opex']} pending OPEX/CAPEX requests.")
+        if not pending_counts['leave'] and not pending_counts['opex']:
             st.info("You have no pending requests.")
-
-
     else:
         st.warning("User not logged in.")
 
 # --- My Profile Page ---
+@page_route("my_profile")
 def display_my_profile():
     st.title("📝 My Profile")
 
@@ -488,6 +904,7 @@ def display_my_profile():
         st.error("Could not find your profile. Please log out and log in again.")
         return
 
+    user_before_edit = copy.deepcopy(st.session_state.users[user_index]) # The form below edits the profile in place
     current_user_profile = st.session_state.users[user_index]['profile']
 
     with st.form("profile_edit_form"):
@@ -543,12 +960,23 @@ def display_my_profile():
                     st.error("New password and confirm password do not match.")
                     st.rerun() # Stop execution to show error
             
+            record_change("users", user_before_edit, st.session_state.users[user_index])
             save_data(st.session_state.users, USERS_FILE)
             st.success("Profile details saved successfully!")
             st.rerun()
 
     st.markdown("---")
     st.subheader("Training Attended")
+    training_records_panel(get_staff_id(st.session_state.users[user_index]))
+
+def delete_training_record(training_id):
+    # "x" button callback; the training fragment reruns without the record
+    get_training_store().delete(training_id)
+    queue_toast("Training record deleted.")
+
+# Adding or deleting a training record reruns only this fragment
+@page_fragment
+def training_records_panel(current_staff_id):
     with st.form("new_training_form"):
         new_training_name = st.text_input("New Training Name")
         new_training_date = st.date_input("Training Date", value=datetime.now())
@@ -556,25 +984,20 @@ def display_my_profile():
         add_training_button = st.form_submit_button("Add Training Record")
 
         if add_training_button:
-            if new_training_name:
-                training_record = {"name": new_training_name, "date": str(new_training_date)}
-                # Ensure 'training_attended' key exists in profile
-                if "training_attended" not in current_user_profile:
-                    current_user_profile["training_attended"] = []
-                current_user_profile["training_attended"].append(training_record)
-                save_data(st.session_state.users, USERS_FILE)
-                st.success(f"Added training: {new_training_name}")
-                st.rerun()
-            else:
+            if not new_training_name:
                 st.error("Training name cannot be empty.")
+            elif submission := claim_submission("training_record", current_staff_id, new_training_name, new_training_date):
+                with submission_write(submission):
+                    get_training_store().add(current_staff_id, new_training_name, new_training_date)
+                st.success(f"Added training: {new_training_name}") # The list below already includes it
 
-    current_trainings = current_user_profile.get("training_attended", [])
+    current_trainings = get_training_store().for_staff(current_staff_id)
     if current_trainings:
         st.write("---")
         st.markdown("#### Existing Training Records:")
         training_container = st.container()
         with training_container:
-            for i, training in enumerate(current_trainings):
+            for training in current_trainings:
                 col_tr1, col_tr2, col_tr3 = st.columns([0.6, 0.3, 0.1])
                 with col_tr1:
                     st.write(f"- **{training.get('name', 'N/A')}**")
@@ -582,21 +1005,29 @@ def display_my_profile():
                     st.write(f"({training.get('date', 'N/A')})")
                 with col_tr3:
                     # Use a unique key for the button
-                    if st.button("x", key=f"delete_training_{i}_btn_{training.get('name', '')}"):
-                        current_user_profile["training_attended"].pop(i)
-                        save_data(st.session_state.users, USERS_FILE)
-                        st.info("Training record deleted.")
-                        st.rerun()
+                    st.button("x", key=f"delete_training_{training['training_id']}_btn", on_click=delete_training_record, args=(training['training_id'],))
     else:
         st.info("No training records added yet.")
 
 
 # --- Leave Request Form (Existing) ---
+@page_route("leave_request")
 def leave_request_form():
     st.title("🏖️ Apply for Leave")
     st.write("Fill out the form below to submit a leave request.")
 
     current_user_profile = st.session_state.current_user.get('profile', {})
+
+    # This year's balances, in working days (weekends and public holidays excluded)
+    st.subheader(f"Your Leave Balances ({date.today().year})")
+    balance_rows = []
+    for balance_leave_type in LEAVE_ENTITLEMENTS:
+        balance = get_leave_balance(st.session_state.current_user, balance_leave_type)
+        balance_rows.append({
+            "Leave Type": balance_leave_type, "Yearly Entitlement": balance['entitlement'], "Accrued to Date": balance['accrued'],
+            "Approved": balance['approved'], "Pending": balance['pending'], "Available": balance['available'],
+        })
+    st.dataframe(balance_rows, use_container_width=True, hide_index=True)
     
     with st.form("leave_application_form"):
         st.subheader(f"Leave Application for {current_user_profile.get('name', 'N/A')}")
@@ -606,9 +1037,9 @@ def leave_request_form():
         end_date = st.date_input("End Date", value=datetime.now().date() + timedelta(days=7))
         reason = st.text_area("Reason for Leave", height=100)
         
-        # Calculate number of days
-        num_days = (end_date - start_date).days + 1
-        st.info(f"Number of days requested: {num_days} days")
+        # Calculate number of working days
+        num_days = get_leave_ledger().working_days(start_date, end_date)
+        st.info(f"Number of working days requested: {num_days} days")
 
         supporting_document = st.file_uploader("Upload Supporting Document (Optional)", type=["pdf", "jpg", "jpeg", "png"])
         
@@ -618,41 +1049,90 @@ def leave_request_form():
             if start_date > end_date:
                 st.error("End Date cannot be before Start Date.")
             elif num_days <= 0:
-                st.error("Number of days requested must be at least 1.")
-            else:
-                doc_path = save_uploaded_file(supporting_document, "leave_documents")
-                
-                new_request = {
-                    "request_id": len(st.session_state.leave_requests) + 1,
-                    "staff_id": current_user_profile.get('staff_id', 'N/A'),
-                    "staff_name": current_user_profile.get('name', 'N/A'),
-                    "leave_type": leave_type,
-                    "start_date": str(start_date),
-                    "end_date": str(end_date),
-                    "num_days": num_days,
-                    "reason": reason,
-                    "document_path": doc_path,
-                    "submission_date": str(datetime.now().date()),
-                    "status": "Pending" # Initial status
-                }
-                st.session_state.leave_requests.append(new_request)
-                save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
+                st.error("The selected dates fall entirely on weekends or public holidays.")
+            elif submission := claim_submission("leave_request", leave_type, start_date, end_date, reason,
+                                                supporting_document and (supporting_document.name, supporting_document.size)):
+                # Claimed before the balance and clash checks, which a repeat of this very request would fail
+                # Leave spanning New Year is checked against each year's balance, as the ledger charges it
+                for year, year_days in get_leave_ledger().working_days_by_year(start_date, end_date).items():
+                    available = get_leave_balance(st.session_state.current_user, leave_type, year)['available']
+                    if available is not None and year_days > available:
+                        release_submission(submission)
+                        st.error(f"Insufficient {leave_type} balance for {year}: {year_days} working days requested, {available} available.")
+                        return
+
+                staff_id = get_staff_id(st.session_state.current_user) or 'N/A'
+                department = current_user_profile.get('department') or 'Unassigned'
+                own_clashes, peak_out, department_size = check_leave_clashes(staff_id, department, start_date, end_date)
+                if own_clashes:
+                    release_submission(submission)
+                    clash_list = ", ".join(f"{start} to {end}" for start, end, _, _ in sorted(own_clashes))
+                    st.error(f"This request overlaps your existing pending or approved leave ({clash_list}). Please change the dates.")
+                    return
+
+                with submission_write(submission):
+                    # Above every ID in use or archived, so IDs (and document refs) stay unique after deletions and archiving
+                    request_id = get_record_archive().allocate_ids("leave", st.session_state.leave_requests)
+                    new_request = {
+                        "request_id": request_id,
+                        "staff_id": staff_id,
+                        "staff_name": current_user_profile.get('name', 'N/A'),
+                        "leave_type": leave_type,
+                        "start_date": str(start_date),
+                        "end_date": str(end_date),
+                        "num_days": num_days,
+                        "reason": reason,
+                        "submission_date": str(datetime.now().date()),
+                        "status": "Pending" # Initial status
+                    }
+                    new_request.update(save_uploaded_file(supporting_document, document_ref("leave", request_id)))
+                    st.session_state.leave_requests.append(new_request)
+                    record_change("leave", None, new_request)
+                    save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
                 st.success("Leave request submitted successfully! It is now pending approval.")
-                st.rerun()
+                if department_size and peak_out * 100 > department_size * DEPARTMENT_LEAVE_WARNING_PERCENT:
+                    # Keep the warning on screen instead of rerunning it away
+                    st.warning(f"Heads up: up to {peak_out} of {department_size} staff in {department} will be away during these dates, including you.")
+                else:
+                    st.rerun()
 
 # --- View Leave Applications (Admin/Manager View) ---
+@page_route("view_leave_applications", imports=("pd",))
 def view_leave_applications():
     st.title("📋 View Leave Applications")
+    leave_applications_panel()
+
+def set_leave_request_status(request_id, status):
+    # Approve/Reject button callback; the panel's fragment then reruns to show the new status
+    reload_if_changed("leave_requests", LEAVE_REQUESTS_FILE, [])
+    for i, req in enumerate(st.session_state.leave_requests):
+        if req.get('request_id') == request_id:
+            request_before = dict(req)
+            st.session_state.leave_requests[i]['status'] = status
+            record_change("leave", request_before, st.session_state.leave_requests[i])
+            break
+    else: # Archived or deleted since the page was drawn
+        queue_toast(f"Leave request {request_id} is no longer open.", icon="⚠️")
+        return
+    save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
+    queue_toast(f"Leave request {request_id} {status.lower()}.", icon="✅" if status == "Approved" else "🚫")
 
+# Table and approval panel as one fragment, so a status change redraws both
+@page_fragment
+def leave_applications_panel():
     # Filter for logged-in user if not admin
     if st.session_state.current_user['role'] == 'admin':
         st.subheader("All Leave Requests")
         display_requests_raw = st.session_state.leave_requests
     else:
         st.subheader("Your Leave Requests")
-        current_staff_id = st.session_state.current_user['profile'].get('staff_id')
+        current_staff_id = get_staff_id(st.session_state.current_user)
         display_requests_raw = [req for req in st.session_state.leave_requests if req.get('staff_id') == current_staff_id]
-        
+    display_requests_raw = display_requests_raw + archived_records_picker(
+        "leave", display_requests_raw, key="leave_requests",
+        belongs=None if st.session_state.current_user['role'] == 'admin' else lambda req: req.get('staff_id') == current_staff_id
+    )
+
     if not display_requests_raw:
         st.info("No leave applications to display.")
         return
@@ -688,6 +1168,7 @@ def view_leave_applications():
     final_display_cols = [col for col in display_cols_for_df if col in df_leave_requests_sorted.columns]
 
     st.dataframe(df_leave_requests_sorted[final_display_cols], use_container_width=True, hide_index=True)
+    table_export_controls(df_leave_requests_sorted[final_display_cols], "Leave Requests", key="leave_requests")
 
     if st.session_state.current_user['role'] == 'admin':
         st.markdown("---")
@@ -710,38 +1191,86 @@ def view_leave_applications():
             st.write(f"**Leave Type:** {selected_request.get('leave_type', 'N/A')}")
             st.write(f"**Dates:** {selected_request.get('start_date', 'N/A')} to {selected_request.get('end_date', 'N/A')} ({selected_request.get('num_days', 'N/A')} days)")
             st.write(f"**Reason:** {selected_request.get('reason', 'N/A')}")
-            if selected_request.get('document_path') and os.path.exists(selected_request['document_path']):
-                with open(selected_request['document_path'], "rb") as file:
-                    btn = st.download_button(
-                        label="Download Supporting Document",
-                        data=file.read(),
-                        file_name=os.path.basename(selected_request['document_path']),
-                        mime="application/octet-stream"
-                    )
-            else:
+            request_dates = leave_date_range(selected_request)
+            if request_dates:
+                applicant = next((entry for entry in get_staff_directory().entries if entry['staff_id'] == selected_request.get('staff_id')), None)
+                department = applicant['department'] if applicant else 'Unassigned'
+                own_clashes, peak_out, department_size = check_leave_clashes(selected_request.get('staff_id'), department, *request_dates, request_id=request_id)
+                if own_clashes:
+                    st.warning(f"Overlaps {len(own_clashes)} other pending/approved request(s) by the same staff member.")
+                if department_size:
+                    st.write(f"**{department} Cover:** up to {peak_out} of {department_size} staff away during these dates (pending and approved)")
+            if not document_download_button(selected_request, key=f"download_document_{request_id}"):
                 st.info("No supporting document uploaded.")
 
             col_approve, col_reject = st.columns(2)
             with col_approve:
-                if st.button("Approve Request", key=f"approve_{request_id}"):
-                    for i, req in enumerate(st.session_state.leave_requests):
-                        if req.get('request_id') == request_id:
-                            st.session_state.leave_requests[i]['status'] = 'Approved'
-                            break
-                    save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
-                    st.success(f"Leave request {request_id} approved.")
-                    st.rerun()
+                st.button("Approve Request", key=f"approve_{request_id}", on_click=set_leave_request_status, args=(request_id, "Approved"))
             with col_reject:
-                if st.button("Reject Request", key=f"reject_{request_id}"):
-                    for i, req in enumerate(st.session_state.leave_requests):
-                        if req.get('request_id') == request_id:
-                            st.session_state.leave_requests[i]['status'] = 'Rejected'
-                            break
-                    save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
-                    st.warning(f"Leave request {request_id} rejected.")
-                    st.rerun()
+                st.button("Reject Request", key=f"reject_{request_id}", on_click=set_leave_request_status, args=(request_id, "Rejected"))
+
+# --- Leave Calendar ---
+@page_route("leave_calendar", imports=("pd", "px", "hr_calendar"))
+def display_leave_calendar():
+    st.title("📅 Leave Calendar")
+    st.write("See who is on approved leave, by day and by department, to plan cover.")
+
+    leave_calendar = get_leave_calendar()
+    staff_directory = get_staff_directory()
+    department_by_staff_id = {entry['staff_id']: entry['department'] for entry in staff_directory.entries}
+    name_by_staff_id = {entry['staff_id']: entry['name'] for entry in staff_directory.entries}
+
+    # Admins see every department; staff see their own
+    if st.session_state.current_user['role'] == 'admin':
+        department_options = ["All Departments"] + sorted(set(department_by_staff_id.values()))
+    else:
+        department_options = [st.session_state.current_user.get('profile', {}).get('department') or 'Unassigned']
+    selected_department = st.selectbox("Department", options=department_options, key="leave_calendar_department")
+    in_selected_department = lambda staff_id: selected_department == "All Departments" or department_by_staff_id.get(staff_id) == selected_department
+
+    st.subheader("Department Heat-Map")
+    calendar_years = list(range(leave_calendar.first_day.year, leave_calendar.last_day.year + 1))
+    heatmap_year = st.selectbox("Year", options=calendar_years, index=calendar_years.index(date.today().year), key="leave_calendar_year")
+    days, departments, counts = leave_calendar.department_heatmap(date(heatmap_year, 1, 1), date(heatmap_year, 12, 31), department_by_staff_id)
+    shown_departments = [i for i, department in enumerate(departments) if selected_department in ("All Departments", department)]
+    if days and shown_departments and counts[:, shown_departments].any():
+        fig_heatmap = px.imshow(
+            counts[:, shown_departments].T, x=days, y=[departments[i] for i in shown_departments],
+            aspect="auto", color_continuous_scale="Reds", labels=dict(x="Date", y="Department", color="Staff Out"),
+            title=f"Staff on Approved Leave per Day ({heatmap_year})"
+        )
+        st.plotly_chart(fig_heatmap, use_container_width=True)
+    else:
+        st.info(f"No approved leave in {heatmap_year} for the selected department.")
+
+    st.subheader("Who Is Out")
+    col_out_day, col_out_range = st.columns(2)
+    with col_out_day:
+        out_day = st.date_input("On date", value=date.today(), key="leave_calendar_day")
+        staff_out = [staff_id for staff_id in leave_calendar.who_is_out(out_day) if in_selected_department(staff_id)]
+        if staff_out:
+            st.dataframe(pd.DataFrame([
+                {"Name": name_by_staff_id.get(staff_id, 'N/A'), "Staff ID": staff_id, "Department": department_by_staff_id.get(staff_id, 'Unknown')}
+                for staff_id in staff_out
+            ]).sort_values(by="Name"), use_container_width=True, hide_index=True)
+        else:
+            st.info("Nobody is on approved leave on this date.")
+    with col_out_range:
+        out_range = st.date_input("In date range", value=(date.today(), date.today() + timedelta(days=14)), key="leave_calendar_range")
+        if isinstance(out_range, (list, tuple)) and len(out_range) == 2:
+            days_out = {staff_id: count for staff_id, count in leave_calendar.days_out_in_range(out_range[0], out_range[1]).items() if in_selected_department(staff_id)}
+            if days_out:
+                st.dataframe(pd.DataFrame([
+                    {"Name": name_by_staff_id.get(staff_id, 'N/A'), "Department": department_by_staff_id.get(staff_id, 'Unknown'), "Days Out": count}
+                    for staff_id, count in days_out.items()
+                ]).sort_values(by="Days Out", ascending=False), use_container_width=True, hide_index=True)
+            else:
+                st.info("Nobody is on approved leave in this range.")
+        else:
+            st.info("Select a start and end date.")
 
 # --- OPEX/CAPEX Form (Existing, will enhance approvals) ---
+@page_route("opex_capex_form")
 def opex_capex_form():
     st.title("💲 OPEX/CAPEX Requisition")
     st.write("Submit your operational or capital expenditure requisition.")
@@ -762,16 +1291,11 @@ def opex_capex_form():
         
         # --- Approvers Selection (New) ---
         st.subheader("Select Approvers")
-        # Get all users who are "managers" in relevant departments or have 'admin' role
-        # For simplicity, let's allow selection from all users, but ideally filtered by role/department
-        # Ensure 'name' exists for user profiles
-        all_staff_names = sorted([user.get('profile', {}).get('name') for user in st.session_state.users if user.get('profile', {}).get('name') is not None])
-        approver_options = [""] + all_staff_names
-        
-        admin_manager_approver = st.selectbox("Admin Manager (Required)", options=approver_options, key="admin_manager_approver")
-        hr_manager_approver = st.selectbox("HR Manager (Required)", options=approver_options, key="hr_manager_approver")
-        finance_manager_approver = st.selectbox("Finance Manager (Required)", options=approver_options, key="finance_manager_approver")
-        md_approver = st.selectbox("Managing Director (Required)", options=approver_options, key="md_approver")
+        # Each picker only lists staff who can act on that approval step
+        admin_manager_approver = st.selectbox("Admin Manager (Required)", options=get_approver_options("admin_manager_approver"), key="admin_manager_approver")
+        hr_manager_approver = st.selectbox("HR Manager (Required)", options=get_approver_options("hr_manager_approver"), key="hr_manager_approver")
+        finance_manager_approver = st.selectbox("Finance Manager (Required)", options=get_approver_options("finance_manager_approver"), key="finance_manager_approver")
+        md_approver = st.selectbox("Managing Director (Required)", options=get_approver_options("md_approver"), key="md_approver")
 
         # Basic validation for approvers
         required_approvers_selected = all([admin_manager_approver, hr_manager_approver, finance_manager_approver, md_approver])
@@ -783,37 +1307,84 @@ def opex_capex_form():
                 st.error("Please select all required approvers.")
             elif not item_description or total_amount <= 0:
                 st.error("Please provide item description and a valid amount.")
-            else:
-                new_request = {
-                    "req_id": len(st.session_state.opex_capex_requests) + 1,
-                    "requester_staff_id": current_user_profile.get('staff_id', 'N/A'),
-                    "requester_name": current_user_profile.get('name', 'N/A'),
-                    "request_type": request_type,
-                    "item_description": item_description,
-                    "quantity": quantity,
-                    "unit_price": unit_price,
-                    "total_amount": total_amount,
-                    "justification": justification,
-                    "submission_date": str(datetime.now().date()),
-                    "admin_manager_approver": admin_manager_approver, # Store selected approver name
-                    "hr_manager_approver": hr_manager_approver,
-                    "finance_manager_approver": finance_manager_approver,
-                    "md_approver": md_approver,
-                    "status_admin_manager": "Pending", # Initial status for each approver
-                    "status_hr_manager": "Pending",
-                    "status_finance_manager": "Pending",
-                    "status_md": "Pending",
-                    "final_status": "Pending" # Overall final status
-                }
-                st.session_state.opex_capex_requests.append(new_request)
-                save_data(st.session_state.opex_capex_requests, OPEX_CAPEX_REQUESTS_FILE)
+            elif submission := claim_submission("opex_capex_request", request_type, item_description, quantity, unit_price, justification,
+                                                admin_manager_approver, hr_manager_approver, finance_manager_approver, md_approver):
+                with submission_write(submission):
+                    new_request = {
+                        "req_id": get_record_archive().allocate_ids("opex-capex", st.session_state.opex_capex_requests),
+                        "requester_staff_id": get_staff_id(st.session_state.current_user) or 'N/A',
+                        "requester_name": current_user_profile.get('name', 'N/A'),
+                        "request_type": request_type,
+                        "item_description": item_description,
+                        "quantity": quantity,
+                        "unit_price": unit_price,
+                        "total_amount": total_amount,
+                        "justification": justification,
+                        "submission_date": str(datetime.now().date()),
+                        "admin_manager_approver": admin_manager_approver, # Store selected approver name
+                        "hr_manager_approver": hr_manager_approver,
+                        "finance_manager_approver": finance_manager_approver,
+                        "md_approver": md_approver,
+                        "status_admin_manager": "Pending", # Initial status for each approver
+                        "status_hr_manager": "Pending",
+                        "status_finance_manager": "Pending",
+                        "status_md": "Pending",
+                        "final_status": "Pending" # Overall final status
+                    }
+                    st.session_state.opex_capex_requests.append(new_request)
+                    record_change("opex", None, new_request)
+                    save_data(st.session_state.opex_capex_requests, OPEX_CAPEX_REQUESTS_FILE)
                 st.success("OPEX/CAPEX requisition submitted successfully! It is now pending approval.")
                 st.rerun()
 
 # --- Manage OPEX/CAPEX Approvals (New Admin/Manager Functionality) ---
+@page_route("manage_opex_capex_approvals", roles=("admin",), imports=("pd",))
 def manage_opex_capex_approvals():
     st.title("✅ Manage OPEX/CAPEX Approvals")
+    opex_capex_approvals_panel()
+
+def submit_requisition_action(req_id):
+    # Submit Action callback; reads the approval form's widgets by key, then the
+    # panel's fragment reruns to drop the request from the pending list
+    new_status = st.session_state[f"status_action_{req_id}"]
+    current_user_name = st.session_state.current_user.get('profile', {}).get('name')
+    reload_if_changed("opex_capex_requests", OPEX_CAPEX_REQUESTS_FILE, [])
+    for i, req_item in enumerate(st.session_state.opex_capex_requests):
+        if req_item.get('req_id') == req_id:
+            request_before = dict(req_item)
+            # Update status based on current user's role
+            # Admin role can override any status if needed, but here we'll stick to specific roles
+            # For simplicity, if admin is also the approver, they approve their specific step
+            if current_user_name == req_item.get('admin_manager_approver'):
+                st.session_state.opex_capex_requests[i]['status_admin_manager'] = new_status
+            if current_user_name == req_item.get('hr_manager_approver'):
+                st.session_state.opex_capex_requests[i]['status_hr_manager'] = new_status
+            if current_user_name == req_item.get('finance_manager_approver'):
+                st.session_state.opex_capex_requests[i]['status_finance_manager'] = new_status
+            if current_user_name == req_item.get('md_approver'):
+                st.session_state.opex_capex_requests[i]['status_md'] = new_status
+
+            # Update final status - only if all are approved
+            final_status = requisition_final_status(st.session_state.opex_capex_requests[i])
+            st.session_state.opex_capex_requests[i]['final_status'] = final_status
+            if final_status == 'Approved':
+                queue_toast(f"Requisition {req_id} has been fully approved!", icon="✅")
+            elif final_status == 'Rejected':
+                queue_toast(f"Requisition {req_id} has been rejected.", icon="🚫")
+            else: # Still pending other approvals
+                queue_toast(f"Action recorded for Requisition {req_id}. Still pending other approvals.", icon="ℹ️")
+
+            record_change("opex", request_before, st.session_state.opex_capex_requests[i])
+            break # Found and updated the request
+    else: # Archived or deleted since the page was drawn
+        queue_toast(f"Requisition {req_id} is no longer open.", icon="⚠️")
+        return
 
+    save_data(st.session_state.opex_capex_requests, OPEX_CAPEX_REQUESTS_FILE)
+
+# Pending table and review panel as one fragment
+@page_fragment
+def opex_capex_approvals_panel():
     current_user = st.session_state.current_user
     current_user_name = current_user.get('profile', {}).get('name')
     current_user_department = current_user.get('profile', {}).get('department')
@@ -894,7 +1465,9 @@ def manage_opex_capex_approvals():
     current_display_cols = [col for col in display_cols if col in df_requests_cleaned.columns]
 
     df_requests_cleaned['submission_date'] = pd.to_datetime(df_requests_cleaned['submission_date'], errors='coerce').dt.date
-    st.dataframe(df_requests_cleaned[current_display_cols].sort_values(by="submission_date", ascending=False), use_container_width=True, hide_index=True)
+    df_pending_display = df_requests_cleaned[current_display_cols].sort_values(by="submission_date", ascending=False)
+    st.dataframe(df_pending_display, use_container_width=True, hide_index=True)
+    table_export_controls(df_pending_display, "Pending Requisitions", key="pending_requisitions")
 
     st.markdown("---")
     st.subheader("Review Request")
@@ -915,6 +1488,8 @@ def manage_opex_capex_approvals():
         st.write(f"**Total Amount:** ₦{selected_req.get('total_amount', 0):,.2f}")
         st.write(f"**Justification:** {selected_req.get('justification', 'N/A')}")
         st.write(f"**Submission Date:** {selected_req.get('submission_date', 'N/A')}")
+        if not document_download_button(selected_req, key=f"download_req_document_{req_id}"):
+            st.info("No supporting document uploaded.")
         st.write("---")
         st.write("### Current Approval Status:")
         st.write(f"- Admin Manager ({selected_req.get('admin_manager_approver', 'N/A')}): {selected_req.get('status_admin_manager', 'N/A')}")
@@ -926,69 +1501,28 @@ def manage_opex_capex_approvals():
 
         # Approval Form for the current user's role
         with st.form(f"approve_opex_capex_form_{req_id}"):
-            new_status = st.radio(f"Action for this Request (as {approver_role_display})", ["Approve", "Reject"], key=f"status_action_{req_id}")
+            st.radio(f"Action for this Request (as {approver_role_display})", ["Approve", "Reject"], key=f"status_action_{req_id}")
             comment = st.text_area("Your Comment (Optional)", key=f"comment_{req_id}")
 
             col_submit_approval, col_cancel_approval = st.columns(2)
             with col_submit_approval:
-                if st.form_submit_button("Submit Action", key=f"submit_action_{req_id}"):
-                    for i, req_item in enumerate(st.session_state.opex_capex_requests):
-                        if req_item.get('req_id') == req_id:
-                            # Update status based on current user's role
-                            # Admin role can override any status if needed, but here we'll stick to specific roles
-                            # For simplicity, if admin is also the approver, they approve their specific step
-                            if current_user_name == req_item.get('admin_manager_approver'):
-                                st.session_state.opex_capex_requests[i]['status_admin_manager'] = new_status
-                            if current_user_name == req_item.get('hr_manager_approver'):
-                                st.session_state.opex_capex_requests[i]['status_hr_manager'] = new_status
-                            if current_user_name == req_item.get('finance_manager_approver'):
-                                st.session_state.opex_capex_requests[i]['status_finance_manager'] = new_status
-                            if current_user_name == req_item.get('md_approver'):
-                                st.session_state.opex_capex_requests[i]['status_md'] = new_status
-                            
-                            # Update final status - only if all are approved
-                            current_req_statuses = st.session_state.opex_capex_requests[i]
-                            all_approved = (
-                                current_req_statuses.get('status_admin_manager') == 'Approve' and
-                                current_req_statuses.get('status_hr_manager') == 'Approve' and
-                                current_req_statuses.get('status_finance_manager') == 'Approve' and
-                                current_req_statuses.get('status_md') == 'Approve'
-                            )
-                            any_rejected = (
-                                current_req_statuses.get('status_admin_manager') == 'Reject' or
-                                current_req_statuses.get('status_hr_manager') == 'Reject' or
-                                current_req_statuses.get('status_finance_manager') == 'Reject' or
-                                current_req_statuses.get('status_md') == 'Reject'
-                            )
-
-                            if all_approved:
-                                st.session_state.opex_capex_requests[i]['final_status'] = 'Approved'
-                                st.success(f"Requisition {req_id} has been fully approved!")
-                            elif any_rejected:
-                                st.session_state.opex_capex_requests[i]['final_status'] = 'Rejected'
-                                st.error(f"Requisition {req_id} has been rejected.")
-                            else:
-                                st.session_state.opex_capex_requests[i]['final_status'] = 'Pending' # Still pending other approvals
-                                st.info(f"Action recorded for Requisition {req_id}. Still pending other approvals.")
-
-                            break # Found and updated the request
-
-                    save_data(st.session_state.opex_capex_requests, OPEX_CAPEX_REQUESTS_FILE)
-                    st.rerun() # Rerun to refresh the list of pending requests
+                st.form_submit_button("Submit Action", key=f"submit_action_{req_id}", on_click=submit_requisition_action, args=(req_id,))
 
             with col_cancel_approval:
                 if st.form_submit_button("Cancel", key=f"cancel_action_{req_id}"):
                     st.info("Action cancelled.")
-                    st.rerun()
 
 # --- View OPEX/CAPEX Requests (User's historical view) ---
+@page_route("view_opex_capex_requests", imports=("pd",))
 def view_opex_capex_requests():
     st.title("📄 View OPEX/CAPEX Requests")
 
-    current_staff_id = st.session_state.current_user['profile'].get('staff_id')
+    current_staff_id = get_staff_id(st.session_state.current_user)
     
     # Filter by current user
     user_requests_raw = [req for req in st.session_state.opex_capex_requests if req.get('requester_staff_id') == current_staff_id]
+    user_requests_raw += archived_records_picker("opex-capex", user_requests_raw, key="my_requisitions",
+                                                 belongs=lambda req: req.get('requester_staff_id') == current_staff_id)
 
     if not user_requests_raw:
         st.info("You have no OPEX/CAPEX requisitions to display.")
@@ -1023,13 +1557,31 @@ def view_opex_capex_requests():
     # Filter display columns to only include those that actually exist in the DataFrame
     final_display_cols = [col for col in display_cols if col in df_user_requests.columns]
 
-    st.dataframe(df_user_requests[final_display_cols].sort_values(by="submission_date", ascending=False), use_container_width=True, hide_index=True)
+    df_user_requests_display = df_user_requests[final_display_cols].sort_values(by="submission_date", ascending=False)
+    st.dataframe(df_user_requests_display, use_container_width=True, hide_index=True)
+    table_export_controls(df_user_requests_display, "My Requisitions", key="my_requisitions")
 
 # --- Performance Goal Setting (Existing) ---
+@page_route("performance_goal_setting", imports=("pd",))
 def performance_goal_setting():
     st.title("📈 Performance Goal Setting")
     st.write("Set and track your performance goals.")
+    performance_goals_panel()
+
+def update_goal_status(goal_id):
+    # Update Status callback; the goals fragment then reruns with the new status
+    new_status = st.session_state[f"goal_status_{goal_id}"]
+    reload_if_changed("performance_goals", PERFORMANCE_GOALS_FILE, [])
+    for i, goal in enumerate(st.session_state.performance_goals):
+        if goal.get('goal_id') == goal_id:
+            st.session_state.performance_goals[i]['status'] = new_status
+            queue_toast(f"Goal '{goal.get('title', 'N/A')}' status updated to '{new_status}'.", icon="✅")
+            break
+    save_data(st.session_state.performance_goals, PERFORMANCE_GOALS_FILE)
 
+# New goal form, goal table and status update as one fragment
+@page_fragment
+def performance_goals_panel():
     current_user_profile = st.session_state.current_user.get('profile', {})
     
     with st.form("goal_setting_form"):
@@ -1041,23 +1593,23 @@ def performance_goal_setting():
         submitted = st.form_submit_button("Set Goal")
 
         if submitted:
-            if goal_title and goal_description:
-                new_goal = {
-                    "goal_id": len(st.session_state.performance_goals) + 1,
-                    "staff_id": current_user_profile.get('staff_id', 'N/A'),
-                    "staff_name": current_user_profile.get('name', 'N/A'),
-                    "title": goal_title,
-                    "description": goal_description,
-                    "due_date": str(due_date),
-                    "status": "Not Started", # Initial status
-                    "set_date": str(datetime.now().date())
-                }
-                st.session_state.performance_goals.append(new_goal)
-                save_data(st.session_state.performance_goals, PERFORMANCE_GOALS_FILE)
-                st.success("Performance goal set successfully!")
-                st.rerun()
-            else:
+            if not (goal_title and goal_description):
                 st.error("Goal Title and Description cannot be empty.")
+            elif submission := claim_submission("performance_goal", goal_title, goal_description, due_date):
+                with submission_write(submission):
+                    new_goal = {
+                        "goal_id": get_record_archive().allocate_ids("goals", st.session_state.performance_goals),
+                        "staff_id": current_user_profile.get('staff_id', 'N/A'),
+                        "staff_name": current_user_profile.get('name', 'N/A'),
+                        "title": goal_title,
+                        "description": goal_description,
+                        "due_date": str(due_date),
+                        "status": "Not Started", # Initial status
+                        "set_date": str(datetime.now().date())
+                    }
+                    st.session_state.performance_goals.append(new_goal)
+                    save_data(st.session_state.performance_goals, PERFORMANCE_GOALS_FILE)
+                st.success("Performance goal set successfully!") # The table below already includes it
 
     st.markdown("---")
     st.subheader("Your Performance Goals")
@@ -1085,7 +1637,9 @@ def performance_goal_setting():
     df_user_goals['due_date'] = pd.to_datetime(df_user_goals['due_date'], errors='coerce').dt.date
     df_user_goals['set_date'] = pd.to_datetime(df_user_goals['set_date'], errors='coerce').dt.date
 
-    st.dataframe(df_user_goals.sort_values(by="due_date"), use_container_width=True, hide_index=True)
+    df_user_goals_display = df_user_goals.sort_values(by="due_date")
+    st.dataframe(df_user_goals_display, use_container_width=True, hide_index=True)
+    table_export_controls(df_user_goals_display, "Performance Goals", key="performance_goals")
 
     st.markdown("---")
     st.subheader("Update Goal Status")
@@ -1098,25 +1652,21 @@ def performance_goal_setting():
         selected_goal = next(goal for goal in st.session_state.performance_goals if goal.get('goal_id') == goal_id)
 
         with st.form(f"update_goal_status_form_{goal_id}"):
-            new_status = st.selectbox("New Status", ["Not Started", "In Progress", "On Hold", "Complete"], index=["Not Started", "In Progress", "On Hold", "Complete"].index(selected_goal.get('status', 'Not Started')))
+            st.selectbox("New Status", ["Not Started", "In Progress", "On Hold", "Complete"], index=["Not Started", "In Progress", "On Hold", "Complete"].index(selected_goal.get('status', 'Not Started')), key=f"goal_status_{goal_id}")
             st.write(f"Current Status: **{selected_goal.get('status', 'N/A')}**")
             
-            update_button = st.form_submit_button("Update Status")
-
-            if update_button:
-                for i, goal in enumerate(st.session_state.performance_goals):
-                    if goal.get('goal_id') == goal_id:
-                        st.session_state.performance_goals[i]['status'] = new_status
-                        break
-                save_data(st.session_state.performance_goals, PERFORMANCE_GOALS_FILE)
-                st.success(f"Goal '{selected_goal.get('title', 'N/A')}' status updated to '{new_status}'.")
-                st.rerun()
+            st.form_submit_button("Update Status", on_click=update_goal_status, args=(goal_id,))
 
 # --- Self-Appraisal (Existing) ---
+@page_route("self_appraisal", imports=("pd",))
 def self_appraisal():
     st.title("✍️ Self-Appraisal")
     st.write("Complete your self-appraisal for the current period.")
+    self_appraisals_panel()
 
+# Appraisal table and submission form as one fragment
+@page_fragment
+def self_appraisals_panel():
     current_user_profile = st.session_state.current_user.get('profile', {})
     
     st.markdown("### Existing Appraisals")
@@ -1136,7 +1686,9 @@ def self_appraisal():
         df_appraisals = pd.DataFrame(cleaned_user_appraisals)
         
         df_appraisals['submission_date'] = pd.to_datetime(df_appraisals['submission_date'], errors='coerce').dt.date
-        st.dataframe(df_appraisals.sort_values(by="submission_date", ascending=False), use_container_width=True, hide_index=True)
+        df_appraisals_display = df_appraisals.sort_values(by="submission_date", ascending=False)
+        st.dataframe(df_appraisals_display, use_container_width=True, hide_index=True)
+        table_export_controls(df_appraisals_display, "Self Appraisals", key="self_appraisals")
     else:
         st.info("You have not submitted any self-appraisals yet.")
 
@@ -1153,26 +1705,28 @@ def self_appraisal():
         submitted = st.form_submit_button("Submit Appraisal")
 
         if submitted:
-            if appraisal_period and achievements:
-                new_appraisal = {
-                    "appraisal_id": len(st.session_state.self_appraisals) + 1,
-                    "staff_id": current_user_profile.get('staff_id', 'N/A'),
-                    "staff_name": current_user_profile.get('name', 'N/A'),
-                    "appraisal_period": appraisal_period,
-                    "achievements": achievements,
-                    "challenges": challenges,
-                    "development_needs": development_needs,
-                    "overall_rating": overall_rating,
-                    "submission_date": str(datetime.now().date())
-                }
-                st.session_state.self_appraisals.append(new_appraisal)
-                save_data(st.session_state.self_appraisals, SELF_APPRAISALS_FILE)
-                st.success("Self-appraisal submitted successfully!")
-                st.rerun()
-            else:
+            if not (appraisal_period and achievements):
                 st.error("Appraisal Period and Key Achievements cannot be empty.")
+            elif submission := claim_submission("self_appraisal", appraisal_period, achievements, challenges, development_needs, overall_rating):
+                with submission_write(submission):
+                    new_appraisal = {
+                        "appraisal_id": get_record_archive().allocate_ids("appraisals", st.session_state.self_appraisals),
+                        "staff_id": current_user_profile.get('staff_id', 'N/A'),
+                        "staff_name": current_user_profile.get('name', 'N/A'),
+                        "appraisal_period": appraisal_period,
+                        "achievements": achievements,
+                        "challenges": challenges,
+                        "development_needs": development_needs,
+                        "overall_rating": overall_rating,
+                        "submission_date": str(datetime.now().date())
+                    }
+                    st.session_state.self_appraisals.append(new_appraisal)
+                    save_data(st.session_state.self_appraisals, SELF_APPRAISALS_FILE)
+                queue_toast("Self-appraisal submitted successfully!", icon="✅")
+                st.rerun(scope="fragment") # Redraw the table above the form
 
 # --- HR Policies (New) ---
+@page_route("hr_policies")
 def display_hr_policies():
     st.title("📄 HR Policies")
     st.write("Browse the company's HR policies below.")
@@ -1192,18 +1746,25 @@ def display_hr_policies():
         st.markdown("---")
 
 # --- My Payslips (New) ---
+def render_payslip_pdf(payslip_record, user_profile):
+    with get_metrics().timer("pdf_render", document="payslip"):
+        return hr_payslips.generate_payslip_pdf(payslip_record, user_profile, payslip_record.get('staff_id'))
+
+@page_route("my_payslips", imports=("pd", "hr_payslips"))
 def display_my_payslips():
     st.title("💰 My Payslips")
     st.write("View and download your monthly payslips.")
 
-    current_staff_id = st.session_state.current_user.get('profile', {}).get('staff_id')
-
-    if not st.session_state.payroll_data:
-        st.info("No payroll data available yet.")
-        return
+    current_staff_id = get_staff_id(st.session_state.current_user)
 
     # Filter payroll data for the current user
     user_payroll_records = [rec for rec in st.session_state.payroll_data if rec.get('staff_id') == current_staff_id]
+    user_payroll_records += archived_records_picker("payroll", user_payroll_records, key="payslips",
+                                                    belongs=lambda rec: rec.get('staff_id') == current_staff_id)
+
+    if not st.session_state.payroll_data and not user_payroll_records:
+        st.info("No payroll data available yet.")
+        return
 
     if not user_payroll_records:
         st.info("No payslips found for your Staff ID.")
@@ -1234,6 +1795,7 @@ def display_my_payslips():
     final_display_cols = [col for col in display_cols if col in df_payslips.columns]
 
     st.dataframe(df_payslips[final_display_cols], use_container_width=True, hide_index=True)
+    table_export_controls(df_payslips[final_display_cols], "Payslips", key="payslips")
 
     st.markdown("---")
     st.subheader("Generate Payslip PDF")
@@ -1253,13 +1815,13 @@ def display_my_payslips():
 
         if selected_payslip:
             # Get full user profile for payslip details
-            payslip_user_profile = next((user.get('profile', {}) for user in st.session_state.users if user.get('profile', {}).get('staff_id') == selected_payslip.get('staff_id')), None)
+            payslip_user_profile = next((user.get('profile', {}) for user in st.session_state.users if get_staff_id(user) == selected_payslip.get('staff_id')), None)
 
             if payslip_user_profile:
-                pdf_buffer = generate_payslip_pdf(selected_payslip, payslip_user_profile)
                 st.download_button(
                     label=f"Download Payslip for {selected_payslip.get('month', 'N/A')}/{selected_payslip.get('year', 'N/A')}",
-                    data=pdf_buffer,
+                    # Rendered only when the button is clicked
+                    data=lambda: render_payslip_pdf(selected_payslip, payslip_user_profile),
                     file_name=f"Payslip_{selected_payslip.get('month', 'N/A')}_{selected_payslip.get('year', 'N/A')}_{selected_payslip.get('staff_id', 'N/A')}.pdf",
                     mime="application/pdf"
                 )
@@ -1268,63 +1830,8 @@ def display_my_payslips():
         else:
             st.error("Selected payslip record not found.")
 
-# --- PDF Generation for Payslip (New) ---
-def generate_payslip_pdf(payslip_record, user_profile):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-
-    # Header
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(0, 10, "Polaris Digitech - Payslip", 0, 1, 'C')
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, f"For: {payslip_record.get('month', 'N/A')}/{payslip_record.get('year', 'N/A')}", 0, 1, 'C')
-    pdf.ln(10)
-
-    # Employee Details
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, "Employee Details:", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 7, f"Name: {user_profile.get('name', 'N/A')}", 0, 1)
-    pdf.cell(0, 7, f"Staff ID: {user_profile.get('staff_id', 'N/A')}", 0, 1)
-    pdf.cell(0, 7, f"Department: {user_profile.get('department', 'N/A')}", 0, 1)
-    pdf.cell(0, 7, f"Grade Level: {user_profile.get('grade_level', 'N/A')}", 0, 1)
-    pdf.ln(5)
-
-    # Earnings
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, "Earnings:", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(80, 7, "Basic Salary:", 0, 0, 'L')
-    pdf.cell(0, 7, f"₦{payslip_record.get('basic_salary', 0):,.2f}", 0, 1, 'R')
-    pdf.cell(80, 7, "Allowances:", 0, 0, 'L')
-    pdf.cell(0, 7, f"₦{payslip_record.get('allowances', 0):,.2f}", 0, 1, 'R')
-    pdf.ln(5)
-
-    # Deductions
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, "Deductions:", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(80, 7, "Total Deductions:", 0, 0, 'L')
-    pdf.cell(0, 7, f"₦{payslip_record.get('deductions', 0):,.2f}", 0, 1, 'R')
-    pdf.ln(5)
-
-    # Net Pay
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(80, 10, "Net Pay:", 0, 0, 'L')
-    pdf.cell(0, 10, f"₦{payslip_record.get('net_pay', 0):,.2f}", 0, 1, 'R')
-    pdf.ln(10)
-
-    pdf.set_font("Arial", 'I', 8)
-    pdf.cell(0, 5, f"Generated on: {payslip_record.get('generated_date', datetime.now().date()).strftime('%Y-%m-%d')}", 0, 1, 'C')
-
-    # Save the PDF to a BytesIO object
-    buffer = BytesIO()
-    pdf.output(buffer)
-    buffer.seek(0)
-    return buffer
-
 # --- Admin Section: Manage Users (New) ---
+@page_route("manage_users", roles=("admin",), imports=("pd",))
 def admin_manage_users():
     st.title("👥 Admin Panel - Manage Users")
 
@@ -1336,54 +1843,69 @@ def admin_manage_users():
             new_staff_id = st.text_input("Staff ID (e.g., POL/2024/XXX)", help="Unique identifier for the staff.", key="new_staff_id_input")
             
             # Initial generic password
-            st.info("New staff members will be assigned a generic password: **123456** (They can change it on their profile page)")
+            st.info(f"New staff members will be assigned a generic password: **{DEFAULT_STAFF_PASSWORD}** (They can change it on their profile page)")
             
             col_add_staff1, col_add_staff2 = st.columns(2)
             with col_add_staff1:
                 if st.form_submit_button("Add Staff"):
-                    if new_staff_name and new_staff_username and new_staff_id:
+                    if not (new_staff_name and new_staff_username and new_staff_id):
+                        st.error("Please fill in Staff Name, Login Username, and Staff ID.")
+                    elif submission := claim_submission("new_staff", new_staff_name, new_staff_username, new_staff_id):
+                        # Claimed first: a repeat of this submission would fail the checks below
                         if any(user['username'] == new_staff_username for user in st.session_state.users):
+                            release_submission(submission)
                             st.error("Username already exists!")
                         elif any(user.get('profile', {}).get('staff_id') == new_staff_id for user in st.session_state.users):
+                            release_submission(submission)
                             st.error("Staff ID already exists!")
                         else:
-                            new_user = {
-                                "username": new_staff_username,
-                                "password": pbkdf2_sha256.hash("123456"), # Generic password
-                                "role": "staff", # Default role
-                                "staff_id": new_staff_id, # Store here for easy lookup
-                                "profile": {
-                                    "name": new_staff_name,
-                                    "staff_id": new_staff_id, # Redundant but good for quick profile access
-                                    "date_of_birth": "", # To be completed by staff
-                                    "gender": "", # To be completed by staff
-                                    "grade_level": "", # To be completed by staff
-                                    "department": "Unassigned", # Default, can be updated by staff/admin
-                                    "education_background": "",
-                                    "professional_experience": "",
-                                    "address": "",
-                                    "phone_number": "",
-                                    "email_address": new_staff_username,
-                                    "training_attended": [],
-                                    "work_anniversary": str(date.today()) # Default to today
-                                }
-                            }
-                            st.session_state.users.append(new_user)
-                            save_data(st.session_state.users, USERS_FILE)
+                            with submission_write(submission):
+                                new_user = new_staff_record(new_staff_name, new_staff_username, new_staff_id, pbkdf2_sha256.hash(DEFAULT_STAFF_PASSWORD))
+                                st.session_state.users.append(new_user)
+                                record_change("users", None, new_user)
+                                save_data(st.session_state.users, USERS_FILE)
                             st.success(f"Staff member '{new_staff_name}' with Staff ID '{new_staff_id}' added successfully!")
                             st.rerun()
-                    else:
-                        st.error("Please fill in Staff Name, Login Username, and Staff ID.")
             with col_add_staff2:
                 if st.form_submit_button("Clear Form", type="secondary"):
                     pass # Handled by clear_on_submit=True
 
+        st.markdown("---")
+        st.subheader("Bulk Import Staff (CSV)")
+        st.write(f"Upload a CSV with columns: `{'`, `'.join(BULK_IMPORT_REQUIRED_COLUMNS)}`. Optional columns: `{'`, `'.join(BULK_IMPORT_OPTIONAL_COLUMNS)}`.")
+        staff_csv = st.file_uploader("Choose a staff CSV file", type="csv", key="bulk_staff_csv")
+        if staff_csv is not None:
+            try:
+                df_new_staff = pd.read_csv(staff_csv, dtype=str).fillna('')
+                missing_cols = [col for col in BULK_IMPORT_REQUIRED_COLUMNS if col not in df_new_staff.columns]
+                if missing_cols:
+                    st.error(f"Missing required columns in CSV: {', '.join(missing_cols)}")
+                else:
+                    st.write(f"{len(df_new_staff)} row(s) found.")
+                    if st.button("Import Staff", key="bulk_import_staff_btn"):
+                        import_report = import_staff_csv_rows(df_new_staff.to_dict('records'))
+                        added_count = sum(1 for row in import_report if row['status'] == 'Added')
+                        st.success(f"Imported {added_count} of {len(import_report)} staff member(s). New staff use the generic password **{DEFAULT_STAFF_PASSWORD}**.")
+                        st.dataframe(pd.DataFrame(import_report), use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"Error reading staff CSV: {e}")
+
         st.markdown("---")
         st.subheader("All Staff Members")
 
+        staff_directory = get_staff_directory()
+        col_staff_search, col_staff_page = st.columns([3, 1])
+        with col_staff_search:
+            staff_search = st.text_input("Search Staff (name, login, staff ID or department)", key="staff_directory_search")
+        matching_staff = staff_directory.search(staff_search, roles=['staff'])
+        with col_staff_page:
+            staff_page = st.number_input("Page", min_value=1, value=1, step=1, key="staff_directory_page")
+        page_entries, total_staff_pages = paginate(matching_staff, staff_page, STAFF_DIRECTORY_PAGE_SIZE)
+        st.caption(f"{len(matching_staff)} matching staff member(s) - page {min(staff_page, total_staff_pages)} of {total_staff_pages}")
+
         if st.session_state.users:
-            # Filter out the admin user for regular staff display if desired, or display all
-            display_users = [user for user in st.session_state.users if user['role'] == 'staff']
+            # Only the current page of search results is turned into a table
+            display_users = [st.session_state.users[entry['position']] for entry in page_entries]
             
             if display_users:
                 # Prepare data robustly for DataFrame creation
@@ -1416,22 +1938,24 @@ def admin_manage_users():
 
                 st.dataframe(df_users[final_display_cols], use_container_width=True, hide_index=True)
             else:
-                st.info("No staff members added yet (excluding admin).")
+                st.info("No staff members match your search (excluding admin).")
         else:
             st.info("No users registered in the system.")
         
         st.markdown("---")
         st.subheader("Edit/Delete Staff Member")
 
-        # Create options robustly
-        user_to_edit_options = [""] + sorted([user.get('profile', {}).get('name', user['username']) for user in st.session_state.users if user['role'] == 'staff'])
-        selected_user_name = st.selectbox("Select Staff Member to Edit/Delete", options=user_to_edit_options, key="edit_staff_select")
+        # Options are the current page of directory search results above
+        user_to_edit_options = [""] + [entry['username'] for entry in page_entries]
+        selected_username = st.selectbox("Select Staff Member to Edit/Delete", options=user_to_edit_options, key="edit_staff_select",
+                                         format_func=lambda username: f"{staff_directory.get(username)['name']} ({username})" if username else "")
 
-        if selected_user_name:
-            selected_user_obj = next((user for user in st.session_state.users if user.get('profile', {}).get('name') == selected_user_name or user['username'] == selected_user_name), None)
+        if selected_username:
+            selected_entry = staff_directory.get(selected_username)
+            selected_user_obj = st.session_state.users[selected_entry['position']] if selected_entry else None
 
             if selected_user_obj:
-                selected_user_index = st.session_state.users.index(selected_user_obj)
+                selected_user_index = selected_entry['position']
                 current_profile = selected_user_obj['profile']
 
                 with st.form(f"edit_staff_form_{selected_user_obj['staff_id']}"):
@@ -1478,6 +2002,7 @@ def admin_manage_users():
                     col_edit_del1, col_edit_del2 = st.columns(2)
                     with col_edit_del1:
                         if st.form_submit_button("Update Staff"):
+                            user_before_edit = copy.deepcopy(st.session_state.users[selected_user_index])
                             st.session_state.users[selected_user_index]['profile']['name'] = updated_name
                             st.session_state.users[selected_user_index]['profile']['date_of_birth'] = str(updated_dob)
                             st.session_state.users[selected_user_index]['profile']['gender'] = updated_gender
@@ -1487,42 +2012,91 @@ def admin_manage_users():
                             st.session_state.users[selected_user_index]['profile']['phone_number'] = updated_phone
                             st.session_state.users[selected_user_index]['profile']['work_anniversary'] = str(updated_work_anniversary) # Save as string
                             
+                            record_change("users", user_before_edit, st.session_state.users[selected_user_index])
                             save_data(st.session_state.users, USERS_FILE)
                             st.success(f"Staff '{updated_name}' updated successfully!")
                             st.rerun()
                     with col_edit_del2:
+                        archive_on_delete = st.checkbox("Archive instead of permanently deleting", value=True, help="Archived staff and their records are kept in the staff archive file.")
                         if st.form_submit_button("Delete Staff", type="primary"):
-                            # Filter out the selected user
-                            st.session_state.users = [user for user in st.session_state.users if user['username'] != selected_user_obj['username']]
-                            save_data(st.session_state.users, USERS_FILE)
-
-                            # Clean up associated data (leave, opex/capex, goals, appraisals, payroll) based on staff_id
-                            staff_id_to_delete = current_profile.get('staff_id')
-                            if staff_id_to_delete:
-                                st.session_state.leave_requests = [req for req in st.session_state.leave_requests if req.get('staff_id') != staff_id_to_delete]
-                                save_data(st.session_state.leave_requests, LEAVE_REQUESTS_FILE)
-
-                                st.session_state.opex_capex_requests = [req for req in st.session_state.opex_capex_requests if req.get('requester_staff_id') != staff_id_to_delete]
-                                save_data(st.session_state.opex_capex_requests, OPEX_CAPEX_REQUESTS_FILE)
-
-                                st.session_state.performance_goals = [goal for goal in st.session_state.performance_goals if goal.get('staff_id') != staff_id_to_delete]
-                                save_data(st.session_state.performance_goals, PERFORMANCE_GOALS_FILE)
-
-                                st.session_state.self_appraisals = [app for app in st.session_state.self_appraisals if app.get('staff_id') != staff_id_to_delete]
-                                save_data(st.session_state.self_appraisals, SELF_APPRAISALS_FILE)
-
-                                st.session_state.payroll_data = [pay for pay in st.session_state.payroll_data if pay.get('staff_id') != staff_id_to_delete]
-                                save_data(st.session_state.payroll_data, PAYROLL_FILE)
-
-                            st.success(f"Staff '{current_profile.get('name', 'N/A')}' deleted successfully!")
+                            # Removes the user and their leave, OPEX/CAPEX, goals, appraisals and payroll in one commit
+                            offboard_selected_staff([selected_user_obj['username']], archive=archive_on_delete)
+                            st.success(f"Staff '{current_profile.get('name', 'N/A')}' {'archived' if archive_on_delete else 'deleted'} successfully!")
                             st.rerun()
             else:
                 st.warning("Selected user not found. Please refresh.")
+
+        st.markdown("---")
+        st.subheader("Offboard Leavers (Batch)")
+        with st.form("batch_offboard_form", clear_on_submit=True):
+            leaver_options = {f"{entry['name']} ({entry['username']})": entry['username'] for entry in matching_staff}
+            selected_leavers = st.multiselect("Select Staff Members Leaving", options=list(leaver_options.keys()))
+            archive_leavers = st.checkbox("Archive instead of permanently deleting", value=True)
+            if st.form_submit_button("Offboard Selected Staff", type="primary"):
+                if selected_leavers:
+                    # Runs as a background job: the cascade rewrites every staff-linked file
+                    submit_job("offboard_staff", f"Offboard {len(selected_leavers)} staff member(s){' (archived)' if archive_leavers else ''}",
+                               offboard_staff_files, [leaver_options[label] for label in selected_leavers],
+                               archive=archive_leavers, blob_store=get_blob_store(), record_archive=get_record_archive(),
+                               training_store=get_training_store())
+                    st.success(f"Offboarding of {len(selected_leavers)} staff member(s) has started. Track it under Background Jobs.")
+                else:
+                    st.error("Please select at least one staff member.")
     else:
         st.info("Select a staff member to edit or delete.")
 
+# Session state key holding each staff-linked data file
+STAFF_LINKED_SESSION_KEYS = {
+    LEAVE_REQUESTS_FILE: "leave_requests",
+    OPEX_CAPEX_REQUESTS_FILE: "opex_capex_requests",
+    PERFORMANCE_GOALS_FILE: "performance_goals",
+    SELF_APPRAISALS_FILE: "self_appraisals",
+    PAYROLL_FILE: "payroll_data",
+}
+
+def offboard_selected_staff(usernames, archive=False):
+    # Single transactional cascade over users and every staff-linked file
+    linked_tables = {filename: st.session_state[key] for filename, key in STAFF_LINKED_SESSION_KEYS.items()}
+    previous_signatures = {filename: file_signature(filename) for filename in [USERS_FILE] + list(linked_tables)}
+    users_before = st.session_state.users
+    st.session_state.users, remaining_tables = offboard_staff(users_before, linked_tables, usernames, archive=archive,
+                                                              record_archive=get_record_archive(), training_store=get_training_store())
+
+    # Take the removed users, leave requests and requisitions out of the dashboard counts
+    removed_rows = {"users": _removed_rows(users_before, st.session_state.users),
+                    "leave": _removed_rows(linked_tables[LEAVE_REQUESTS_FILE], remaining_tables[LEAVE_REQUESTS_FILE]),
+                    "opex": _removed_rows(linked_tables[OPEX_CAPEX_REQUESTS_FILE], remaining_tables[OPEX_CAPEX_REQUESTS_FILE])}
+    for kind, rows in removed_rows.items():
+        for row in rows:
+            record_change(kind, row, None)
+    for filename, previous_signature in previous_signatures.items():
+        mark_derived_views_synced(filename, previous_signature)
+
+    for filename, records in remaining_tables.items():
+        st.session_state[STAFF_LINKED_SESSION_KEYS[filename]] = records
+
+    # Deleted leave requests no longer hold on to their documents; archived ones keep them
+    if not archive:
+        for row in removed_rows["leave"]:
+            if row.get('document_sha256'):
+                get_blob_store().release(document_ref("leave", row.get('request_id')))
+
+def _removed_rows(before, after):
+    kept = {id(row) for row in after}
+    return [row for row in before if id(row) not in kept]
+
+def import_staff_csv_rows(rows):
+    previous_signature = file_signature(USERS_FILE)
+    existing_count = len(st.session_state.users)
+    st.session_state.users, import_report = import_staff_rows(st.session_state.users, rows)
+    for new_user in st.session_state.users[existing_count:]:
+        record_change("users", None, new_user)
+    mark_derived_views_synced(USERS_FILE, previous_signature)
+    return import_report
+
 
 # --- Admin Section: Upload Payroll (New) ---
+@page_route("upload_payroll", roles=("admin",), imports=("pd",))
 def admin_upload_payroll():
     st.title("📤 Admin Panel - Upload Payroll")
     st.write("Upload payroll data as a CSV file. The CSV should contain columns: `staff_id`, `month` (e.g., 1-12), `year` (e.g., 2024), `basic_salary`, `allowances`, `deductions`, `net_pay`.")
@@ -1534,83 +2108,36 @@ def admin_upload_payroll():
             df_payroll = pd.read_csv(uploaded_file)
             st.dataframe(df_payroll, use_container_width=True, hide_index=True)
 
-            required_cols = ['staff_id', 'month', 'year', 'basic_salary', 'allowances', 'deductions', 'net_pay']
-            if not all(col in df_payroll.columns for col in required_cols):
-                st.error(f"Missing required columns in CSV. Please ensure the file contains: {', '.join(required_cols)}")
+            if not all(col in df_payroll.columns for col in PAYROLL_REQUIRED_COLUMNS):
+                st.error(f"Missing required columns in CSV. Please ensure the file contains: {', '.join(PAYROLL_REQUIRED_COLUMNS)}")
             else:
                 if st.button("Process and Save Payroll Data"):
-                    new_or_updated_payroll_records = []
-                    
-                    # Create a temporary lookup for existing payroll to easily check/update
-                    payroll_lookup = {}
-                    for p_rec in st.session_state.payroll_data:
-                        key = (p_rec.get('staff_id'), p_rec.get('month'), p_rec.get('year'))
-                        if all(x is not None for x in key):
-                            payroll_lookup[key] = p_rec
-
-                    for index, row in df_payroll.iterrows():
-                        try:
-                            # Basic validation and type conversion
-                            staff_id = str(row['staff_id']).strip()
-                            month = int(row['month'])
-                            year = int(row['year'])
-                            basic_salary = float(row['basic_salary'])
-                            allowances = float(row['allowances'])
-                            deductions = float(row['deductions'])
-                            net_pay = float(row['net_pay'])
-
-                            # Check if staff_id exists in users (using .get() for robustness)
-                            if not any(user.get('profile', {}).get('staff_id') == staff_id for user in st.session_state.users):
-                                st.warning(f"Skipping payroll for unknown Staff ID: {staff_id} in row {index+1}.")
-                                continue
-                            
-                            current_payslip_key = (staff_id, month, year)
-                            
-                            payslip_data = {
-                                "payslip_id": payroll_lookup.get(current_payslip_key, {}).get('payslip_id', len(st.session_state.payroll_data) + len(new_or_updated_payroll_records) + 1),
-                                "staff_id": staff_id,
-                                "month": month,
-                                "year": year,
-                                "basic_salary": basic_salary,
-                                "allowances": allowances,
-                                "deductions": deductions,
-                                "net_pay": net_pay,
-                                "generated_date": str(date.today())
-                            }
-                            
-                            if current_payslip_key in payroll_lookup:
-                                # Update existing record in place
-                                for i, p_rec in enumerate(st.session_state.payroll_data):
-                                    if (p_rec.get('staff_id'), p_rec.get('month'), p_rec.get('year')) == current_payslip_key:
-                                        st.session_state.payroll_data[i] = payslip_data
-                                        st.info(f"Updated payslip for {staff_id} - {month}/{year}")
-                                        break
-                            else:
-                                new_or_updated_payroll_records.append(payslip_data)
-
-                        except ValueError as ve:
-                            st.error(f"Data conversion error in row {index+1}: {ve}. Please check numeric fields and dates.")
-                            continue
-                        except KeyError as ke:
-                            st.error(f"Missing column in row {index+1}: {ke}. Please check CSV headers.")
-                            continue
-                        except Exception as ex:
-                            st.error(f"An unexpected error occurred in row {index+1}: {ex}")
-                            continue
-
-                    # Add genuinely new records
-                    st.session_state.payroll_data.extend(new_or_updated_payroll_records)
-                    save_data(st.session_state.payroll_data, PAYROLL_FILE)
-                    st.success("Payroll data uploaded and processed successfully!")
-                    st.rerun()
+                    # Processed by a background job; existing payslips for the same staff/month/year are replaced
+                    payroll_rows = df_payroll[PAYROLL_REQUIRED_COLUMNS].to_dict("records")
+                    submit_job("payroll_import", f"Payroll import: {uploaded_file.name} ({len(payroll_rows)} rows)", import_payroll_file, payroll_rows,
+                               record_archive=get_record_archive())
+                    st.success("Payroll import has started. Track it under Background Jobs.")
 
         except Exception as e:
             st.error(f"Error reading or processing CSV: {e}")
 
 # --- Admin Section: Manage Beneficiaries (New) ---
+@page_route("manage_beneficiaries", roles=("admin",), imports=("pd",))
 def admin_manage_beneficiaries():
     st.title("🏦 Admin Panel - Manage Beneficiaries")
-
+    beneficiaries_panel()
+
+def delete_beneficiary(b_name):
+    # Confirm Delete callback
+    reload_if_changed("beneficiaries", BENEFICIARIES_FILE, {})
+    st.session_state.beneficiaries.pop(b_name, None)
+    save_data(st.session_state.beneficiaries, BENEFICIARIES_FILE)
+    st.session_state.pending_beneficiary_delete = None
+    queue_toast(f"Beneficiary '{b_name}' deleted.")
+
+# Beneficiary table and edit forms as one fragment
+@page_fragment
+def beneficiaries_panel():
     st.subheader("Current Beneficiaries")
     # Exclude the "Other (Manually Enter Details)" option from the display table
     display_beneficiaries = {k: v for k, v in st.session_state.beneficiaries.items() if k != "Other (Manually Enter Details)"}
@@ -1631,20 +2158,22 @@ def admin_manage_beneficiaries():
         b_bank = st.text_input("Bank Name")
 
         if st.form_submit_button("Add Beneficiary"):
-            if b_name and b_acc_name and b_acc_no and b_bank:
+            if not (b_name and b_acc_name and b_acc_no and b_bank):
+                st.error("Please fill all beneficiary fields.")
+            elif submission := claim_submission("beneficiary", b_name, b_acc_name, b_acc_no, b_bank):
                 if b_name in st.session_state.beneficiaries:
+                    release_submission(submission)
                     st.warning("Beneficiary with this name already exists. Use update section to modify.")
                 else:
-                    st.session_state.beneficiaries[b_name] = {
-                        "Account Name": b_acc_name,
-                        "Account No": b_acc_no,
-                        "Bank": b_bank
-                    }
-                    save_data(st.session_state.beneficiaries, BENEFICIARIES_FILE)
-                    st.success(f"Beneficiary '{b_name}' added.")
-                    st.rerun()
-            else:
-                st.error("Please fill all beneficiary fields.")
+                    with submission_write(submission):
+                        st.session_state.beneficiaries[b_name] = {
+                            "Account Name": b_acc_name,
+                            "Account No": b_acc_no,
+                            "Bank": b_bank
+                        }
+                        save_data(st.session_state.beneficiaries, BENEFICIARIES_FILE)
+                    queue_toast(f"Beneficiary '{b_name}' added.", icon="✅")
+                    st.rerun(scope="fragment") # Redraw the table above the form
 
     st.markdown("---")
     st.subheader("Update/Delete Beneficiary")
@@ -1669,27 +2198,43 @@ def admin_manage_beneficiaries():
                             "Bank": updated_b_bank
                         }
                         save_data(st.session_state.beneficiaries, BENEFICIARIES_FILE)
-                        st.success(f"Beneficiary '{selected_b_name}' updated.")
-                        st.rerun()
+                        queue_toast(f"Beneficiary '{selected_b_name}' updated.", icon="✅")
+                        st.rerun(scope="fragment")
                     else:
                         st.error("Please fill all update fields.")
             with col_b_del:
-                if st.form_submit_button("Delete Beneficiary", type="primary"):
-                    # Add confirmation to delete
-                    st.warning(f"Are you sure you want to delete '{selected_b_name}'?")
-                    if st.button(f"Confirm Delete '{selected_b_name}'", key=f"confirm_delete_b_{selected_b_name}"):
-                        del st.session_state.beneficiaries[selected_b_name]
-                        save_data(st.session_state.beneficiaries, BENEFICIARIES_FILE)
-                        st.success(f"Beneficiary '{selected_b_name}' deleted.")
-                        st.rerun()
+                # Ask for confirmation below the form; the choice is kept in session state across reruns
+                st.form_submit_button("Delete Beneficiary", type="primary",
+                                      on_click=lambda: st.session_state.update(pending_beneficiary_delete=selected_b_name))
+        if st.session_state.get('pending_beneficiary_delete') == selected_b_name:
+            st.warning(f"Are you sure you want to delete '{selected_b_name}'?")
+            col_b_confirm, col_b_keep = st.columns(2)
+            with col_b_confirm:
+                st.button(f"Confirm Delete '{selected_b_name}'", key=f"confirm_delete_b_{selected_b_name}", on_click=delete_beneficiary, args=(selected_b_name,))
+            with col_b_keep:
+                st.button("Keep Beneficiary", key=f"keep_b_{selected_b_name}", on_click=lambda: st.session_state.update(pending_beneficiary_delete=None))
     else:
         st.info("Select a beneficiary to update or delete.")
 
 
 # --- Admin Section: Manage HR Policies (New) ---
+@page_route("manage_hr_policies", roles=("admin",))
 def admin_manage_hr_policies():
     st.title("📜 Admin Panel - Manage HR Policies")
-
+    hr_policies_panel()
+    public_holidays_panel()
+
+def delete_hr_policy(policy_name):
+    # Confirm Delete callback
+    reload_if_changed("hr_policies", HR_POLICIES_FILE, {})
+    st.session_state.hr_policies.pop(policy_name, None)
+    save_data(st.session_state.hr_policies, HR_POLICIES_FILE)
+    st.session_state.pending_policy_delete = None
+    queue_toast(f"Policy '{policy_name}' deleted.")
+
+# Policy editing and adding as one fragment
+@page_fragment
+def hr_policies_panel():
     st.subheader("Edit Existing Policies")
     policy_names = list(st.session_state.hr_policies.keys())
     selected_policy_name = st.selectbox("Select Policy to Edit", options=[""] + policy_names)
@@ -1704,16 +2249,17 @@ def admin_manage_hr_policies():
                 st.session_state.hr_policies[selected_policy_name] = updated_policy_content
                 save_data(st.session_state.hr_policies, HR_POLICIES_FILE)
                 st.success(f"Policy '{selected_policy_name}' updated successfully!")
-                st.rerun()
         with col_policy_delete:
-            if st.button(f"Delete {selected_policy_name} Policy", type="primary"):
-                # Add confirmation for deletion
-                st.warning(f"Are you sure you want to delete the '{selected_policy_name}' policy?")
-                if st.button(f"Confirm Delete Policy '{selected_policy_name}'", key=f"confirm_delete_policy_{selected_policy_name}"):
-                    del st.session_state.hr_policies[selected_policy_name]
-                    save_data(st.session_state.hr_policies, HR_POLICIES_FILE)
-                    st.success(f"Policy '{selected_policy_name}' deleted.")
-                    st.rerun()
+            # Confirmation is kept in session state, so the Confirm button still exists when it is clicked
+            st.button(f"Delete {selected_policy_name} Policy", type="primary",
+                      on_click=lambda: st.session_state.update(pending_policy_delete=selected_policy_name))
+        if st.session_state.get('pending_policy_delete') == selected_policy_name:
+            st.warning(f"Are you sure you want to delete the '{selected_policy_name}' policy?")
+            col_policy_confirm, col_policy_keep = st.columns(2)
+            with col_policy_confirm:
+                st.button(f"Confirm Delete Policy '{selected_policy_name}'", key=f"confirm_delete_policy_{selected_policy_name}", on_click=delete_hr_policy, args=(selected_policy_name,))
+            with col_policy_keep:
+                st.button("Keep Policy", key=f"keep_policy_{selected_policy_name}", on_click=lambda: st.session_state.update(pending_policy_delete=None))
 
     st.markdown("---")
     st.subheader("Add New Policy")
@@ -1722,83 +2268,232 @@ def admin_manage_hr_policies():
         new_policy_content = st.text_area("New Policy Content", height=300)
 
         if st.form_submit_button("Add New Policy"):
-            if new_policy_name and new_policy_content:
+            if not (new_policy_name and new_policy_content):
+                st.error("Please provide both a name and content for the new policy.")
+            elif submission := claim_submission("hr_policy", new_policy_name, new_policy_content):
                 if new_policy_name in st.session_state.hr_policies:
+                    release_submission(submission)
                     st.error("Policy with this name already exists. Please choose a different name or edit the existing policy.")
                 else:
-                    st.session_state.hr_policies[new_policy_name] = new_policy_content
-                    save_data(st.session_state.hr_policies, HR_POLICIES_FILE)
-                    st.success(f"New policy '{new_policy_name}' added successfully!")
-                    st.rerun()
+                    with submission_write(submission):
+                        st.session_state.hr_policies[new_policy_name] = new_policy_content
+                        save_data(st.session_state.hr_policies, HR_POLICIES_FILE)
+                    queue_toast(f"New policy '{new_policy_name}' added successfully!", icon="✅")
+                    st.rerun(scope="fragment") # List it in the policy selectbox above
+
+@page_fragment
+def public_holidays_panel():
+    st.markdown("---")
+    st.subheader("Public Holidays")
+    st.write("Public holidays are excluded, along with weekends, when counting leave days.")
+    with st.form("public_holidays_form"):
+        holidays_text = st.text_area("Holiday Dates (one YYYY-MM-DD date per line)", value="\n".join(st.session_state.public_holidays), height=200)
+        if st.form_submit_button("Save Public Holidays"):
+            holiday_lines = [line.strip() for line in holidays_text.splitlines() if line.strip()]
+            invalid_lines = []
+            for line in holiday_lines:
+                try:
+                    date.fromisoformat(line)
+                except ValueError:
+                    invalid_lines.append(line)
+            if invalid_lines:
+                st.error(f"Not valid YYYY-MM-DD dates: {', '.join(invalid_lines)}")
             else:
-                st.error("Please provide both a name and content for the new policy.")
+                st.session_state.public_holidays = sorted(set(holiday_lines))
+                save_data(st.session_state.public_holidays, PUBLIC_HOLIDAYS_FILE) # Leave balances are recounted on next use
+                st.success("Public holidays updated.")
+
+# --- Admin Section: Training Reports ---
+@page_route("training_reports", roles=("admin",), imports=("pd", "px"))
+def admin_training_reports():
+    st.title("🎓 Admin Panel - Training Reports")
+
+    training_store = get_training_store()
+    if not training_store.records:
+        st.info("No training records have been added yet.")
+        return
+
+    by_course, by_department = training_attendance_report(training_store, st.session_state.users)
+    st.metric("Total Training Attendances", len(training_store.records))
+
+    st.subheader("Attendance by Course")
+    df_by_course = pd.DataFrame(by_course)
+    st.dataframe(df_by_course, use_container_width=True, hide_index=True)
+
+    st.subheader("Attendance by Department")
+    df_by_department = pd.DataFrame(by_department)
+    fig_training_dept = px.bar(df_by_department, x='Department', y='Attendances', title='Training Attendance by Department')
+    st.plotly_chart(fig_training_dept, use_container_width=True)
+    st.dataframe(df_by_department, use_container_width=True, hide_index=True)
+
+# --- Admin Section: Background Jobs ---
+@page_route("jobs", roles=("admin",), imports=("pd",))
+def admin_background_jobs():
+    st.title("⚙️ Admin Panel - Background Jobs")
+    st.write("Long-running work such as payroll imports and offboarding runs here, independent of your browser tab.")
+    st.button("Refresh", key="refresh_jobs")
+
+    with st.expander("Archive Closed Records"):
+        st.write("Moves decided leave requests and requisitions, and payroll, closed before the cutoff out of the "
+                 "working data files into compressed monthly archive files. Leave from this calendar year always stays. "
+                 "Archived records remain viewable from the history pages.")
+        archive_summary = get_record_archive().summary()
+        st.dataframe(pd.DataFrame([{
+            "Table": table, "Archived Months": summary['partitions'], "Oldest Month": summary['oldest'],
+            "Size (KB)": round(summary['bytes'] / 1024, 1),
+        } for table, summary in archive_summary.items()]), use_container_width=True, hide_index=True)
+        with st.form("archive_records_form"):
+            archive_after_months = st.number_input("Archive records closed more than this many months ago", min_value=1, max_value=120,
+                                                   value=DEFAULT_ARCHIVE_AFTER_MONTHS, step=1)
+            if st.form_submit_button("Start Archiving"):
+                submit_job("record_archive", f"Archive records closed over {archive_after_months} months ago",
+                           archive_closed_records, months=int(archive_after_months), record_archive=get_record_archive())
+                st.success("Archiving has started. Its result is listed below once it finishes.")
+
+    jobs = get_job_runner().list_jobs()
+    if not jobs:
+        st.info("No background jobs have been run yet.")
+        return
+
+    for job in jobs:
+        if job['status'] in ("Queued", "Running"):
+            st.progress(job['progress'], text=f"{job['description']} — {job['status']}{': ' + job['message'] if job['message'] else ''}")
+
+    df_jobs = pd.DataFrame([{
+        "Job ID": job['job_id'], "Job": job['description'], "Status": job['status'], "Progress": f"{job['progress']:.0%}",
+        "Submitted By": job['submitted_by'], "Submitted": job['submitted_at'], "Finished": job['finished_at'],
+        "Duration (s)": job['duration_s'],
+    } for job in jobs])
+    st.dataframe(df_jobs, use_container_width=True, hide_index=True)
+
+    st.subheader("Job Details")
+    job_labels = {f"{job['description']} ({job['job_id']})": job for job in jobs}
+    default_label = next((label for label, job in job_labels.items() if job['job_id'] == st.session_state.get('last_job_id')), None)
+    labels = list(job_labels)
+    selected_label = st.selectbox("Select Job", options=labels, index=labels.index(default_label) if default_label else 0)
+    selected_job = job_labels[selected_label]
+    if selected_job['status'] == "Failed":
+        st.error(selected_job['error'])
+        st.code(selected_job['message'])
+    elif selected_job['status'] == "Interrupted":
+        st.warning(selected_job['message'])
+    result = selected_job.get('result') or {}
+    if selected_job['kind'] == "payroll_import" and result:
+        st.write(f"**Added:** {result['added']}  **Updated:** {result['updated']}  **Skipped:** {result['skipped']}")
+        if result['skipped_rows']:
+            st.dataframe(pd.DataFrame(result['skipped_rows']), use_container_width=True, hide_index=True)
+    elif result:
+        st.json(result)
+
+# --- Admin Section: System Metrics ---
+METRIC_DESCRIPTIONS = {
+    "page_render": "Page handlers",
+    "fragment_render": "Panel reruns (fragments)",
+    "data_load": "Data file reads",
+    "data_save": "Data file writes",
+    "password_verify": "Password checks",
+    "pdf_render": "PDF renders",
+    "table_export": "Table exports",
+}
+
+@page_route("system_metrics", roles=("admin",), imports=("pd",))
+def admin_system_metrics():
+    st.title("📉 Admin Panel - System Metrics")
+    metrics = get_metrics()
+    uptime = timedelta(seconds=int(datetime.now().timestamp() - metrics.started_at))
+    st.write(f"Timings for this server process over the last {metrics.window_s // 60} minutes (up {uptime}). "
+             "Percentiles are estimated from histogram buckets.")
+    st.button("Refresh", key="refresh_system_metrics")
+
+    rows = metrics.summary()
+    if not rows:
+        st.info("No timings recorded yet.")
+    for metric, description in METRIC_DESCRIPTIONS.items():
+        metric_rows = [row for row in rows if row['metric'] == metric]
+        if not metric_rows:
+            continue
+        st.subheader(description)
+        df_metric = pd.DataFrame([{
+            **{label.title(): value for label, value in row['labels'].items()},
+            "Count": row['count'],
+            "Mean (ms)": row['mean_s'] * 1000, "p50 (ms)": row['p50_s'] * 1000,
+            "p95 (ms)": row['p95_s'] * 1000, "p99 (ms)": row['p99_s'] * 1000, "Max (ms)": row['max_s'] * 1000,
+            "Total (s)": row['total_s'],
+            **({"KB": row['bytes'] / 1024} if metric in ("data_load", "data_save", "table_export") else {}),
+        } for row in metric_rows])
+        st.dataframe(df_metric.round(1), use_container_width=True, hide_index=True)
+
+    st.subheader("Prometheus Export")
+    server, server_error = get_metrics_server()
+    if server:
+        st.write(f"Scrape endpoint: `http://{server.server_address[0]}:{server.server_address[1]}/metrics`")
+    elif server_error:
+        st.warning(f"Could not start the metrics endpoint on port {METRICS_EXPORT_PORT}: {server_error}")
+    if METRICS_EXPORT_FILE:
+        st.write(f"Written every {METRICS_EXPORT_INTERVAL_S} s to `{METRICS_EXPORT_FILE}`.")
+    if not server and not METRICS_EXPORT_FILE:
+        st.caption("Set METRICS_EXPORT_FILE or METRICS_EXPORT_PORT in hr_app.py to export continuously.")
+    st.download_button("Download metrics (Prometheus text)", data=metrics.prometheus_text,
+                       file_name="hr_portal_metrics.prom", mime="text/plain")
+
+# --- Admin Section: Slow Rerun Profiles ---
+@page_route("profiles", roles=("admin",), imports=("pd",))
+def admin_slow_rerun_profiles():
+    st.title("🔬 Admin Panel - Slow Rerun Profiles")
+    st.write("When switched on, any page load slower than the threshold is profiled with cProfile and kept here. "
+             "Profiling slows every page load down, so switch it off once you have the traces you need.")
+    profiler = get_profiler()
+    settings = profiler.settings
+
+    with st.form("profiling_settings_form"):
+        enabled = st.checkbox("Profile slow page loads", value=settings['enabled'])
+        threshold_s = st.number_input("Threshold (seconds)", min_value=0.0, value=float(settings['threshold_s']), step=0.5)
+        max_traces = st.number_input("Traces to keep", min_value=1, max_value=1000, value=int(settings['max_traces']), step=10)
+        if st.form_submit_button("Save Settings"):
+            profiler.update_settings(enabled, threshold_s, max_traces)
+            st.success("Profiling settings saved.")
+            st.rerun()
+
+    traces = profiler.list_traces()
+    if not traces:
+        st.info("No slow page loads have been profiled yet.")
+        return
+
+    df_traces = pd.DataFrame([{
+        "Captured": trace['captured_at'], "Page": trace['page'], "Role": trace['role'],
+        "Duration (s)": trace['duration_s'], "Size (KB)": round(trace['size'] / 1024, 1), "Trace": trace['trace'],
+    } for trace in traces])
+    st.dataframe(df_traces, use_container_width=True, hide_index=True)
+
+    st.subheader("Trace Details")
+    trace_labels = {f"{trace['captured_at']} — {trace['page']} ({trace['role']}, {trace['duration_s']} s)": trace['trace'] for trace in traces}
+    selected_trace = trace_labels[st.selectbox("Select Trace", options=list(trace_labels))]
+    sort_by = st.radio("Sort by", ["cumulative", "tottime", "ncalls"], horizontal=True, key="profile_sort_by")
+    st.code(profiler.trace_summary(selected_trace, sort_by=sort_by), language=None)
+    st.download_button("Download Trace (.prof)", data=lambda: profiler.read_trace(selected_trace),
+                       file_name=selected_trace, mime="application/octet-stream")
+    st.caption("Open downloaded traces with `python -m pstats <file>` or snakeviz.")
+
+    if st.button("Delete All Traces", key="delete_profiles"):
+        profiler.clear()
+        st.rerun()
 
 # --- Main Application Logic ---
 def main():
     setup_initial_data() # Ensure initial data is set up on first run or if files are empty
+    export_metrics()
 
     if not st.session_state.logged_in:
-        login_form()
+        with get_metrics().timer("page_render", page="login"):
+            login_form()
     else:
         display_sidebar()
 
         # Display the selected page based on session state
-        if st.session_state.current_page == "dashboard":
-            display_dashboard()
-        elif st.session_state.current_page == "my_profile":
-            display_my_profile()
-        elif st.session_state.current_page == "leave_request":
-            leave_request_form()
-        elif st.session_state.current_page == "view_leave_applications":
-            view_leave_applications()
-        elif st.session_state.current_page == "opex_capex_form":
-            opex_capex_form()
-        elif st.session_state.current_page == "manage_opex_capex_approvals": # New page
-            # Only admin can access this
-            if st.session_state.current_user and st.session_state.current_user['role'] == 'admin':
-                manage_opex_capex_approvals()
-            else:
-                st.error("Access Denied: You do not have permission to view this page.")
-                st.session_state.current_page = "dashboard" # Redirect to dashboard
-                st.rerun()
-        elif st.session_state.current_page == "view_opex_capex_requests":
-            view_opex_capex_requests()
-        elif st.session_state.current_page == "performance_goal_setting":
-            performance_goal_setting()
-        elif st.session_state.current_page == "self_appraisal":
-            self_appraisal()
-        elif st.session_state.current_page == "hr_policies": # New page
-            display_hr_policies()
-        elif st.session_state.current_page == "my_payslips": # New page
-            display_my_payslips()
-        elif st.session_state.current_page == "manage_users": # New admin page
-            if st.session_state.current_user and st.session_state.current_user['role'] == 'admin':
-                admin_manage_users()
-            else:
-                st.error("Access Denied: You do not have permission to view this page.")
-                st.session_state.current_page = "dashboard"
-                st.rerun()
-        elif st.session_state.current_page == "upload_payroll": # New admin page
-            if st.session_state.current_user and st.session_state.current_user['role'] == 'admin':
-                admin_upload_payroll()
-            else:
-                st.error("Access Denied: You do not have permission to view this page.")
-                st.session_state.current_page = "dashboard"
-                st.rerun()
-        elif st.session_state.current_page == "manage_beneficiaries": # New admin page
-            if st.session_state.current_user and st.session_state.current_user['role'] == 'admin':
-                admin_manage_beneficiaries()
-            else:
-                st.error("Access Denied: You do not have permission to view this page.")
-                st.session_state.current_page = "dashboard"
-                st.rerun()
-        elif st.session_state.current_page == "manage_hr_policies": # New admin page
-            if st.session_state.current_user and st.session_state.current_user['role'] == 'admin':
-                admin_manage_hr_policies()
-            else:
-                st.error("Access Denied: You do not have permission to view this page.")
-                st.session_state.current_page = "dashboard"
-                st.rerun()
+        render_page(st.session_state.current_page)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally: # Also runs when st.rerun() cuts the rerun short
+        get_profiler().finish(rerun_profile)
@@ -0,0 +1,115 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from hr_analytics import leave_date_range
+from hr_store import LEAVE_REQUESTS_FILE, file_signature
+
+# Leave occupancy calendar: a (day x staff) matrix of approved leave over a
+# three-year window (last year, this year, next year). Each cell counts the
+# approved requests covering that staff member on that day, so approving or
+# rejecting a request is a single slice update and "who is out" questions are
+# vectorised column scans instead of a pass over every leave request.
+
+class LeaveCalendar:
+    def __init__(self, leave_requests, today=None):
+        self._lock = threading.RLock()
+        today = today or date.today()
+        self.first_day = date(today.year - 1, 1, 1)
+        self.last_day = date(today.year + 1, 12, 31)
+        self.num_days = (self.last_day - self.first_day).days + 1
+        self.staff_ids = [] # column -> staff_id
+        self._column_by_staff_id = {}
+        self.occupancy = np.zeros((self.num_days, 64), dtype=np.uint16)
+        for leave_request in leave_requests:
+            self._contribute(leave_request, 1)
+        self.signature = file_signature(LEAVE_REQUESTS_FILE)
+
+    # --- Sync with the leave requests file (same contract as DashboardAggregates) ---
+    def is_current(self, today=None):
+        today = today or date.today()
+        return self.first_day.year == today.year - 1 and self.signature == file_signature(LEAVE_REQUESTS_FILE)
+
+    def mark_synced(self, filename, previous_signature):
+        with self._lock:
+            if filename == LEAVE_REQUESTS_FILE and self.signature == previous_signature:
+                self.signature = file_signature(filename)
+
+    def apply(self, kind, before=None, after=None):
+        if kind != "leave":
+            return
+        with self._lock:
+            if before is not None:
+                self._contribute(before, -1)
+            if after is not None:
+                self._contribute(after, 1)
+
+    def _column(self, staff_id):
+        column = self._column_by_staff_id.get(staff_id)
+        if column is None:
+            column = len(self.staff_ids)
+            if column == self.occupancy.shape[1]: # Grow capacity geometrically
+                self.occupancy = np.concatenate([self.occupancy, np.zeros_like(self.occupancy)], axis=1)
+            self.staff_ids.append(staff_id)
+            self._column_by_staff_id[staff_id] = column
+        return column
+
+    def _day_slice(self, start_date, end_date):
+        start = max((start_date - self.first_day).days, 0)
+        end = min((end_date - self.first_day).days, self.num_days - 1)
+        return slice(start, end + 1) if start <= end else None
+
+    def _contribute(self, leave_request, sign):
+        if leave_request.get('status') != 'Approved':
+            return
+        date_range = leave_date_range(leave_request)
+        if date_range is None:
+            return
+        day_slice = self._day_slice(*date_range)
+        if day_slice is None:
+            return # Entirely outside the calendar window
+        column = self._column(leave_request.get('staff_id'))
+        if sign > 0:
+            self.occupancy[day_slice, column] += 1
+        else:
+            cells = self.occupancy[day_slice, column]
+            cells -= np.minimum(cells, 1) # Never wrap below zero
+
+    # --- Queries ---
+    def _staff_matrix(self, start_date, end_date):
+        day_slice = self._day_slice(start_date, end_date)
+        if day_slice is None:
+            return None
+        return self.occupancy[day_slice, :len(self.staff_ids)] > 0
+
+    def who_is_out(self, day):
+        # Staff IDs on approved leave on `day`
+        out = self._staff_matrix(day, day)
+        if out is None:
+            return []
+        return [self.staff_ids[column] for column in np.flatnonzero(out[0])]
+
+    def days_out_in_range(self, start_date, end_date):
+        # {staff_id: days on approved leave between start_date and end_date (inclusive)}
+        out = self._staff_matrix(start_date, end_date)
+        if out is None:
+            return {}
+        days_out = out.sum(axis=0)
+        return {self.staff_ids[column]: int(days_out[column]) for column in np.flatnonzero(days_out)}
+
+    def department_heatmap(self, start_date, end_date, department_by_staff_id):
+        # Returns (days, departments, counts) where counts[d, i] is the number of
+        # staff in departments[i] out on days[d]
+        out = self._staff_matrix(start_date, end_date)
+        if out is None:
+            return [], [], np.zeros((0, 0), dtype=np.int32)
+        staff_departments = [department_by_staff_id.get(staff_id, 'Unknown') for staff_id in self.staff_ids]
+        departments = sorted(set(department_by_staff_id.values()) | set(staff_departments))
+        department_position = {department: i for i, department in enumerate(departments)}
+        membership = np.zeros((len(self.staff_ids), len(departments)), dtype=np.int32)
+        membership[np.arange(len(self.staff_ids)), [department_position[d] for d in staff_departments]] = 1
+        counts = out.astype(np.int32) @ membership
+        first = max(start_date, self.first_day)
+        days = [first + timedelta(days=offset) for offset in range(counts.shape[0])]
+        return days, departments, counts
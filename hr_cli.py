@@ -0,0 +1,328 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from hr_store import (
+    DATA_DIR, USERS_FILE, LEAVE_REQUESTS_FILE, OPEX_CAPEX_REQUESTS_FILE, PERFORMANCE_GOALS_FILE,
+    SELF_APPRAISALS_FILE, PAYROLL_FILE, PUBLIC_HOLIDAYS_FILE, DEFAULT_STAFF_PASSWORD, PAYROLL_REQUIRED_COLUMNS,
+    BULK_IMPORT_REQUIRED_COLUMNS, STALE_TEMP_FILE_AGE_S, load_json, write_json_atomic, get_staff_id,
+    recover_pending_transaction, finish_offboarding, import_payroll_file, import_staff_rows, TrainingStore, migrate_training_records,
+    training_attendance_report, BlobStore, live_document_refs, migrate_legacy_documents,
+    RecordArchive, RECORD_ARCHIVE_TABLES, DEFAULT_ARCHIVE_AFTER_MONTHS, record_key, archive_closed_records
+)
+from hr_export import write_export
+
+# Command-line entry point for batch HR operations, for cron jobs and scripts.
+# It calls the same hr_store / hr_analytics / hr_payslips functions as the
+# Streamlit app and never imports streamlit. The running app notices the
+# changed files through their signatures and reloads them on its next rerun.
+#
+# Usage (from the portal directory, or pass -C <portal directory>):
+#   python hr_cli.py import-payroll payroll_2025_06.csv
+#   python hr_cli.py import-staff new_starters.csv
+#   python hr_cli.py render-payslips --year 2025 --month 6 --output-dir payslips/
+#   python hr_cli.py export leave --format csv --output leave.csv
+#   python hr_cli.py export payroll --format parquet --output payroll.parquet
+#   python hr_cli.py report leave-balances --year 2025
+#   python hr_cli.py migrate
+#   python hr_cli.py reindex --verify
+#   python hr_cli.py compact
+#   python hr_cli.py archive --months 12
+
+EXPORT_TABLES = {
+    "users": USERS_FILE,
+    "leave": LEAVE_REQUESTS_FILE,
+    "opex-capex": OPEX_CAPEX_REQUESTS_FILE,
+    "payroll": PAYROLL_FILE,
+    "performance-goals": PERFORMANCE_GOALS_FILE,
+    "self-appraisals": SELF_APPRAISALS_FILE,
+    "training": None, # Read through TrainingStore
+}
+OUTPUT_FORMATS = ("csv", "json", "jsonl", "xlsx", "parquet")
+BINARY_OUTPUT_FORMATS = ("xlsx", "parquet") # Written through hr_export
+
+# --- Input/Output ---
+def read_table(path):
+    # Rows of a CSV file as dicts; .xlsx files need pandas and openpyxl
+    if path.lower().endswith((".xlsx", ".xls")):
+        import pandas as pd
+        return pd.read_excel(path).to_dict("records")
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        return list(csv.DictReader(file))
+
+def write_rows(rows, output_format, output=None):
+    # Streams rows to `output` (stdout when None or "-"); nested values are JSON-encoded in CSV
+    if output_format in BINARY_OUTPUT_FORMATS:
+        rows = list(rows)
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        make_rows = lambda: ([row.get(column) for column in columns] for row in rows)
+        if output in (None, "-"):
+            write_export(make_rows, columns, output_format, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            with open(output, "wb") as file:
+                write_export(make_rows, columns, output_format, file)
+        return
+    file = sys.stdout if output in (None, "-") else open(output, "w", newline="", encoding="utf-8")
+    try:
+        if output_format == "json":
+            json.dump(list(rows), file, indent=4, default=str)
+            file.write("\n")
+        elif output_format == "jsonl":
+            for row in rows:
+                file.write(json.dumps(row, default=str) + "\n")
+        else:
+            rows = list(rows)
+            columns = list(dict.fromkeys(column for row in rows for column in row))
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({column: json.dumps(value) if isinstance(value, (list, dict)) else value
+                                 for column, value in row.items()})
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+def print_summary(title, counts):
+    print(title)
+    for name, value in counts.items():
+        print(f"  {name.replace('_', ' ')}: {value}")
+
+def _user_row(user):
+    # Flat view of a user without the password hash
+    return {"username": user.get('username'), "role": user.get('role'), "staff_id": get_staff_id(user),
+            **{field: value for field, value in user.get('profile', {}).items() if field != 'staff_id'}}
+
+def table_rows(table, include_archive=False):
+    if table == "training":
+        return list(TrainingStore().records.values())
+    rows = load_json(EXPORT_TABLES[table], [])
+    if table == "users":
+        return [_user_row(user) for user in rows]
+    if include_archive and table in RECORD_ARCHIVE_TABLES:
+        hot_keys = {record_key(table, row) for row in rows}
+        rows += [row for _, row in RecordArchive().scan(table) if record_key(table, row) not in hot_keys]
+    return rows
+
+# --- Commands ---
+def cmd_import_payroll(args):
+    rows = read_table(args.file)
+    missing = [column for column in PAYROLL_REQUIRED_COLUMNS if rows and column not in rows[0]]
+    if missing:
+        print(f"Missing required columns: {', '.join(missing)}", file=sys.stderr)
+        return 2
+    result = import_payroll_file(rows)
+    print_summary(f"Imported {args.file} ({len(rows)} rows)",
+                  {"added": result['added'], "updated": result['updated'], "skipped": result['skipped']})
+    for entry in result['skipped_rows']:
+        print(f"  row {entry['row']} ({entry['staff_id'] or 'no staff ID'}): {entry['message']}", file=sys.stderr)
+    return 1 if result['skipped'] and args.strict else 0
+
+def cmd_import_staff(args):
+    rows = read_table(args.file)
+    missing = [column for column in BULK_IMPORT_REQUIRED_COLUMNS if rows and column not in rows[0]]
+    if missing:
+        print(f"Missing required columns: {', '.join(missing)}", file=sys.stderr)
+        return 2
+    _, report = import_staff_rows(load_json(USERS_FILE, []), rows, password=args.password, max_workers=args.workers)
+    skipped = [entry for entry in report if entry['status'] == "Skipped"]
+    print_summary(f"Imported {args.file} ({len(rows)} rows)", {"added": len(report) - len(skipped), "skipped": len(skipped)})
+    for entry in skipped:
+        print(f"  row {entry['row']} ({entry['username'] or 'no username'}): {entry['message']}", file=sys.stderr)
+    return 1 if skipped and args.strict else 0
+
+def _render_payslip(job):
+    # Runs in a worker process
+    from hr_payslips import generate_payslip_pdf
+    payslip, profile, output_path = job
+    with open(output_path, "wb") as file:
+        file.write(generate_payslip_pdf(payslip, profile, payslip.get('staff_id')))
+    return output_path
+
+def cmd_render_payslips(args):
+    profiles = {get_staff_id(user): user.get('profile', {}) for user in load_json(USERS_FILE, [])}
+    staff_ids = set(args.staff_id or [])
+    payslips = [
+        payslip for payslip in load_json(PAYROLL_FILE, [])
+        if payslip.get('year') == args.year and (args.month is None or payslip.get('month') == args.month)
+        and (not staff_ids or payslip.get('staff_id') in staff_ids)
+    ]
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = []
+    for payslip in payslips:
+        profile = profiles.get(payslip.get('staff_id'))
+        if profile is None:
+            print(f"  skipped payslip {payslip.get('payslip_id')}: no user with staff ID {payslip.get('staff_id')}", file=sys.stderr)
+            continue
+        # Same file name as the My Payslips download, with the slashes in staff IDs replaced
+        file_name = f"Payslip_{payslip.get('month', 'N/A')}_{payslip.get('year', 'N/A')}_{payslip.get('staff_id', 'N/A')}.pdf".replace("/", "-")
+        jobs.append((payslip, profile, os.path.join(args.output_dir, file_name)))
+
+    started = time.perf_counter()
+    workers = args.workers or os.cpu_count() or 1
+    if workers > 1 and len(jobs) >= 8:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_render_payslip, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        for job in jobs:
+            _render_payslip(job)
+    print(f"Rendered {len(jobs)} payslip(s) to {args.output_dir} in {time.perf_counter() - started:.1f} s")
+    return 0
+
+def cmd_export(args):
+    write_rows(table_rows(args.table, include_archive=args.include_archive), args.format, args.output)
+    return 0
+
+def cmd_report(args):
+    if args.report in ("training-courses", "training-departments"):
+        by_course, by_department = training_attendance_report(TrainingStore(), load_json(USERS_FILE, []))
+        rows = by_course if args.report == "training-courses" else by_department
+    else: # leave-balances
+        from hr_analytics import LEAVE_ENTITLEMENTS, LeaveLedger, parse_holidays
+        ledger = LeaveLedger(load_json(LEAVE_REQUESTS_FILE, []), parse_holidays(load_json(PUBLIC_HOLIDAYS_FILE, [])))
+        year = args.year or date.today().year
+        rows = []
+        for user in load_json(USERS_FILE, []):
+            if user.get('role') == 'admin':
+                continue
+            profile = user.get('profile', {})
+            try:
+                joined_on = date.fromisoformat(str(profile.get('work_anniversary')))
+            except ValueError:
+                joined_on = None
+            for leave_type in LEAVE_ENTITLEMENTS:
+                balance = ledger.balance(get_staff_id(user), leave_type, profile.get('grade_level', ''), year=year, joined_on=joined_on)
+                rows.append({"staff_id": get_staff_id(user), "name": profile.get('name'), "year": year,
+                             "leave_type": leave_type, **balance})
+    write_rows(rows, args.format, args.output)
+    return 0
+
+def cmd_migrate(args):
+    recover_pending_transaction() # Finish any multi-file write that was interrupted
+    training_store = TrainingStore()
+    finish_offboarding(RecordArchive(), training_store) # ... and any offboarding cleanup it left pending
+    users = load_json(USERS_FILE, [])
+    training_migrated = migrate_training_records(users, training_store)
+    if training_migrated:
+        write_json_atomic(users, USERS_FILE)
+    documents_migrated = {}
+    for kind, id_field, filename in (("leave", "request_id", LEAVE_REQUESTS_FILE), ("opex", "req_id", OPEX_CAPEX_REQUESTS_FILE)):
+        records = load_json(filename, [])
+        documents_migrated[kind] = migrate_legacy_documents(records, kind, id_field, BlobStore())
+        if documents_migrated[kind]:
+            write_json_atomic(records, filename)
+    print_summary("Migration finished", {
+        "legacy training records moved": "yes" if training_migrated else "none found",
+        "legacy leave documents moved": "yes" if documents_migrated["leave"] else "none found",
+        "legacy requisition documents moved": "yes" if documents_migrated["opex"] else "none found",
+    })
+    return 0
+
+def cmd_reindex(args):
+    # Archived leave requests and requisitions keep their documents too
+    record_archive = RecordArchive()
+    leave_requests = load_json(LEAVE_REQUESTS_FILE, []) + [row for _, row in record_archive.scan("leave")]
+    opex_capex_requests = load_json(OPEX_CAPEX_REQUESTS_FILE, []) + [row for _, row in record_archive.scan("opex-capex")]
+    report = BlobStore().reindex(live_document_refs(leave_requests, opex_capex_requests), verify=args.verify)
+    corrupt = report.pop("corrupt_blobs")
+    print_summary("Document index rebuilt", report)
+    for sha256 in corrupt:
+        print(f"  corrupt blob: {sha256}", file=sys.stderr)
+    return 1 if corrupt else 0
+
+def cmd_compact(args):
+    training_store = TrainingStore()
+    size_before = os.path.getsize(training_store.filename) if os.path.exists(training_store.filename) else 0
+    training_store.compact()
+    # Temp files left next to data files by writes that were interrupted
+    now = time.time()
+    stale_temp_files = [path for path in glob.glob(os.path.join(DATA_DIR, "*.tmp")) if now - os.path.getmtime(path) > STALE_TEMP_FILE_AGE_S]
+    for path in stale_temp_files:
+        os.remove(path)
+    print_summary("Compaction finished", {
+        "training log": f"{size_before / 1024:,.1f} KB -> {os.path.getsize(training_store.filename) / 1024:,.1f} KB "
+                        f"({len(training_store.records)} live records)",
+        "stale temp files deleted": len(stale_temp_files),
+    })
+    return 0
+
+def cmd_archive(args):
+    report = archive_closed_records(months=args.months, dry_run=args.dry_run)
+    print_summary(f"{'Would archive' if args.dry_run else 'Archived'} records closed before {report['cutoff']}", {
+        table: f"{counts['archived']} archived, {counts['kept_hot']} kept" for table, counts in report.items() if table in RECORD_ARCHIVE_TABLES
+    })
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="hr_cli.py", description="Batch HR operations without the Streamlit UI")
+    parser.add_argument("-C", "--directory", help="Portal directory containing hr_data (default: current directory)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("import-payroll", help="Add or replace payslips from a CSV/XLSX file")
+    command.add_argument("file")
+    command.add_argument("--strict", action="store_true", help="Exit with status 1 if any row was skipped")
+    command.set_defaults(handler=cmd_import_payroll)
+
+    command = commands.add_parser("import-staff", help="Add staff from a CSV/XLSX file")
+    command.add_argument("file")
+    command.add_argument("--password", default=DEFAULT_STAFF_PASSWORD, help="First-login password for the new staff")
+    command.add_argument("--workers", type=int, help="Processes used for password hashing (default: all CPUs)")
+    command.add_argument("--strict", action="store_true", help="Exit with status 1 if any row was skipped")
+    command.set_defaults(handler=cmd_import_staff)
+
+    command = commands.add_parser("render-payslips", help="Write payslip PDFs for a month or year")
+    command.add_argument("--year", type=int, required=True)
+    command.add_argument("--month", type=int, help="1-12; all months of the year when omitted")
+    command.add_argument("--staff-id", action="append", help="Only this staff ID (repeatable)")
+    command.add_argument("--output-dir", required=True)
+    command.add_argument("--workers", type=int, help="Rendering processes (default: all CPUs)")
+    command.set_defaults(handler=cmd_render_payslips)
+
+    command = commands.add_parser("export", help="Export a data table")
+    command.add_argument("table", choices=list(EXPORT_TABLES))
+    command.add_argument("--format", choices=OUTPUT_FORMATS, default="csv")
+    command.add_argument("--output", help="Output file (default: stdout)")
+    command.add_argument("--include-archive", action="store_true", help="Also export archived records (leave, opex-capex, payroll)")
+    command.set_defaults(handler=cmd_export)
+
+    command = commands.add_parser("report", help="Print a report")
+    command.add_argument("report", choices=["leave-balances", "training-courses", "training-departments"])
+    command.add_argument("--year", type=int, help="Leave year (default: this year)")
+    command.add_argument("--format", choices=OUTPUT_FORMATS, default="csv")
+    command.add_argument("--output", help="Output file (default: stdout)")
+    command.set_defaults(handler=cmd_report)
+
+    command = commands.add_parser("migrate", help="Finish interrupted writes and move legacy data into its current stores")
+    command.set_defaults(handler=cmd_migrate)
+
+    command = commands.add_parser("reindex", help="Rebuild the document blob index from the leave records and files on disk")
+    command.add_argument("--verify", action="store_true", help="Also re-hash every blob to detect corruption")
+    command.set_defaults(handler=cmd_reindex)
+
+    command = commands.add_parser("compact", help="Compact the training log and delete stale temp files")
+    command.set_defaults(handler=cmd_compact)
+
+    command = commands.add_parser("archive", help="Move closed leave, requisitions and payroll into compressed monthly archive files")
+    command.add_argument("--months", type=int, default=DEFAULT_ARCHIVE_AFTER_MONTHS, help="Archive records closed more than this many months ago")
+    command.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+    command.set_defaults(handler=cmd_archive)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.directory:
+        os.chdir(args.directory) # Data paths in hr_store are relative to the portal directory
+    try:
+        return args.handler(args)
+    except BrokenPipeError: # Output piped into e.g. `head`, which has exited
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno()) # Silence the flush at interpreter exit
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
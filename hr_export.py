@@ -0,0 +1,137 @@
+import csv
+import importlib.util
+import io
+import itertools
+import json
+import numbers
+import tempfile
+from datetime import date, datetime
+
+# Chunked table export to CSV, Excel and Parquet, shared by the table views'
+# export buttons and the CLI. Rows are pulled from an iterator EXPORT_CHUNK_ROWS
+# at a time and written straight to the output file, so exporting a large
+# table never builds a second copy of it in memory. Excel (openpyxl) and
+# Parquet (pyarrow) are optional; available_export_formats() lists what is
+# installed.
+
+EXPORT_FORMATS = {
+    "csv": {"label": "CSV", "mime": "text/csv", "module": None},
+    "xlsx": {"label": "Excel", "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "module": "openpyxl"},
+    "parquet": {"label": "Parquet", "mime": "application/vnd.apache.parquet", "module": "pyarrow"},
+}
+EXPORT_CHUNK_ROWS = 10_000
+XLSX_MAX_ROWS_PER_SHEET = 1_048_576 # Excel's limit, header row included
+
+def available_export_formats():
+    return [export_format for export_format, spec in EXPORT_FORMATS.items()
+            if spec['module'] is None or importlib.util.find_spec(spec['module']) is not None]
+
+def _chunks(rows, size=EXPORT_CHUNK_ROWS):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+def _is_missing(value):
+    return value is None or value != value # NaN and NaT are not equal to themselves
+
+def _text(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def _cell(value):
+    # Excel takes numbers and dates as they are, everything else as text
+    if _is_missing(value):
+        return None
+    if isinstance(value, (numbers.Number, date, datetime)) or type(value).__name__ == "bool_":
+        return value.item() if hasattr(value, "item") else value # numpy scalars
+    return _text(value)
+
+# --- Writers ---
+def _write_csv(make_rows, columns, file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="", write_through=True) # BOM so Excel reads UTF-8
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    for chunk in _chunks(make_rows()):
+        writer.writerows([["" if _is_missing(value) else _text(value) for value in row] for row in chunk])
+    text.detach() # Leave `file` open for the caller
+
+def _write_xlsx(make_rows, columns, file, sheet_name):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True) # Rows are streamed to disk, not kept as cell objects
+    sheet_name = sheet_name[:28] # Excel caps names at 31 characters; leave room for " 2"
+    sheet, sheet_rows, sheet_number = None, XLSX_MAX_ROWS_PER_SHEET, 0
+    for chunk in _chunks(make_rows()):
+        for row in chunk:
+            if sheet_rows == XLSX_MAX_ROWS_PER_SHEET: # Continue on a new sheet
+                sheet_number += 1
+                sheet = workbook.create_sheet(sheet_name if sheet_number == 1 else f"{sheet_name} {sheet_number}")
+                sheet.append(columns)
+                sheet_rows = 1
+            sheet.append([_cell(value) for value in row])
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet(sheet_name).append(columns)
+    workbook.save(file)
+
+def _parquet_schema(rows, columns):
+    # One pass over the rows to pick a column type that fits every value:
+    # bool, int64, float64 (ints mixed with floats), date32, timestamp or string
+    import pyarrow as pa
+    kinds = [set() for _ in columns]
+    for row in rows:
+        for position, value in enumerate(row):
+            if _is_missing(value):
+                continue
+            if isinstance(value, bool) or type(value).__name__ == "bool_":
+                kinds[position].add("bool")
+            elif isinstance(value, numbers.Integral):
+                kinds[position].add("int")
+            elif isinstance(value, numbers.Real):
+                kinds[position].add("float")
+            elif isinstance(value, datetime):
+                kinds[position].add("timestamp")
+            elif isinstance(value, date):
+                kinds[position].add("date")
+            else:
+                kinds[position].add("string")
+    types = {
+        frozenset({"bool"}): pa.bool_(), frozenset({"int"}): pa.int64(), frozenset({"float"}): pa.float64(),
+        frozenset({"int", "float"}): pa.float64(), frozenset({"date"}): pa.date32(), frozenset({"timestamp"}): pa.timestamp("us"),
+    }
+    return pa.schema([(str(column), types.get(frozenset(column_kinds), pa.string())) for column, column_kinds in zip(columns, kinds)])
+
+def _write_parquet(make_rows, columns, file):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _parquet_schema(make_rows(), columns)
+    converters = {pa.bool_(): bool, pa.int64(): int, pa.float64(): float, pa.string(): _text}
+    with pq.ParquetWriter(file, schema, compression="snappy") as writer:
+        for chunk in _chunks(make_rows()):
+            arrays = []
+            for position, field in enumerate(schema):
+                convert = converters.get(field.type, lambda value: value)
+                arrays.append(pa.array([None if _is_missing(row[position]) else convert(row[position]) for row in chunk], type=field.type))
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+def write_export(make_rows, columns, export_format, file, sheet_name="Export"):
+    # Writes the rows to the binary `file`. `make_rows()` must return a fresh
+    # iterator of sequences aligned with `columns` each time it is called:
+    # Parquet reads the rows twice, once to settle the column types.
+    if export_format == "csv":
+        _write_csv(make_rows, columns, file)
+    elif export_format == "xlsx":
+        _write_xlsx(make_rows, columns, file, sheet_name)
+    elif export_format == "parquet":
+        _write_parquet(make_rows, columns, file)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+def export_bytes(make_rows, columns, export_format, sheet_name="Export"):
+    # write_export() into a temporary file, returning its contents for a download
+    with tempfile.TemporaryFile() as file:
+        write_export(make_rows, columns, export_format, file, sheet_name=sheet_name)
+        file.seek(0)
+        return file.read()
@@ -0,0 +1,170 @@
+import calendar
+import math
+import re
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+from hr_store import get_staff_id
+
+# In-memory indexes over HR data. They are rebuilt from the loaded records
+# and cached by the app against the data file's signature, so none of them
+# import streamlit or touch the disk themselves.
+
+# --- Staff Directory ---
+TOKEN_SPLIT_PATTERN = re.compile(r"[\s/_.@()-]+")
+
+class StaffDirectory:
+    SEARCH_FIELDS = ("name", "username", "staff_id", "department")
+
+    def __init__(self, users):
+        self.entries = []
+        self._position_by_username = {}
+        self._trigrams = {} # trigram -> set of entry positions
+        prefix_tokens = [] # (token, position), sorted for bisect prefix lookups
+
+        for user in users:
+            profile = user.get('profile', {})
+            entry = {
+                "username": user.get('username', ''),
+                "name": profile.get('name') or user.get('username', ''),
+                "staff_id": get_staff_id(user) or '',
+                "department": profile.get('department') or 'Unassigned',
+                "grade_level": profile.get('grade_level', ''),
+                "role": user.get('role', 'staff'),
+                "position": len(self.entries), # Index into the users list the directory was built from
+            }
+            position = entry['position']
+            self.entries.append(entry)
+            self._position_by_username[entry['username']] = position
+
+            for field in self.SEARCH_FIELDS:
+                value = str(entry[field]).lower()
+                for token in set(TOKEN_SPLIT_PATTERN.split(value)) | {value}:
+                    if token:
+                        prefix_tokens.append((token, position))
+                for i in range(len(value) - 2):
+                    self._trigrams.setdefault(value[i:i + 3], set()).add(position)
+
+        prefix_tokens.sort()
+        self._prefix_tokens = prefix_tokens
+        self._name_order = sorted(range(len(self.entries)), key=lambda pos: self.entries[pos]['name'].lower())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, username):
+        position = self._position_by_username.get(username)
+        return self.entries[position] if position is not None else None
+
+    def _prefix_matches(self, query):
+        matches = set()
+        start = bisect_left(self._prefix_tokens, (query,))
+        for token, position in self._prefix_tokens[start:]:
+            if not token.startswith(query):
+                break
+            matches.add(position)
+        return matches
+
+    def _substring_matches(self, query):
+        candidates = None
+        for i in range(len(query) - 2):
+            positions = self._trigrams.get(query[i:i + 3], set())
+            candidates = positions if candidates is None else candidates & positions
+            if not candidates:
+                return set()
+        # Trigrams can match out of order, so confirm against the actual values
+        return {
+            pos for pos in candidates
+            if any(query in str(self.entries[pos][field]).lower() for field in self.SEARCH_FIELDS)
+        }
+
+    def search(self, query="", departments=None, include_admins=False, roles=None):
+        # Name-ordered entries matching `query`. Short queries match word
+        # prefixes; three or more characters match anywhere via trigrams.
+        query = (query or "").strip().lower()
+        if not query:
+            matches = None
+        elif len(query) < 3:
+            matches = self._prefix_matches(query)
+        else:
+            matches = self._substring_matches(query)
+
+        results = []
+        for position in self._name_order:
+            if matches is not None and position not in matches:
+                continue
+            entry = self.entries[position]
+            if roles is not None and entry['role'] not in roles:
+                continue
+            if departments is not None and entry['department'] not in departments and not (include_admins and entry['role'] == 'admin'):
+                continue
+            results.append(entry)
+        return results
+
+def paginate(items, page, page_size):
+    # Returns (items on the page, total pages); `page` is 1-based and clamped
+    total_pages = max(1, math.ceil(len(items) / page_size))
+    page = min(max(1, page), total_pages)
+    start = (page - 1) * page_size
+    return items[start:start + page_size], total_pages
+
+# --- Birthdays & Work Anniversaries ---
+class AnnualDateIndex:
+    # Profile dates that recur every year (date_of_birth, work_anniversary),
+    # sorted by (month, day) so "next N days" is one or two bisect range scans.
+    # 29 February dates fall on 28 February in non-leap years.
+
+    def __init__(self, users, field):
+        self.field = field
+        entries = []
+        for user in users:
+            profile = user.get('profile', {})
+            name = profile.get('name')
+            raw_value = profile.get(field)
+            if not name or not raw_value:
+                continue
+            try:
+                original = raw_value if isinstance(raw_value, date) else date.fromisoformat(str(raw_value))
+            except ValueError:
+                continue # Skip malformed dates
+            entries.append(((original.month, original.day), name, original))
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        self._keys = [entry[0] for entry in entries]
+        self._entries = entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _range(self, start_key, end_key):
+        return self._entries[bisect_left(self._keys, start_key):bisect_right(self._keys, end_key)]
+
+    def upcoming(self, today, days=30):
+        # Entries whose next occurrence is within `days` days of `today` (inclusive),
+        # as (occurrence date, days until, name, original date), soonest first
+        window_end = today + timedelta(days=days)
+        end_key = (window_end.month, window_end.day)
+        if end_key == (2, 28) and not calendar.isleap(window_end.year):
+            end_key = (2, 29) # 29 Feb dates are celebrated on the 28th this year
+
+        start_key = (today.month, today.day)
+        if window_end.year == today.year:
+            matches = self._range(start_key, end_key)
+        else: # Window wraps into next year
+            matches = self._range(start_key, (12, 31)) + self._range((1, 1), end_key)
+
+        results = []
+        for key, name, original in matches:
+            occurrence = _occurrence_in_year(key, today.year if key >= start_key else today.year + 1)
+            if occurrence < today: # 29 Feb already celebrated on the 28th
+                occurrence = _occurrence_in_year(key, today.year + 1)
+            days_until = (occurrence - today).days
+            if 0 <= days_until <= days:
+                results.append((occurrence, days_until, name, original))
+        results.sort(key=lambda result: (result[1], result[2]))
+        return results
+
+def _occurrence_in_year(month_day, year):
+    month, day = month_day
+    if (month, day) == (2, 29) and not calendar.isleap(year):
+        day = 28
+    return date(year, month, day)
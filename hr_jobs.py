@@ -0,0 +1,100 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from hr_store import JOBS_FILE, load_json, write_json_atomic
+
+# In-process background job runner. Admin pages submit slow work (payroll
+# imports, offboarding cascades, report generation) and return at once; the
+# work runs on a small thread pool that belongs to the server process, so it
+# keeps going across reruns and after the browser tab is closed. Every job's
+# status, progress and timings are kept in a JSON job table, so finished jobs
+# are still listed after a restart and jobs cut short by one are marked as such.
+#
+# Job functions must not touch st.session_state: they read and write the data
+# files directly and receive a `progress(fraction, message=None)` callback.
+
+ACTIVE_JOB_STATUSES = ("Queued", "Running")
+PROGRESS_SAVE_INTERVAL_S = 1.0 # Progress updates are persisted at most this often
+MAX_FINISHED_JOBS = 200 # Older finished jobs are dropped from the job table
+
+class JobRunner:
+    def __init__(self, jobs_file=JOBS_FILE, max_workers=2):
+        self.jobs_file = jobs_file
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hr-job")
+        self.jobs = load_json(jobs_file, {}) # job_id -> job, in submission order
+        for job in self.jobs.values():
+            if job['status'] in ACTIVE_JOB_STATUSES: # The process running it has gone
+                job.update(status="Interrupted", message="Server restarted before the job finished",
+                           finished_at=_now())
+        self._last_saved = 0.0
+        self._save()
+
+    def _save(self):
+        with self._lock:
+            write_json_atomic(self.jobs, self.jobs_file)
+            self._last_saved = time.monotonic()
+
+    def submit(self, kind, description, func, *args, submitted_by=None, **kwargs):
+        # Queues func(*args, progress=..., **kwargs) and returns the new job's ID.
+        # The function's return value (JSON-serialisable) becomes the job result.
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self.jobs[job_id] = {
+                "job_id": job_id, "kind": kind, "description": description, "submitted_by": submitted_by,
+                "status": "Queued", "progress": 0.0, "message": "",
+                "submitted_at": _now(), "started_at": None, "finished_at": None, "duration_s": None,
+                "result": None, "error": None,
+            }
+            self._prune()
+            self._save()
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        job = self.jobs[job_id]
+        started = time.monotonic()
+        with self._lock:
+            job.update(status="Running", started_at=_now())
+            self._save()
+
+        def progress(fraction, message=None):
+            with self._lock:
+                job['progress'] = max(0.0, min(1.0, float(fraction)))
+                if message is not None:
+                    job['message'] = message
+                if time.monotonic() - self._last_saved >= PROGRESS_SAVE_INTERVAL_S:
+                    self._save()
+
+        try:
+            result = func(*args, progress=progress, **kwargs)
+            outcome = {"status": "Succeeded", "progress": 1.0, "result": result}
+        except Exception as error:
+            outcome = {"status": "Failed", "error": f"{type(error).__name__}: {error}",
+                       "message": traceback.format_exc(limit=5)}
+        with self._lock:
+            job.update(outcome, finished_at=_now(), duration_s=round(time.monotonic() - started, 3))
+            self._save()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] not in ACTIVE_JOB_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        # Newest first
+        with self._lock:
+            return [dict(job) for job in reversed(list(self.jobs.values()))]
+
+    def active_count(self):
+        return sum(1 for job in list(self.jobs.values()) if job['status'] in ACTIVE_JOB_STATUSES)
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide timing metrics. The app times page handlers, data file reads and
+# writes, password checks and PDF renders into rolling histograms keyed by
+# metric name and labels. The System Metrics page shows percentiles over the
+# rolling window; the Prometheus export uses the lifetime totals, which only
+# ever grow, as Prometheus counters must.
+
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROLLING_WINDOW_S = 15 * 60
+ROLLING_SLOT_S = 60 # Observations expire from the window one slot at a time
+PROMETHEUS_PREFIX = "hr_portal"
+
+class RollingHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_S, window_s=ROLLING_WINDOW_S, slot_s=ROLLING_SLOT_S):
+        self.buckets = buckets
+        self.slot_s = slot_s
+        self.num_slots = max(1, window_s // slot_s)
+        self.slots = deque() # [slot number, bucket counts, count, sum, bytes, max]; oldest first
+        # Lifetime totals for the Prometheus export
+        self.total_counts = [0] * (len(buckets) + 1) # Last bucket is +Inf
+        self.total_count = 0
+        self.total_sum = 0.0
+        self.total_bytes = 0
+
+    def _bucket(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                return i
+        return len(self.buckets)
+
+    def _expire(self, now):
+        oldest_kept = int(now // self.slot_s) - self.num_slots + 1
+        while self.slots and self.slots[0][0] < oldest_kept:
+            self.slots.popleft()
+
+    def observe(self, seconds, nbytes=0, now=None):
+        now = time.time() if now is None else now
+        slot_number = int(now // self.slot_s)
+        if not self.slots or self.slots[-1][0] != slot_number:
+            self.slots.append([slot_number, [0] * (len(self.buckets) + 1), 0, 0.0, 0, 0.0])
+        self._expire(now)
+        bucket = self._bucket(seconds)
+        slot = self.slots[-1]
+        slot[1][bucket] += 1
+        slot[2] += 1
+        slot[3] += seconds
+        slot[4] += nbytes
+        slot[5] = max(slot[5], seconds)
+        self.total_counts[bucket] += 1
+        self.total_count += 1
+        self.total_sum += seconds
+        self.total_bytes += nbytes
+
+    def window(self, now=None):
+        # Totals over the rolling window
+        self._expire(time.time() if now is None else now)
+        counts = [0] * (len(self.buckets) + 1)
+        for slot in self.slots:
+            for i, count in enumerate(slot[1]):
+                counts[i] += count
+        return {
+            "counts": counts,
+            "count": sum(slot[2] for slot in self.slots),
+            "sum": sum(slot[3] for slot in self.slots),
+            "bytes": sum(slot[4] for slot in self.slots),
+            "max": max((slot[5] for slot in self.slots), default=0.0),
+        }
+
+    def quantile(self, q, window):
+        # Estimated by linear interpolation inside the bucket holding the q-th
+        # observation; the open-ended last bucket reports the window maximum
+        if not window['count']:
+            return None
+        rank = q * window['count']
+        seen = 0
+        for i, count in enumerate(window['counts']):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return window['max']
+                lower = self.buckets[i - 1] if i else 0.0
+                estimate = lower + (self.buckets[i] - lower) * (rank - seen) / count
+                return min(estimate, window['max'])
+            seen += count
+        return window['max']
+
+class MetricsRegistry:
+    def __init__(self, window_s=ROLLING_WINDOW_S):
+        self.window_s = window_s
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._histograms = {} # (name, sorted label items) -> RollingHistogram
+        self._last_export = 0.0
+
+    def observe(self, name, seconds, nbytes=0, **labels):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = RollingHistogram(window_s=self.window_s)
+            histogram.observe(seconds, nbytes)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # Times the block; set sample["bytes"] inside it to record bytes moved.
+        # Blocks that raise (including Streamlit's rerun) are still recorded.
+        sample = {"bytes": 0}
+        started = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            self.observe(name, time.perf_counter() - started, sample['bytes'], **labels)
+
+    def summary(self):
+        # One row per metric and label set over the rolling window, busiest first
+        rows = []
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                window = histogram.window()
+                if not window['count']:
+                    continue
+                rows.append({
+                    "metric": name,
+                    "labels": dict(labels),
+                    "count": window['count'],
+                    "mean_s": window['sum'] / window['count'],
+                    "p50_s": histogram.quantile(0.50, window),
+                    "p95_s": histogram.quantile(0.95, window),
+                    "p99_s": histogram.quantile(0.99, window),
+                    "max_s": window['max'],
+                    "total_s": window['sum'],
+                    "bytes": window['bytes'],
+                })
+        rows.sort(key=lambda row: row['total_s'], reverse=True)
+        return rows
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            by_name = {}
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                by_name.setdefault(name, []).append((labels, histogram))
+            for name, series in by_name.items():
+                metric = f"{PROMETHEUS_PREFIX}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in series:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.total_counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_label_text(labels + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{metric}_sum{_label_text(labels)} {histogram.total_sum:.6f}")
+                    lines.append(f"{metric}_count{_label_text(labels)} {histogram.total_count}")
+                if any(histogram.total_bytes for _, histogram in series):
+                    metric = f"{PROMETHEUS_PREFIX}_{name}_bytes_total"
+                    lines.append(f"# TYPE {metric} counter")
+                    for labels, histogram in series:
+                        lines.append(f"{metric}{_label_text(labels)} {histogram.total_bytes}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_process_start_time_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_process_start_time_seconds {self.started_at:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def export_to_file(self, filename, min_interval_s=0):
+        # Writes the Prometheus text atomically (e.g. for node_exporter's textfile
+        # collector); skipped if the last export was under min_interval_s ago
+        now = time.monotonic()
+        if self._last_export and now - self._last_export < min_interval_s:
+            return False
+        self._last_export = now
+        temp_path = f"{filename}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_path, filename)
+        return True
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escape = lambda value: value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{label}="{escape(value)}"' for label, value in labels) + "}"
+
+def start_metrics_server(registry, port, host="127.0.0.1"):
+    # Serves GET /metrics in Prometheus text format from a daemon thread
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Scrapes would otherwise flood the server log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="hr-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,68 @@
+from datetime import date
+
+from fpdf import FPDF
+
+# Payslip PDF rendering, shared by the My Payslips page and offline tooling.
+# Works with both PyFPDF 1.7 and fpdf2.
+
+# The built-in PDF fonts only cover Latin-1, which has no Naira sign
+CURRENCY_PREFIX = "NGN "
+
+def _money(value):
+    try:
+        return f"{CURRENCY_PREFIX}{float(value):,.2f}"
+    except (TypeError, ValueError):
+        return f"{CURRENCY_PREFIX}0.00"
+
+def generate_payslip_pdf(payslip_record, user_profile, staff_id=None):
+    # Returns the payslip as PDF bytes
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    # Header
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(0, 10, "Polaris Digitech - Payslip", 0, 1, 'C')
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, f"For: {payslip_record.get('month', 'N/A')}/{payslip_record.get('year', 'N/A')}", 0, 1, 'C')
+    pdf.ln(10)
+
+    # Employee Details
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Employee Details:", 0, 1, 'L')
+    pdf.set_font("Arial", '', 10)
+    pdf.cell(0, 7, f"Name: {user_profile.get('name', 'N/A')}", 0, 1)
+    pdf.cell(0, 7, f"Staff ID: {staff_id or user_profile.get('staff_id') or payslip_record.get('staff_id', 'N/A')}", 0, 1)
+    pdf.cell(0, 7, f"Department: {user_profile.get('department', 'N/A')}", 0, 1)
+    pdf.cell(0, 7, f"Grade Level: {user_profile.get('grade_level', 'N/A')}", 0, 1)
+    pdf.ln(5)
+
+    # Earnings
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Earnings:", 0, 1, 'L')
+    pdf.set_font("Arial", '', 10)
+    pdf.cell(80, 7, "Basic Salary:", 0, 0, 'L')
+    pdf.cell(0, 7, _money(payslip_record.get('basic_salary', 0)), 0, 1, 'R')
+    pdf.cell(80, 7, "Allowances:", 0, 0, 'L')
+    pdf.cell(0, 7, _money(payslip_record.get('allowances', 0)), 0, 1, 'R')
+    pdf.ln(5)
+
+    # Deductions
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Deductions:", 0, 1, 'L')
+    pdf.set_font("Arial", '', 10)
+    pdf.cell(80, 7, "Total Deductions:", 0, 0, 'L')
+    pdf.cell(0, 7, _money(payslip_record.get('deductions', 0)), 0, 1, 'R')
+    pdf.ln(5)
+
+    # Net Pay
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(80, 10, "Net Pay:", 0, 0, 'L')
+    pdf.cell(0, 10, _money(payslip_record.get('net_pay', 0)), 0, 1, 'R')
+    pdf.ln(10)
+
+    pdf.set_font("Arial", 'I', 8)
+    pdf.cell(0, 5, f"Generated on: {payslip_record.get('generated_date') or date.today().isoformat()}", 0, 1, 'C')
+
+    output = pdf.output(dest='S')
+    return output.encode('latin-1') if isinstance(output, str) else bytes(output) # PyFPDF 1.7 returns str
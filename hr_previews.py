@@ -0,0 +1,116 @@
+import glob
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import pymupdf as fitz # PyMuPDF (requirements.txt); without it PDFs get no preview
+except ImportError:
+    try:
+        import fitz # PyMuPDF before 1.24
+    except ImportError:
+        fitz = None
+
+# Small PNG previews of uploaded documents (downscaled images, first page of
+# PDFs), generated on a background thread and cached next to their blob so
+# review pages can show a thumbnail without reading the original file.
+# The cache is bounded by total size; the least recently shown previews are
+# evicted first.
+
+PREVIEW_MAX_SIZE = (320, 320) # Pixels; aspect ratio is kept
+PREVIEW_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+class PreviewCache:
+    def __init__(self, blob_store, max_bytes=PREVIEW_CACHE_MAX_BYTES, max_workers=1):
+        self.blob_store = blob_store
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview")
+        self._pending = set()
+        self._unsupported = set() # Digests no preview can be made for
+        # preview path -> size, least recently used first; seeded from disk by modification time
+        existing = glob.glob(os.path.join(blob_store.blob_dir, "*", "*.preview.png"))
+        self._entries = OrderedDict(
+            (path, os.path.getsize(path)) for path in sorted(existing, key=os.path.getmtime)
+        )
+        self._total_bytes = sum(self._entries.values())
+
+    def get(self, digest):
+        # Path of the cached preview, or None if there is none (yet). A missing
+        # preview is queued for generation, so a later rerun will find it.
+        if not digest or digest in self._unsupported:
+            return None
+        preview_path = self.blob_store.preview_path(digest)
+        with self._lock:
+            if preview_path in self._entries and os.path.exists(preview_path):
+                self._entries.move_to_end(preview_path)
+                return preview_path
+            self._total_bytes -= self._entries.pop(preview_path, 0) # Removed along with its blob
+        self.request(digest)
+        return None
+
+    def is_pending(self, digest):
+        return digest in self._pending
+
+    def request(self, digest):
+        # Queues background generation of a preview for a stored blob
+        metadata = self.blob_store.metadata(digest)
+        if metadata is None:
+            return # Not (or no longer) in the store
+        if not _can_preview(metadata.get('content_type', '')):
+            self._unsupported.add(digest)
+            return
+        with self._lock:
+            if digest in self._pending:
+                return
+            self._pending.add(digest)
+        self._executor.submit(self._generate, digest, metadata['content_type'])
+
+    def _generate(self, digest, content_type):
+        preview_path = self.blob_store.preview_path(digest)
+        temp_path = preview_path + ".tmp"
+        try:
+            image = _render_first_page(self.blob_store.path(digest), content_type)
+            image.thumbnail(PREVIEW_MAX_SIZE)
+            if image.mode not in ("RGB", "RGBA", "L"):
+                image = image.convert("RGBA")
+            image.save(temp_path, format="PNG", optimize=True)
+            os.replace(temp_path, preview_path)
+            with self._lock:
+                self._total_bytes -= self._entries.pop(preview_path, 0)
+                self._entries[preview_path] = os.path.getsize(preview_path)
+                self._total_bytes += self._entries[preview_path]
+                self._evict()
+        except Exception:
+            self._unsupported.add(digest) # Corrupt or unreadable file: don't keep retrying
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            if os.path.exists(path):
+                os.remove(path)
+
+def pdf_previews_available():
+    return fitz is not None
+
+def _can_preview(content_type):
+    return content_type.startswith("image/") or (content_type == "application/pdf" and fitz is not None)
+
+def _render_first_page(path, content_type):
+    if content_type == "application/pdf":
+        with fitz.open(path) as document:
+            pixmap = document[0].get_pixmap(dpi=72)
+            return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    with Image.open(path) as image:
+        image.draft("RGB", PREVIEW_MAX_SIZE) # Lets JPEG decode at reduced size
+        image.load()
+        return image.copy()
@@ -0,0 +1,142 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+from datetime import datetime
+
+from hr_store import PROFILES_DIR, PROFILING_SETTINGS_FILE, file_signature, load_json, write_json_atomic
+
+# Opt-in profiler for slow reruns. While enabled, every rerun of the app runs
+# under cProfile (which only sees the session's own script thread); reruns
+# slower than the threshold keep their trace, tagged with the page and the
+# user's role, and faster ones are thrown away. Traces are standard .prof
+# files (open with snakeviz or `python -m pstats`), each with a JSON sidecar,
+# and only the newest `max_traces` are kept.
+#
+# Profiling slows every rerun down while it is on, so it is meant to be
+# switched on from the admin panel while chasing a problem, then off again.
+
+DEFAULT_PROFILING_SETTINGS = {"enabled": False, "threshold_s": 2.0, "max_traces": 50}
+TRACE_NAME_PATTERN = re.compile(r"^[\w.-]+\.prof$")
+
+class ProfiledRerun:
+    def __init__(self, profiler, page, role):
+        self.profiler = profiler
+        self.page = page
+        self.role = role
+        self.started = time.perf_counter()
+
+class SlowRerunProfiler:
+    def __init__(self, trace_dir=PROFILES_DIR, settings_file=PROFILING_SETTINGS_FILE):
+        self.trace_dir = trace_dir
+        self.settings_file = settings_file
+        self._lock = threading.Lock()
+        self._settings_signature = None
+        self.settings = dict(DEFAULT_PROFILING_SETTINGS)
+        self.refresh()
+
+    def refresh(self):
+        # Picks up settings saved by another worker process; one stat when unchanged
+        signature = file_signature(self.settings_file)
+        if signature != self._settings_signature:
+            self.settings = {**DEFAULT_PROFILING_SETTINGS, **load_json(self.settings_file, {})}
+            self._settings_signature = signature
+
+    def update_settings(self, enabled, threshold_s, max_traces):
+        with self._lock:
+            self.settings = {"enabled": bool(enabled), "threshold_s": float(threshold_s), "max_traces": int(max_traces)}
+            write_json_atomic(self.settings, self.settings_file)
+            self._settings_signature = file_signature(self.settings_file)
+            self._rotate()
+
+    # --- Capturing ---
+    def start(self, page, role):
+        # Returns a handle for finish(), or None when profiling is off
+        self.refresh()
+        if not self.settings['enabled']:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # Another profiler is active (Python 3.12+ allows one per process)
+            return None
+        return ProfiledRerun(profiler, page, role)
+
+    def finish(self, rerun):
+        # Stops profiling; keeps the trace if the rerun was slower than the threshold
+        if rerun is None:
+            return None
+        rerun.profiler.disable()
+        duration_s = time.perf_counter() - rerun.started
+        if duration_s < self.settings['threshold_s']:
+            return None
+
+        captured_at = datetime.now()
+        stem = f"{captured_at:%Y%m%d-%H%M%S-%f}_{_slug(rerun.page)}_{_slug(rerun.role)}"
+        with self._lock:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            rerun.profiler.dump_stats(os.path.join(self.trace_dir, f"{stem}.prof"))
+            metadata = {
+                "trace": f"{stem}.prof", "page": rerun.page, "role": rerun.role,
+                "duration_s": round(duration_s, 3), "captured_at": captured_at.isoformat(timespec="seconds"),
+            }
+            write_json_atomic(metadata, os.path.join(self.trace_dir, f"{stem}.json"))
+            self._rotate()
+        return metadata
+
+    def _rotate(self):
+        traces = sorted(name for name in os.listdir(self.trace_dir) if name.endswith(".prof")) if os.path.isdir(self.trace_dir) else []
+        for name in traces[:max(0, len(traces) - self.settings['max_traces'])]: # Names sort oldest first
+            self._remove_trace(name)
+
+    def _remove_trace(self, name):
+        path = self.trace_path(name)
+        for trace_file in (path, path[:-len(".prof")] + ".json"):
+            try:
+                os.remove(trace_file)
+            except FileNotFoundError:
+                pass
+
+    # --- Browsing ---
+    def list_traces(self):
+        # Sidecar metadata of the kept traces, newest first, with file sizes
+        if not os.path.isdir(self.trace_dir):
+            return []
+        traces = []
+        for name in sorted(os.listdir(self.trace_dir), reverse=True):
+            if not name.endswith(".prof"):
+                continue
+            metadata = load_json(os.path.join(self.trace_dir, name[:-len(".prof")] + ".json"), {})
+            try:
+                size = os.path.getsize(os.path.join(self.trace_dir, name))
+            except FileNotFoundError:
+                continue # Rotated away meanwhile
+            traces.append({"trace": name, "page": None, "role": None, "duration_s": None, "captured_at": None, **metadata, "size": size})
+        return traces
+
+    def trace_path(self, name):
+        if not TRACE_NAME_PATTERN.match(name or ""):
+            raise ValueError(f"Invalid trace name: {name!r}")
+        return os.path.join(self.trace_dir, name)
+
+    def read_trace(self, name):
+        with open(self.trace_path(name), "rb") as file:
+            return file.read()
+
+    def trace_summary(self, name, sort_by="cumulative", limit=30):
+        # pstats text report of the top `limit` functions
+        stream = io.StringIO()
+        stats = pstats.Stats(self.trace_path(name), stream=stream)
+        stats.strip_dirs().sort_stats(sort_by).print_stats(limit)
+        return stream.getvalue()
+
+    def clear(self):
+        with self._lock:
+            for trace in self.list_traces():
+                self._remove_trace(trace['trace'])
+
+def _slug(value):
+    return re.sub(r"[^\w-]+", "-", str(value or "none")).strip("-") or "none"
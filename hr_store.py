@@ -0,0 +1,1020 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+from passlib.hash import pbkdf2_sha256
+
+# Storage layer shared by the Streamlit app and any offline tooling.
+# Nothing in here may import streamlit, so it can be used from scripts too.
+
+# --- Configuration & Paths ---
+DATA_DIR = "hr_data"
+USERS_FILE = os.path.join(DATA_DIR, "users.json")
+LEAVE_REQUESTS_FILE = os.path.join(DATA_DIR, "leave_requests.json")
+OPEX_CAPEX_REQUESTS_FILE = os.path.join(DATA_DIR, "opex_capex_requests.json")
+PERFORMANCE_GOALS_FILE = os.path.join(DATA_DIR, "performance_goals.json")
+SELF_APPRAISALS_FILE = os.path.join(DATA_DIR, "self_appraisals.json")
+PAYROLL_FILE = os.path.join(DATA_DIR, "payroll.json")
+BENEFICIARIES_FILE = os.path.join(DATA_DIR, "beneficiaries.json")
+HR_POLICIES_FILE = os.path.join(DATA_DIR, "hr_policies.json")
+STAFF_ARCHIVE_FILE = os.path.join(DATA_DIR, "staff_archive.json") # Offboarded staff and their records
+TRAINING_FILE = os.path.join(DATA_DIR, "training.json") # Append-only log, one JSON object per line
+PUBLIC_HOLIDAYS_FILE = os.path.join(DATA_DIR, "public_holidays.json") # ISO dates excluded from leave day counts
+DOCUMENTS_FILE = os.path.join(DATA_DIR, "documents.json") # Metadata index of the document blob store
+BLOB_DIR = os.path.join(DATA_DIR, "blobs") # Uploaded documents, stored by SHA-256 of their content
+
+DEFAULT_STAFF_PASSWORD = "123456" # Generic first-login password for new staff
+
+TRANSACTION_JOURNAL_FILE = os.path.join(DATA_DIR, ".transaction_journal.json")
+OFFBOARDING_CLEANUP_FILE = os.path.join(DATA_DIR, ".offboarding_cleanup.json") # Staff IDs still to purge from archive/training
+JOBS_FILE = os.path.join(DATA_DIR, "jobs.json") # Background job table (see hr_jobs)
+PROFILING_SETTINGS_FILE = os.path.join(DATA_DIR, "profiling.json") # Slow-rerun profiler switch (see hr_profiling)
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles") # cProfile traces of slow reruns
+RECORD_ARCHIVE_DIR = os.path.join(DATA_DIR, "archive") # Closed records moved out of the hot files (see RecordArchive)
+
+# Files holding rows that belong to a staff member, and the field carrying the staff ID
+STAFF_LINKED_TABLES = {
+    LEAVE_REQUESTS_FILE: "staff_id",
+    OPEX_CAPEX_REQUESTS_FILE: "requester_staff_id",
+    PERFORMANCE_GOALS_FILE: "staff_id",
+    SELF_APPRAISALS_FILE: "staff_id",
+    PAYROLL_FILE: "staff_id",
+}
+
+# --- JSON Encoding ---
+class DateEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, (date, datetime)):
+            return obj.isoformat()
+        return super().default(obj)
+
+def load_json(filename, default_value=None):
+    if default_value is None:
+        default_value = []
+    try:
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, "r") as file:
+                return json.load(file)
+        return default_value
+    except (json.JSONDecodeError, FileNotFoundError):
+        return default_value
+
+def file_signature(filename):
+    # Cheap change detector for cache keys: (mtime_ns, size), or None if the file is missing
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _write_temp_json(data, filename):
+    # Temp file lives next to the target so os.replace() stays on one filesystem
+    directory = os.path.dirname(filename) or "."
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{filename}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file, indent=4, cls=DateEncoder)
+        file.flush()
+        os.fsync(file.fileno())
+    return temp_path
+
+def write_json_atomic(data, filename):
+    # Readers see either the old or the new file, never a half-written one
+    temp_path = _write_temp_json(data, filename)
+    os.replace(temp_path, filename)
+
+# --- Multi-file Transactions ---
+# A commit writes every staged file to a temp file, then records the
+# temp->target pairs in a journal. Writing the journal is the commit point:
+# if the process dies after it, recover_pending_transaction() finishes the
+# renames on next start; if it dies before it, the temp files are discarded.
+class Transaction:
+    def __init__(self, journal_file=TRANSACTION_JOURNAL_FILE):
+        self.journal_file = journal_file
+        self._staged = {}
+
+    def stage(self, filename, data):
+        self._staged[filename] = data
+
+    def commit(self):
+        if not self._staged:
+            return
+        renames = []
+        try:
+            for filename, data in self._staged.items():
+                renames.append([_write_temp_json(data, filename), filename])
+        except Exception:
+            for temp_path, _ in renames:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            raise
+        write_json_atomic(renames, self.journal_file)
+        _apply_renames(renames)
+        os.remove(self.journal_file)
+        self._staged = {}
+
+def _apply_renames(renames):
+    for temp_path, filename in renames:
+        if os.path.exists(temp_path):
+            os.replace(temp_path, filename)
+
+def recover_pending_transaction(journal_file=TRANSACTION_JOURNAL_FILE):
+    # Roll forward a transaction that was committed but not fully applied
+    if not os.path.exists(journal_file):
+        return False
+    renames = load_json(journal_file, [])
+    _apply_renames(renames)
+    os.remove(journal_file)
+    return True
+
+# --- Indexes ---
+def get_staff_id(user):
+    # Older user records only carry the staff ID at the top level
+    return user.get('profile', {}).get('staff_id') or user.get('staff_id')
+
+def build_index(records, key):
+    # Maps key value -> list of positions in records. `key` is a field name or a callable.
+    key_func = key if callable(key) else (lambda record: record.get(key))
+    index = {}
+    for position, record in enumerate(records):
+        index.setdefault(key_func(record), []).append(position)
+    return index
+
+# --- Idempotent Submissions ---
+SUBMISSION_TOKEN_TTL_S = 15 * 60 # A repeat after this long counts as a new submission
+
+def submission_key(*parts):
+    # Idempotency key for a submission: a hash of whatever identifies it
+    return hashlib.sha256(json.dumps(parts, cls=DateEncoder, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class SubmissionTokenIndex:
+    # Short-lived set of claimed idempotency keys. The first claim of a key wins;
+    # repeats within ttl_s are refused, so a double-submitted form writes once.
+    def __init__(self, ttl_s=SUBMISSION_TOKEN_TTL_S):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._claimed = {} # key -> claim time (monotonic); oldest first
+
+    def _expire(self, now):
+        while self._claimed:
+            key, claimed_at = next(iter(self._claimed.items()))
+            if now - claimed_at < self.ttl_s:
+                break
+            del self._claimed[key]
+
+    def claim(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            if key in self._claimed:
+                return False
+            self._claimed[key] = now
+            return True
+
+    def release(self, key):
+        # Makes the key claimable again, e.g. when the submission failed validation
+        with self._lock:
+            self._claimed.pop(key, None)
+
+# --- OPEX/CAPEX Approvals ---
+REQUISITION_APPROVAL_STEPS = ("status_admin_manager", "status_hr_manager", "status_finance_manager", "status_md")
+REQUISITION_STEP_STATUSES = ("Pending", "Approve", "Reject")
+
+def requisition_final_status(requisition):
+    # Approved once every step approves, rejected as soon as any step rejects
+    statuses = [requisition.get(step) for step in REQUISITION_APPROVAL_STEPS]
+    if all(status == 'Approve' for status in statuses):
+        return 'Approved'
+    if any(status == 'Reject' for status in statuses):
+        return 'Rejected'
+    return 'Pending'
+
+# --- Staff Offboarding ---
+def offboard_staff(users, linked_tables, usernames, archive=False,
+                   users_file=USERS_FILE, archive_file=STAFF_ARCHIVE_FILE,
+                   journal_file=TRANSACTION_JOURNAL_FILE, record_archive=None, training_store=None,
+                   cleanup_file=OFFBOARDING_CLEANUP_FILE):
+    # Removes the given users and every row linked to their staff IDs in one
+    # transaction. `linked_tables` maps a STAFF_LINKED_TABLES filename to its
+    # current rows. With archive=True the removed user and rows are kept in
+    # the staff archive file instead of being discarded. Their closed records
+    # in `record_archive` (a RecordArchive) and training records in
+    # `training_store` are removed too, by finish_offboarding() once the
+    # transaction has committed.
+    # Returns (remaining_users, {filename: remaining_rows}).
+    usernames = set(usernames)
+    user_index = build_index(users, 'username')
+    leavers = [users[pos] for name in usernames for pos in user_index.get(name, [])]
+    leaver_by_staff_id = {}
+    for user in leavers:
+        staff_id = get_staff_id(user)
+        if staff_id and staff_id != "N/A":
+            leaver_by_staff_id[staff_id] = user['username']
+
+    archived_on = str(date.today())
+    archive_entries = {user['username']: {"archived_on": archived_on, "user": user, "records": {}} for user in leavers}
+
+    txn = Transaction(journal_file)
+    remaining_users = [user for user in users if user.get('username') not in usernames]
+    txn.stage(users_file, remaining_users)
+
+    remaining_tables = {}
+    for filename, records in linked_tables.items():
+        index = build_index(records, STAFF_LINKED_TABLES[filename])
+        positions_to_drop = set()
+        for staff_id, username in leaver_by_staff_id.items():
+            positions = index.get(staff_id, [])
+            if not positions:
+                continue
+            positions_to_drop.update(positions)
+            if archive:
+                table_name = os.path.splitext(os.path.basename(filename))[0]
+                archive_entries[username]["records"][table_name] = [records[pos] for pos in positions]
+        if positions_to_drop:
+            remaining_tables[filename] = [record for pos, record in enumerate(records) if pos not in positions_to_drop]
+            txn.stage(filename, remaining_tables[filename])
+        else:
+            remaining_tables[filename] = records
+
+    if archive and record_archive is not None:
+        for table, spec in RECORD_ARCHIVE_TABLES.items():
+            staff_field = STAFF_LINKED_TABLES[spec['file']]
+            table_name = os.path.splitext(os.path.basename(spec['file']))[0]
+            for _, row in record_archive.scan(table):
+                username = leaver_by_staff_id.get(row.get(staff_field))
+                if username:
+                    archive_entries[username]["records"].setdefault(table_name, []).append(row)
+
+    if archive and training_store is not None:
+        for staff_id, username in leaver_by_staff_id.items():
+            trainings = training_store.for_staff(staff_id)
+            if trainings:
+                archive_entries[username]["records"]["training"] = trainings
+
+    if archive and archive_entries:
+        staff_archive = load_json(archive_file, {})
+        staff_archive.update(archive_entries)
+        txn.stage(archive_file, staff_archive)
+
+    # The record archive and training log can't be staged, so the leavers'
+    # staff IDs are committed with the rest and purged from them afterwards
+    if leaver_by_staff_id and (record_archive is not None or training_store is not None):
+        txn.stage(cleanup_file, sorted(set(load_json(cleanup_file, [])) | set(leaver_by_staff_id)))
+
+    txn.commit()
+    finish_offboarding(record_archive, training_store, cleanup_file)
+    return remaining_users, remaining_tables
+
+def finish_offboarding(record_archive=None, training_store=None, cleanup_file=OFFBOARDING_CLEANUP_FILE):
+    # Removes the archived records and training records of the staff IDs left in
+    # `cleanup_file` by offboard_staff(). Records already removed are skipped, so
+    # it is run again at startup in case the process died before it finished.
+    # Returns True if there was anything to clean up.
+    staff_ids = set(load_json(cleanup_file, []))
+    if not staff_ids:
+        return False
+    if record_archive is not None:
+        for table, spec in RECORD_ARCHIVE_TABLES.items():
+            staff_field = STAFF_LINKED_TABLES[spec['file']]
+            for period in record_archive.periods(table):
+                rows = [row for row in record_archive.read(table, period) if row.get(staff_field) in staff_ids]
+                if rows:
+                    record_archive.remove(table, period, rows)
+    if training_store is not None:
+        training_store.delete_for_staff(staff_ids)
+    os.remove(cleanup_file)
+    return True
+
+def offboard_staff_files(usernames, archive=False, blob_store=None, users_file=USERS_FILE, record_archive=None,
+                         training_store=None, progress=None):
+    # offboard_staff() on the current contents of the data files, for callers
+    # that don't hold the data in memory (background jobs, scripts). Documents of
+    # deleted leave requests are released from `blob_store`; archived ones keep them.
+    users = load_json(users_file, [])
+    linked_tables = {filename: load_json(filename, []) for filename in STAFF_LINKED_TABLES}
+    training_store = training_store if training_store is not None else TrainingStore()
+    training_store.refresh()
+    remaining_users, remaining_tables = offboard_staff(users, linked_tables, usernames, archive=archive, users_file=users_file,
+                                                       record_archive=record_archive, training_store=training_store)
+    if progress:
+        progress(0.9, "Records removed")
+    if blob_store is not None and not archive:
+        kept = {id(row) for row in remaining_tables[LEAVE_REQUESTS_FILE]}
+        for row in linked_tables[LEAVE_REQUESTS_FILE]:
+            if id(row) not in kept and row.get('document_sha256'):
+                blob_store.release(document_ref("leave", row.get('request_id')))
+    return {"staff_removed": len(users) - len(remaining_users), "archived": archive}
+
+# --- Staff Onboarding ---
+def new_staff_record(name, username, staff_id, password_hash, department="Unassigned", grade_level="",
+                     gender="", date_of_birth="", work_anniversary=None, email_address=None):
+    return {
+        "username": username,
+        "password": password_hash,
+        "role": "staff", # Default role
+        "staff_id": staff_id, # Store here for easy lookup
+        "profile": {
+            "name": name,
+            "staff_id": staff_id, # Redundant but good for quick profile access
+            "date_of_birth": date_of_birth, # To be completed by staff
+            "gender": gender, # To be completed by staff
+            "grade_level": grade_level, # To be completed by staff
+            "department": department or "Unassigned", # Default, can be updated by staff/admin
+            "education_background": "",
+            "professional_experience": "",
+            "address": "",
+            "phone_number": "",
+            "email_address": email_address or username,
+            "work_anniversary": work_anniversary or str(date.today()) # Default to today
+        }
+    }
+
+def _hash_password(password):
+    return pbkdf2_sha256.hash(password)
+
+def hash_passwords(passwords, max_workers=None):
+    # pbkdf2 is CPU-bound on purpose, so large batches are spread over processes
+    passwords = list(passwords)
+    if len(passwords) < 8:
+        return [_hash_password(password) for password in passwords]
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_hash_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+BULK_IMPORT_REQUIRED_COLUMNS = ['name', 'username', 'staff_id']
+BULK_IMPORT_OPTIONAL_COLUMNS = ['department', 'grade_level', 'gender', 'date_of_birth', 'work_anniversary', 'email_address']
+
+def import_staff_rows(users, rows, password=DEFAULT_STAFF_PASSWORD, users_file=USERS_FILE, max_workers=None):
+    # Validates each row against username/staff ID sets, hashes the accepted
+    # rows' passwords in parallel and appends them with a single write.
+    # Returns (all_users, report) where report has one entry per input row.
+    existing_usernames = {user.get('username') for user in users}
+    existing_staff_ids = {get_staff_id(user) for user in users}
+
+    report = []
+    accepted = []
+    for row_number, row in enumerate(rows, start=1):
+        values = {col: str(row.get(col) or '').strip() for col in BULK_IMPORT_REQUIRED_COLUMNS + BULK_IMPORT_OPTIONAL_COLUMNS}
+        missing = [col for col in BULK_IMPORT_REQUIRED_COLUMNS if not values[col]]
+        if missing:
+            status, message = "Skipped", f"Missing {', '.join(missing)}"
+        elif values['username'] in existing_usernames:
+            status, message = "Skipped", "Username already exists"
+        elif values['staff_id'] in existing_staff_ids:
+            status, message = "Skipped", "Staff ID already exists"
+        else:
+            # Reserve immediately so duplicates later in the same file are caught
+            existing_usernames.add(values['username'])
+            existing_staff_ids.add(values['staff_id'])
+            accepted.append(values)
+            status, message = "Added", ""
+        report.append({"row": row_number, "name": values['name'], "username": values['username'],
+                       "staff_id": values['staff_id'], "status": status, "message": message})
+
+    if not accepted:
+        return users, report
+
+    password_hashes = hash_passwords([password] * len(accepted), max_workers=max_workers)
+    new_users = [
+        new_staff_record(password_hash=password_hash, **{col: values[col] for col in values if values[col]})
+        for values, password_hash in zip(accepted, password_hashes)
+    ]
+    all_users = users + new_users
+    write_json_atomic(all_users, users_file)
+    return all_users, report
+
+# --- Payroll Import ---
+PAYROLL_REQUIRED_COLUMNS = ['staff_id', 'month', 'year', 'basic_salary', 'allowances', 'deductions', 'net_pay']
+
+def import_payroll_rows(payroll_data, rows, users, progress=None, record_archive=None):
+    # Adds payslips from CSV rows, replacing any existing payslip for the same
+    # (staff_id, month, year). Returns (all_payslips, report) where report has
+    # one entry per input row. `progress(fraction, message)` is optional. New
+    # payslip IDs come from `record_archive` (a RecordArchive), so they never
+    # reuse the ID of an archived payslip.
+    known_staff_ids = {get_staff_id(user) for user in users}
+    original_payroll = payroll_data
+    payroll_data = list(payroll_data)
+    position_by_key = {(rec.get('staff_id'), rec.get('month'), rec.get('year')): pos for pos, rec in enumerate(payroll_data)}
+    added = []
+
+    report = []
+    for row_number, row in enumerate(rows, start=1):
+        if progress and row_number % 500 == 0:
+            progress(row_number / len(rows), f"{row_number} of {len(rows)} rows")
+        staff_id = str(row.get('staff_id', '')).strip()
+        entry = {"row": row_number, "staff_id": staff_id, "month": row.get('month'), "year": row.get('year'), "status": "Skipped", "message": ""}
+        report.append(entry)
+        try:
+            payslip = {
+                "staff_id": staff_id,
+                "month": int(row['month']),
+                "year": int(row['year']),
+                "basic_salary": float(row['basic_salary']),
+                "allowances": float(row['allowances']),
+                "deductions": float(row['deductions']),
+                "net_pay": float(row['net_pay']),
+                "generated_date": str(date.today()),
+            }
+        except KeyError as error:
+            entry["message"] = f"Missing column {error}"
+            continue
+        except (TypeError, ValueError) as error:
+            entry["message"] = f"Data conversion error: {error}"
+            continue
+        if staff_id not in known_staff_ids:
+            entry["message"] = "Unknown Staff ID"
+            continue
+
+        key = (staff_id, payslip['month'], payslip['year'])
+        if key in position_by_key:
+            position = position_by_key[key]
+            payslip = {"payslip_id": payroll_data[position].get('payslip_id'), **payslip}
+            payroll_data[position] = payslip
+            entry["status"] = "Updated"
+        else:
+            payslip = {"payslip_id": None, **payslip} # Numbered below, once the count is known
+            added.append(payslip)
+            position_by_key[key] = len(payroll_data)
+            payroll_data.append(payslip)
+            entry["status"] = "Added"
+    if added:
+        first_id = (record_archive or RecordArchive()).allocate_ids("payroll", original_payroll, count=len(added))
+        for payslip_id, payslip in enumerate(added, start=first_id):
+            payslip['payslip_id'] = payslip_id
+    return payroll_data, report
+
+def import_payroll_file(rows, payroll_file=PAYROLL_FILE, users_file=USERS_FILE, progress=None, record_archive=None):
+    # import_payroll_rows() against the payroll file on disk, saved with one write.
+    # Returns a summary: counts per status and the rows that were skipped.
+    payroll_data, report = import_payroll_rows(load_json(payroll_file, []), rows, load_json(users_file, []), progress=progress,
+                                               record_archive=record_archive)
+    write_json_atomic(payroll_data, payroll_file)
+    counts = Counter(entry['status'] for entry in report)
+    return {
+        "added": counts["Added"], "updated": counts["Updated"], "skipped": counts["Skipped"],
+        "skipped_rows": [entry for entry in report if entry['status'] == "Skipped"],
+    }
+
+# --- Training Records ---
+# Training records live in their own append-only log instead of inside each
+# user's profile, so adding or deleting one writes a single line rather than
+# the whole users file. Each line is {"op": "add", "record": {...}} or
+# {"op": "delete", "training_id": ...}; compact() rewrites only live records.
+class TrainingStore:
+    def __init__(self, filename=TRAINING_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        self.records = {} # training_id -> record
+        self.by_staff_id = {} # staff_id -> [training_id] in insertion order
+        self._needs_newline = False
+        if os.path.exists(self.filename):
+            with open(self.filename, "r") as file:
+                content = file.read()
+            for line in content.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self._apply(json.loads(line))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue # Torn or malformed line, e.g. from a crash mid-append
+            self._needs_newline = bool(content) and not content.endswith("\n")
+        self._signature = file_signature(self.filename)
+
+    def refresh(self):
+        # Picks up writes made by another process since the last load
+        if file_signature(self.filename) != self._signature:
+            with self._lock:
+                self._load()
+
+    def _apply(self, entry):
+        if entry['op'] == 'add':
+            record = entry['record']
+            if record['training_id'] not in self.records:
+                self.records[record['training_id']] = record
+                self.by_staff_id.setdefault(record['staff_id'], []).append(record['training_id'])
+        elif entry['op'] == 'delete':
+            record = self.records.pop(entry['training_id'], None)
+            if record:
+                self.by_staff_id[record['staff_id']].remove(entry['training_id'])
+
+    def _append(self, *entries):
+        # All entries go out in one write and one fsync
+        with self._lock:
+            os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+            with open(self.filename, "a") as file:
+                if self._needs_newline:
+                    file.write("\n")
+                file.write("".join(json.dumps(entry, cls=DateEncoder) + "\n" for entry in entries))
+                file.flush()
+                os.fsync(file.fileno())
+            self._needs_newline = False
+            for entry in entries:
+                self._apply(entry)
+            self._signature = file_signature(self.filename)
+
+    def add(self, staff_id, name, training_date, training_id=None):
+        training_id = training_id or uuid.uuid4().hex
+        if training_id in self.records:
+            return self.records[training_id]
+        record = {"training_id": training_id, "staff_id": staff_id, "name": name, "date": str(training_date)}
+        self._append({"op": "add", "record": record})
+        return record
+
+    def delete(self, training_id):
+        if training_id in self.records:
+            self._append({"op": "delete", "training_id": training_id})
+
+    def delete_for_staff(self, staff_ids):
+        # Drops every record of the given staff IDs; returns the removed records
+        removed = [record for staff_id in set(staff_ids) for record in self.for_staff(staff_id)]
+        if removed:
+            self._append(*({"op": "delete", "training_id": record['training_id']} for record in removed))
+        return removed
+
+    def for_staff(self, staff_id):
+        return [self.records[training_id] for training_id in self.by_staff_id.get(staff_id, [])]
+
+    def compact(self):
+        with self._lock:
+            temp_path = f"{self.filename}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "w") as file:
+                for record in self.records.values():
+                    file.write(json.dumps({"op": "add", "record": record}, cls=DateEncoder) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.filename)
+            self._needs_newline = False
+            self._signature = file_signature(self.filename)
+
+def migrate_training_records(users, training_store):
+    # Moves legacy profile['training_attended'] lists into the training store.
+    # Returns True when users were changed and need saving. Migrated records get
+    # deterministic IDs, so re-running after a crash does not duplicate them.
+    changed = False
+    for user in users:
+        legacy_trainings = user.get('profile', {}).pop('training_attended', None)
+        if legacy_trainings is None:
+            continue
+        changed = True
+        staff_id = get_staff_id(user)
+        for position, training in enumerate(legacy_trainings):
+            legacy_key = f"{staff_id}|{position}|{training.get('name')}|{training.get('date')}"
+            training_id = "legacy-" + hashlib.sha1(legacy_key.encode("utf-8")).hexdigest()[:16]
+            training_store.add(staff_id, training.get('name', 'N/A'), training.get('date', ''), training_id=training_id)
+    return changed
+
+def training_attendance_report(training_store, users):
+    # Returns (attendance by course, attendance by department) as lists of dicts,
+    # most attended first. Departments come from the staff member's current profile.
+    department_by_staff_id = {get_staff_id(user): user.get('profile', {}).get('department') or 'Unassigned' for user in users}
+    course_counts = Counter()
+    course_staff = {}
+    department_counts = Counter()
+    for record in training_store.records.values():
+        course_counts[record['name']] += 1
+        course_staff.setdefault(record['name'], set()).add(record['staff_id'])
+        department_counts[department_by_staff_id.get(record['staff_id'], 'Former Staff')] += 1
+    by_course = [{"Course": course, "Attendances": count, "Staff Trained": len(course_staff[course])} for course, count in course_counts.most_common()]
+    by_department = [{"Department": department, "Attendances": count} for department, count in department_counts.most_common()]
+    return by_course, by_department
+
+# --- Document Blob Store ---
+# Uploaded documents are stored once per distinct content under
+# blobs/<first two hex digits>/<sha256>, so identical uploads share one file
+# and two different files can never overwrite each other. documents.json holds
+# per-blob metadata (size, content type, names it was uploaded under, reference
+# count) and the refs linking records such as "leave:12" to a blob.
+HASH_CHUNK_SIZE = 1024 * 1024
+STALE_TEMP_FILE_AGE_S = 3600 # Older .tmp files are leftovers of interrupted writes, not uploads in progress
+
+class BlobStore:
+    def __init__(self, blob_dir=BLOB_DIR, index_file=DOCUMENTS_FILE):
+        self.blob_dir = blob_dir
+        self.index_file = index_file
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        index = load_json(self.index_file, {})
+        if not isinstance(index, dict):
+            index = {} # The file started out as an unused empty list
+        self.blobs = index.get("blobs", {}) # sha256 -> metadata
+        self.refs = index.get("refs", {}) # ref -> sha256
+        self._signature = file_signature(self.index_file)
+
+    def refresh(self):
+        # Picks up writes made by another process since the last load
+        if file_signature(self.index_file) != self._signature:
+            with self._lock:
+                self._load()
+
+    def _save(self):
+        write_json_atomic({"blobs": self.blobs, "refs": self.refs}, self.index_file)
+        self._signature = file_signature(self.index_file)
+
+    def path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def preview_path(self, digest):
+        # Cached PNG preview kept next to the blob (see hr_previews)
+        return self.path(digest) + ".preview.png"
+
+    def metadata(self, digest):
+        return self.blobs.get(digest)
+
+    def digest_for(self, ref):
+        return self.refs.get(ref)
+
+    def put(self, file_obj, name, ref, content_type=None):
+        # Streams `file_obj` into the store, hashing it chunk by chunk, and points
+        # `ref` at the result (releasing whatever it pointed at before).
+        # Returns the blob's SHA-256.
+        os.makedirs(self.blob_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            sha256 = digest.hexdigest()
+            with self._lock:
+                self.refresh()
+                blob_path = self.path(sha256)
+                if os.path.exists(blob_path):
+                    os.remove(temp_path) # Same content already stored
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(temp_path, blob_path)
+                metadata = self.blobs.setdefault(sha256, {
+                    "size": size,
+                    "content_type": content_type or mimetypes.guess_type(name)[0] or "application/octet-stream",
+                    "names": [],
+                    "refcount": 0,
+                    "created": datetime.now().isoformat(timespec="seconds"),
+                })
+                if name not in metadata["names"]:
+                    metadata["names"].append(name)
+                self._link(ref, sha256)
+                self._save()
+            return sha256
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def put_file(self, source_path, ref, name=None):
+        with open(source_path, "rb") as source:
+            return self.put(source, name or os.path.basename(source_path), ref)
+
+    def _link(self, ref, sha256):
+        previous = self.refs.get(ref)
+        if previous == sha256:
+            return
+        self.refs[ref] = sha256
+        self.blobs[sha256]["refcount"] += 1
+        if previous:
+            self._unlink_blob(previous)
+
+    def release(self, ref):
+        # Drops `ref`; the blob is deleted once nothing refers to it any more
+        with self._lock:
+            self.refresh()
+            sha256 = self.refs.pop(ref, None)
+            if sha256:
+                self._unlink_blob(sha256)
+                self._save()
+
+    def _unlink_blob(self, sha256):
+        metadata = self.blobs.get(sha256)
+        if metadata is None:
+            return
+        metadata["refcount"] -= 1
+        if metadata["refcount"] <= 0:
+            self._delete_blob(sha256)
+
+    def _delete_blob(self, sha256):
+        self.blobs.pop(sha256, None)
+        for path in (self.path(sha256), self.preview_path(sha256)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def reindex(self, live_refs=None, verify=False):
+        # Repairs the index against the records and the files on disk. With
+        # `live_refs` ({ref: sha256}, see live_document_refs) refs whose record is
+        # gone are dropped and refs records still point at are restored. Reference
+        # counts are then recounted, blobs nothing refers to are deleted, and so
+        # are files the index does not know. verify=True also re-hashes every blob.
+        # Returns counts of each repair, plus the digests of corrupt blobs.
+        report = Counter()
+        corrupt = []
+        with self._lock:
+            self.refresh()
+            if live_refs is not None:
+                for ref in [ref for ref in self.refs if ref not in live_refs]:
+                    del self.refs[ref]
+                    report["refs_dropped"] += 1
+                for ref, sha256 in live_refs.items():
+                    if self.refs.get(ref) != sha256 and sha256 in self.blobs:
+                        self.refs[ref] = sha256
+                        report["refs_restored"] += 1
+
+            for sha256 in [sha256 for sha256 in self.blobs if not os.path.exists(self.path(sha256))]:
+                self._delete_blob(sha256)
+                report["missing_blobs"] += 1
+            for ref in [ref for ref, sha256 in self.refs.items() if sha256 not in self.blobs]:
+                del self.refs[ref]
+                report["refs_dropped"] += 1
+
+            refcounts = Counter(self.refs.values())
+            for sha256, metadata in list(self.blobs.items()):
+                if metadata["refcount"] != refcounts[sha256]:
+                    metadata["refcount"] = refcounts[sha256]
+                    report["refcounts_fixed"] += 1
+                if not refcounts[sha256]:
+                    self._delete_blob(sha256)
+                    report["orphaned_blobs_deleted"] += 1
+                elif verify and _file_sha256(self.path(sha256)) != sha256:
+                    corrupt.append(sha256)
+
+            now = datetime.now().timestamp()
+            for directory, _, filenames in os.walk(self.blob_dir):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    if filename.endswith(".tmp"):
+                        if now - os.path.getmtime(path) > STALE_TEMP_FILE_AGE_S:
+                            os.remove(path)
+                            report["temp_files_deleted"] += 1
+                    elif filename.removesuffix(".preview.png") not in self.blobs:
+                        os.remove(path)
+                        report["unindexed_files_deleted"] += 1
+            self._save()
+        return {**report, "blobs": len(self.blobs), "refs": len(self.refs), "corrupt_blobs": corrupt}
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def document_ref(kind, record_id):
+    # Blob store ref for the document attached to a record, e.g. "leave:12"
+    return f"{kind}:{record_id}"
+
+def record_document_ref(kind, record, id_field, sha256=None):
+    # document_ref() for a record's document. Legacy records without an ID (old
+    # requisitions) are referenced by the document's hash instead; records holding
+    # the same file then share the ref, which stays live while any of them does.
+    record_id = record.get(id_field)
+    if record_id is None:
+        return document_ref(kind, f"sha256-{sha256 or record['document_sha256']}")
+    return document_ref(kind, record_id)
+
+def live_document_refs(leave_requests, opex_capex_requests=()):
+    # {ref: sha256} for every record that has a document in the blob store
+    live_refs = {}
+    for kind, id_field, records in (("leave", "request_id", leave_requests), ("opex", "req_id", opex_capex_requests)):
+        for record in records:
+            if record.get('document_sha256'):
+                live_refs[record_document_ref(kind, record, id_field)] = record['document_sha256']
+    return live_refs
+
+def migrate_legacy_documents(records, kind, id_field, blob_store):
+    # Moves documents saved under their upload name (e.g. leave_documents/x.pdf)
+    # into the blob store. The original files are left in place. Returns True
+    # when records were changed and need saving.
+    changed = False
+    for record in records:
+        legacy_path = record.get('document_path')
+        if not legacy_path or record.get('document_sha256'):
+            continue
+        legacy_path = legacy_path.replace("\\", "/") # Paths saved on Windows
+        if not os.path.exists(legacy_path):
+            continue
+        content_sha256 = _file_sha256(legacy_path) if record.get(id_field) is None else None
+        sha256 = blob_store.put_file(legacy_path, record_document_ref(kind, record, id_field, sha256=content_sha256))
+        record.update(document_path=blob_store.path(sha256), document_sha256=sha256,
+                      document_name=os.path.basename(legacy_path))
+        changed = True
+    return changed
+
+# --- Record Archive (Hot/Cold) ---
+# Closed records (decided leave, decided requisitions, payroll) older than a
+# cutoff move out of the hot JSON files, which every page load reads, into
+# gzipped monthly partitions: archive/<table>/<YYYY-MM>.json.gz, by the month
+# the record closed in. History views read partitions on demand.
+DEFAULT_ARCHIVE_AFTER_MONTHS = 12
+ARCHIVE_PERIOD_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+def _record_month(value):
+    # "YYYY-MM" of an ISO date, or None if it isn't one
+    try:
+        return date.fromisoformat(str(value)[:10]).strftime("%Y-%m")
+    except ValueError:
+        return None
+
+def _payroll_month(record):
+    try:
+        return f"{int(record['year']):04d}-{int(record['month']):02d}"
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# Table -> hot file, ID field, which records are closed, and the month they closed in.
+# Leave keeps the current calendar year hot: balances are counted per year.
+RECORD_ARCHIVE_TABLES = {
+    "leave": {
+        "file": LEAVE_REQUESTS_FILE, "id": "request_id", "keep_current_year": True,
+        "closed": lambda record: record.get('status') in ("Approved", "Rejected"),
+        "period": lambda record: _record_month(record.get('end_date')),
+    },
+    "opex-capex": {
+        "file": OPEX_CAPEX_REQUESTS_FILE, "id": "req_id", "keep_current_year": False,
+        "closed": lambda record: record.get('final_status') in ("Approved", "Rejected"),
+        "period": lambda record: _record_month(record.get('submission_date')),
+    },
+    "payroll": {
+        "file": PAYROLL_FILE, "id": "payslip_id", "keep_current_year": False,
+        "closed": lambda record: True,
+        "period": _payroll_month,
+    },
+}
+
+# Tables that are never archived but still allocate IDs through the high-water
+# mark, since deleting records (offboarding) would otherwise let IDs be reused
+ID_ALLOCATED_TABLES = {"goals": "goal_id", "appraisals": "appraisal_id"}
+
+def table_id_field(table):
+    if table in RECORD_ARCHIVE_TABLES:
+        return RECORD_ARCHIVE_TABLES[table]['id']
+    return ID_ALLOCATED_TABLES[table]
+
+def record_key(table, record):
+    # Identity for merging hot and archived copies; content hash for records without an ID
+    record_id = record.get(RECORD_ARCHIVE_TABLES[table]['id'])
+    if record_id is not None:
+        return str(record_id)
+    return "sha256:" + hashlib.sha256(json.dumps(record, cls=DateEncoder, sort_keys=True).encode("utf-8")).hexdigest()
+
+def max_record_id(records, id_field):
+    # Highest integer ID among the records (0 if none); rows without one are ignored
+    highest = 0
+    for record in records:
+        try:
+            highest = max(highest, int(record.get(id_field)))
+        except (TypeError, ValueError):
+            continue
+    return highest
+
+def _months_before(day, months):
+    month_index = day.year * 12 + day.month - 1 - months
+    return f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+
+_ID_HIGH_WATER_LOCK = threading.Lock()
+
+class RecordArchive:
+    def __init__(self, archive_dir=RECORD_ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self.high_water_file = os.path.join(archive_dir, "id_high_water.json")
+        self._lock = threading.Lock()
+
+    def partition_path(self, table, period):
+        if table not in RECORD_ARCHIVE_TABLES or not ARCHIVE_PERIOD_PATTERN.match(period or ""):
+            raise ValueError(f"Invalid archive partition: {table!r} {period!r}")
+        return os.path.join(self.archive_dir, table, f"{period}.json.gz")
+
+    def periods(self, table):
+        # Archived months of `table`, newest first
+        table_dir = os.path.join(self.archive_dir, table)
+        if not os.path.isdir(table_dir):
+            return []
+        periods = [name[:-len(".json.gz")] for name in os.listdir(table_dir) if name.endswith(".json.gz")]
+        return sorted((period for period in periods if ARCHIVE_PERIOD_PATTERN.match(period)), reverse=True)
+
+    def read(self, table, period):
+        try:
+            with gzip.open(self.partition_path(table, period), "rt", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+
+    def scan(self, table):
+        # (period, record) for every archived record of `table`, newest month first
+        for period in self.periods(table):
+            for record in self.read(table, period):
+                yield period, record
+
+    def summary(self):
+        # Per table: number of monthly partitions and their total compressed size
+        summary = {}
+        for table in RECORD_ARCHIVE_TABLES:
+            periods = self.periods(table)
+            size = sum(os.path.getsize(self.partition_path(table, period)) for period in periods)
+            summary[table] = {"partitions": len(periods), "oldest": periods[-1] if periods else None, "bytes": size}
+        return summary
+
+    def _write(self, table, period, records):
+        path = self.partition_path(table, period)
+        if not records:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as file:
+                file.write(json.dumps(records, cls=DateEncoder).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+
+    def add(self, table, records):
+        # Merges records into their monthly partitions; a record already there is replaced
+        period_of = RECORD_ARCHIVE_TABLES[table]['period']
+        by_period = {}
+        for record in records:
+            by_period.setdefault(period_of(record), []).append(record)
+        with self._lock:
+            for period, new_records in by_period.items():
+                merged = {record_key(table, record): record for record in self.read(table, period)}
+                merged.update((record_key(table, record), record) for record in new_records)
+                self._write(table, period, list(merged.values()))
+
+    def remove(self, table, period, records):
+        keys = {record_key(table, record) for record in records}
+        with self._lock:
+            self._write(table, period, [record for record in self.read(table, period) if record_key(table, record) not in keys])
+
+    # --- ID allocation ---
+    # Once records leave the hot file, max(hot) + 1 would hand out their IDs again.
+    # Each table keeps a high-water mark of every ID ever allocated or archived;
+    # a table without one (archived before marks were kept) is seeded from its partitions.
+    def _high_water_marks(self, table):
+        marks = load_json(self.high_water_file, {})
+        if table not in marks:
+            marks[table] = max_record_id((record for _, record in self.scan(table)), table_id_field(table))
+        return marks
+
+    def raise_high_water(self, table, records):
+        # Records the IDs of `records` (about to be archived) as used
+        with _ID_HIGH_WATER_LOCK:
+            marks = self._high_water_marks(table)
+            marks[table] = max(marks[table], max_record_id(records, table_id_field(table)))
+            write_json_atomic(marks, self.high_water_file)
+
+    def allocate_ids(self, table, hot_records, count=1):
+        # First of `count` consecutive new IDs for `table`, above every ID in
+        # `hot_records` and every ID previously allocated or archived
+        with _ID_HIGH_WATER_LOCK:
+            marks = self._high_water_marks(table)
+            first_id = max(marks[table], max_record_id(hot_records, table_id_field(table))) + 1
+            marks[table] = first_id + count - 1
+            write_json_atomic(marks, self.high_water_file)
+        return first_id
+
+def archive_closed_records(months=DEFAULT_ARCHIVE_AFTER_MONTHS, today=None, record_archive=None, dry_run=False, progress=None):
+    # Moves closed records from before the month `months` months ago out of the
+    # hot files into the record archive. Safe to re-run: archived copies are
+    # merged by record_key, so a crash between writing the archive and the hot
+    # file only leaves a duplicate that the next run clears up.
+    today = today or date.today()
+    record_archive = record_archive or RecordArchive()
+    cutoff = _months_before(today, months)
+    report = {"cutoff": cutoff, "dry_run": dry_run}
+    for step, (table, spec) in enumerate(RECORD_ARCHIVE_TABLES.items()):
+        table_cutoff = min(cutoff, f"{today.year:04d}-01") if spec['keep_current_year'] else cutoff
+        while True:
+            signature = file_signature(spec['file'])
+            hot, cold = [], []
+            for record in load_json(spec['file'], []):
+                period = spec['period'](record)
+                is_cold = spec['closed'](record) and period is not None and period < table_cutoff
+                (cold if is_cold else hot).append(record)
+            if dry_run or not cold:
+                break
+            record_archive.raise_high_water(table, cold)
+            record_archive.add(table, cold)
+            if file_signature(spec['file']) == signature: # Retry if the app saved the file meanwhile
+                write_json_atomic(hot, spec['file'])
+                break
+        report[table] = {"archived": len(cold), "kept_hot": len(hot)}
+        if progress:
+            progress((step + 1) / len(RECORD_ARCHIVE_TABLES), f"{table}: {len(cold)} record(s) archived")
+    return report